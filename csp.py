@@ -1,17 +1,23 @@
 """CSP (Constraint Satisfaction Problems) problems and solvers. (Chapter 6)"""
 
+import copy
 import itertools
+import multiprocessing
+import os
 import random
 import re
 import string
-from collections import defaultdict, Counter
-from functools import reduce
+import time
+from collections import defaultdict, deque, Counter
+from functools import lru_cache, partial, reduce
 from operator import eq, neg
+from queue import Empty
 
+import numpy as np
 from sortedcontainers import SortedSet
 
 import search
-from utils import argmin_random_tie, count, first, extend
+from utils import argmin_random_tie, count, first, extend, print_table
 
 
 class CSP(search.Problem):
@@ -42,6 +48,15 @@ class CSP(search.Problem):
                                 conflict with var=val
         curr_domains[var]       Slot: remaining consistent values for var
                                 Used by constraint propagation routines.
+                                A list, or a BitDomain if bitsets is true.
+        trail                   Slot: the (var, val) pairs pruned since the
+                                first push_level; pop_level undoes the ones
+                                pruned since the last push_level.
+        conflicts[var][val]     Slot: nconflicts(var, val) for one assignment,
+                                kept up to date by assign and unassign once
+                                support_conflict_counts has been called; and
+        conflicted              the list of its variables in conflict.
+                                Used by min_conflicts.
     The following methods are used only by graph_search and tree_search:
         actions(state)          Return a list of actions
         result(state, action)   Return a successor of state
@@ -60,11 +75,26 @@ class CSP(search.Problem):
         self.neighbors = neighbors
         self.constraints = constraints
         self.curr_domains = None
+        self.conflicts = None
+        self.tables = None
+        self.trail, self.levels = [], []
+        self.size_index = self.weights = self.wdeg = self.wiped = None
         self.nassigns = 0
 
     def assign(self, var, val, assignment):
         """Add {var: val} to assignment; Discard the old value if any."""
-        assignment[var] = val
+        if self.wdeg is not None and assignment is self.indexed and var not in assignment:
+            self.reweigh(var, -1)
+        if self.conflicts is not None and assignment is self.counted:
+            if var in assignment:
+                self.record_conflicts(var, assignment[var], -1)
+            assignment[var] = val
+            self.record_conflicts(var, val, +1)
+            self.mark_conflicted(var, self.conflicts[var][val] > 0)
+        else:
+            assignment[var] = val
+        if self.size_index is not None and assignment is self.indexed:
+            self.size_index[self.sizes[var]].discard(var)
         self.nassigns += 1
 
     def unassign(self, var, assignment):
@@ -72,10 +102,25 @@ class CSP(search.Problem):
         DO NOT call this if you are changing a variable to a new value;
         just call assign for that."""
         if var in assignment:
+            if self.conflicts is not None and assignment is self.counted:
+                self.record_conflicts(var, assignment[var], -1)
+                self.mark_conflicted(var, False)
             del assignment[var]
+            if self.size_index is not None and assignment is self.indexed:
+                self.size_index[self.sizes[var]].add(var)
+            if self.wdeg is not None and assignment is self.indexed:
+                self.reweigh(var, +1)
 
     def nconflicts(self, var, val, assignment):
         """Return the number of conflicts var=val has with other variables."""
+        if self.conflicts is not None and assignment is self.counted:
+            return self.conflicts[var][val]
+        if self.tables is not None:
+            index, rows = self.value_index, self.table_rows
+            i = index[var][val]
+            return count(var2 in assignment and
+                         not rows[var, var2][i] >> index[var2][assignment[var2]] & 1
+                         for var2 in self.neighbors[var])
 
         # Subclasses may implement this more efficiently
         def conflict(var2):
@@ -115,25 +160,125 @@ class CSP(search.Problem):
 
     # These are for constraint propagation
 
+    bitsets = False  # Set to True (on a class or an instance) for BitDomain curr_domains
+
     def support_pruning(self):
         """Make sure we can prune values from domains. (We want to pay
         for this only if we use it.)"""
         if self.curr_domains is None:
-            self.curr_domains = {v: list(self.domains[v]) for v in self.variables}
+            if self.bitsets:
+                indexes = {}  # Variables that share a domain (like the n queens) share its index
+                self.curr_domains = {}
+                for v in self.variables:
+                    domain = self.domains[v]
+                    if id(domain) not in indexes:
+                        indexes[id(domain)] = BitDomain(domain).index
+                    self.curr_domains[v] = BitDomain(domain, index=indexes[id(domain)])
+            else:
+                self.curr_domains = {v: list(self.domains[v]) for v in self.variables}
 
-    def suppose(self, var, value):
-        """Start accumulating inferences from assuming var=value."""
+    def suppose(self, var, value, removals=None):
+        """Start accumulating inferences from assuming var=value, in removals
+        (by default a new list), which is returned."""
         self.support_pruning()
-        removals = [(var, a) for a in self.curr_domains[var] if a != value]
-        self.curr_domains[var] = [value]
+        if removals is None:
+            removals = []
+        removals.extend((var, a) for a in self.curr_domains[var] if a != value)
+        if isinstance(self.curr_domains[var], BitDomain):
+            self.curr_domains[var][:] = [value]  # in place, to keep the BitDomain
+        else:
+            self.curr_domains[var] = [value]
+        if self.size_index is not None:
+            self.resize(var)
         return removals
 
     def prune(self, var, value, removals):
         """Rule out var=value."""
         self.curr_domains[var].remove(value)
+        if self.size_index is not None:
+            self.resize(var)
         if removals is not None:
             removals.append((var, value))
 
+    def prune_bits(self, var, bits, removals):
+        """Rule out the values of var with the given bits in its BitDomain."""
+        domain = self.curr_domains[var]
+        bits &= domain.bits
+        domain.bits ^= bits
+        domain.members = None
+        if self.size_index is not None:
+            self.resize(var)
+        if removals is not None:
+            removals.extend((var, b) for b in domain.values_of(bits))
+
+    def conflicting_bits(self, var, value, B):
+        """Return the bits of the values b in the BitDomain of B for which
+        var=value, B=b does not satisfy the constraints. Subclasses that know
+        their constraints may do better than this check of every b."""
+        domain = self.curr_domains[B]
+        if self.tables is not None:
+            # The table rows and the BitDomain share the order of domains[B]
+            return domain.bits & ~self.table_rows[var, B][self.value_index[var][value]]
+        if self.constraints is different_values_constraint:
+            return domain.bits & domain.bit(value) if value in domain.index else 0
+        return sum(domain.bit(b) for b in domain if not self.constraints(var, value, B, b))
+
+    def unsupported_bits(self, Xi, Xj):
+        """Return the bits of the values x in the BitDomain of Xi that
+        conflict with every value left for Xj (the ones revise removes)."""
+        Di, Dj = self.curr_domains[Xi], self.curr_domains[Xj].bits
+        if Dj and self.constraints is different_values_constraint:
+            # Only the one value left for Xj, if there is just one, is unsupported
+            return 0 if Dj & Dj - 1 else self.conflicting_bits(Xj, self.curr_domains[Xj][0], Xi)
+        return sum(Di.bit(x) for x in Di if self.conflicting_bits(Xi, x, Xj) == Dj)
+
+    def compile_constraints(self, cache=None):
+        """Tabulate the constraints over the (finite) domains, so that
+        revise, AC4 and nconflicts look them up instead of calling them:
+        tables[Xi, Xj][i, j] is constraints(Xi, x, Xj, y) for the ith value x
+        in domains[Xi] and the jth value y in domains[Xj]. Each row is also
+        packed into the bits of an int, in table_rows[Xi, Xj][i], as one
+        lookup then checks x against a whole domain of Xj; value_index[var]
+        maps each value of var to its position; and table_conflicts[Xi, Xj] is
+        the most values of Xj that any value of Xi conflicts with, so that
+        while Xj has more values left than that, every value of Xi has a
+        support and the arc need not be revised. Pass the same dict as cache
+        to CSPs with the same variables and constraints (like a batch of
+        Sudokus) to build the table for each arc and pair of domains once."""
+        self.value_index = {var: {val: i for i, val in enumerate(self.domains[var])}
+                            for var in self.variables}
+        self.tables, self.table_rows, self.table_conflicts = {}, {}, {}
+        for Xi in self.variables:
+            for Xj in self.neighbors[Xi]:
+                Di, Dj = tuple(self.domains[Xi]), tuple(self.domains[Xj])
+                key = (self.constraints, Xi, Xj, Di, Dj)
+                if cache is None or key not in cache:
+                    table = np.array([[self.constraints(Xi, x, Xj, y) for y in Dj] for x in Di],
+                                     dtype=bool).reshape(len(Di), len(Dj))
+                    rows = [sum(1 << int(j) for j in np.flatnonzero(row)) for row in table]
+                    conflicts = int((~table).sum(axis=1).max(initial=0))
+                    if cache is not None:
+                        cache[key] = table, rows, conflicts
+                else:
+                    table, rows, conflicts = cache[key]
+                self.tables[Xi, Xj], self.table_rows[Xi, Xj] = table, rows
+                self.table_conflicts[Xi, Xj] = conflicts
+
+    def value_bits(self, var, values):
+        """The bits, in the rows of the tables, of the given values of var."""
+        index = self.value_index[var]
+        return sum(1 << index[val] for val in values)
+
+    def recheck(self, Xi, Xj):
+        """Return the variables Xk whose arcs (Xk, Xi) AC3 must revise again
+        after revising (Xi, Xj) removed values of Xi. With compiled tables,
+        the arcs that cannot lose a value yet are left out."""
+        if self.tables is not None:
+            n = len(self.curr_domains[Xi])
+            return [Xk for Xk in self.neighbors[Xi]
+                    if Xk != Xj and n <= self.table_conflicts[Xk, Xi]]
+        return [Xk for Xk in self.neighbors[Xi] if Xk != Xj]
+
     def choices(self, var):
         """Return all values for var that aren't currently ruled out."""
         return (self.curr_domains or self.domains)[var]
@@ -148,14 +293,214 @@ class CSP(search.Problem):
         """Undo a supposition and all inferences from it."""
         for B, b in removals:
             self.curr_domains[B].append(b)
+            if self.size_index is not None:
+                self.resize(B)
+
+    def push_level(self):
+        """Start a new level on the trail. Pass the trail as the removals to
+        suppose, prune and the inference functions, and pop_level undoes
+        them all at once, without a new removals list for each level."""
+        self.support_pruning()
+        self.levels.append(len(self.trail))
+
+    def pop_level(self):
+        """Undo every prune recorded on the trail since the last push_level."""
+        level = self.levels.pop()
+        self.restore(self.trail[level:])
+        del self.trail[level:]
+
+    # These are for variable ordering
+
+    def support_variable_index(self, assignment):
+        """Start keeping the variables not in assignment in size_index, a
+        list of sets of them by the number of values left in curr_domains.
+        It is kept up to date as values are pruned and restored and variables
+        assigned and unassigned, so that indexed_mrv finds a variable with the
+        fewest values without counting them for every variable. If weights
+        (for dom_wdeg) are kept, so is wdeg, the weighted degree of each
+        variable: the sum of one plus the weight of each constraint with a
+        neighbor not in assignment."""
+        self.support_pruning()
+        self.indexed = assignment
+        self.sizes = {var: len(self.curr_domains[var]) for var in self.variables}
+        largest = max((len(self.domains[var]) for var in self.variables), default=0)
+        self.size_index = [set() for _ in range(largest + 1)]
+        for var in self.variables:
+            if var not in assignment:
+                self.size_index[self.sizes[var]].add(var)
+        if self.weights is not None:
+            self.wdeg = {var: sum(1 + self.weights[var][B]
+                                  for B in self.neighbors[var] if B not in assignment)
+                         for var in self.variables}
+
+    def resize(self, var):
+        """Move var to the set in size_index for the values it has left."""
+        size, old = len(self.curr_domains[var]), self.sizes[var]
+        if size != old:
+            self.sizes[var] = size
+            if var in self.size_index[old]:
+                self.size_index[old].remove(var)
+                self.size_index[size].add(var)
+
+    def reweigh(self, var, sign):
+        """Add (sign +1) or take away (sign -1) the constraints with var from
+        the weighted degrees of its neighbors, as it is unassigned or assigned."""
+        for B in self.neighbors[var]:
+            self.wdeg[B] += sign * (1 + self.weights[B][var])
+
+    def wipeout(self, Xi, Xj):
+        """Note that the constraint between Xi and Xj left Xi with no values;
+        backtracking_search with backjumping blames the failure on what
+        pruned them, and dom_wdeg weighs the constraints by these."""
+        self.wiped = Xi
+        if self.weights is not None:
+            self.weights[Xi][Xj] += 1
+            self.weights[Xj][Xi] += 1
+            if self.wdeg is not None:
+                self.wdeg[Xi] += Xj not in self.indexed
+                self.wdeg[Xj] += Xi not in self.indexed
 
     # This is for min_conflicts search
 
     def conflicted_vars(self, current):
         """Return a list of variables in current assignment that are in conflict"""
+        if self.conflicts is not None and current is self.counted:
+            return sorted(self.conflicted, key=self.position.__getitem__)
         return [var for var in self.variables
                 if self.nconflicts(var, current[var], current) > 0]
 
+    def support_conflict_counts(self, assignment):
+        """Start keeping conflicts[var][val], the number of variables assigned
+        in assignment that conflict with var=val, for every var and val in its
+        domain, and the list of conflicted variables. Each assign or unassign
+        on this assignment then updates the counts for the variables that
+        have var as a neighbor, with O(neighbors x domain size) constraint
+        checks, after which nconflicts is a lookup and conflicted_vars needs
+        no checks at all (it only sorts the conflicted variables into the
+        order of variables, as it lists them without the counts)."""
+        self.counted = assignment
+        self.conflicts = {var: dict.fromkeys(self.domains[var], 0) for var in self.variables}
+        self.conflicted, self.conflicted_index = [], {}
+        # to list the conflicted variables in order
+        self.position = {var: i for i, var in enumerate(self.variables)}
+        self.dependents = defaultdict(list)  # the variables that have var among their neighbors
+        for var in self.variables:
+            for B in self.neighbors[var]:
+                self.dependents[B].append(var)
+        for var, val in assignment.items():
+            self.record_conflicts(var, val, +1)
+        for var, val in assignment.items():
+            self.mark_conflicted(var, self.conflicts[var][val] > 0)
+
+    def record_conflicts(self, var, val, delta):
+        """Add delta to the counts of the values of other variables that
+        conflict with var=val."""
+        assignment = self.counted
+        for B in self.dependents[var]:
+            counts = self.conflicts[B]
+            for b in self.domains[B]:
+                if not self.constraints(B, b, var, val):
+                    counts[b] += delta
+            if B in assignment:
+                self.mark_conflicted(B, counts[assignment[B]] > 0)
+
+    def mark_conflicted(self, var, conflicted):
+        """Add var to, or remove it from, the conflicted list in O(1)."""
+        index = self.conflicted_index
+        if conflicted and var not in index:
+            index[var] = len(self.conflicted)
+            self.conflicted.append(var)
+        elif not conflicted and var in index:
+            last = self.conflicted.pop()
+            i = index.pop(var)
+            if last != var:
+                self.conflicted[i] = last
+                index[last] = i
+
+
+BINARY_DIGITS = bytes.maketrans(b'01', b'\x00\x01')
+
+
+class BitDomain:
+    """The current domain of a variable, held as the bits of a Python int
+    over its fixed tuple of initial values. It acts as the list used in
+    curr_domains by default (iteration, len, in, [i], [:], remove and
+    append), so every propagation routine works with either; but remove
+    and append (that is, prune and restore) clear or set one bit, and len
+    is a popcount. Values are kept, and iterated, in their initial order.
+    >>> d = BitDomain('123456789')
+    >>> d.remove('5'); len(d), '5' in d
+    (8, False)
+    >>> d.append('5'); d[4]
+    '5'
+    """
+
+    def __init__(self, values, bits=None, index=None):
+        self.values = tuple(values)
+        self.index = index or {v: i for i, v in enumerate(self.values)}
+        self.bits = (1 << len(self.values)) - 1 if bits is None else bits
+        self.members = None  # The list of values in bits, cached between changes
+
+    def copy(self):
+        domain = BitDomain(self.values, self.bits, self.index)
+        domain.members = self.members
+        return domain
+
+    def bit(self, value):
+        return 1 << self.index[value]
+
+    def remove(self, value):
+        bit = self.bit(value)
+        if not self.bits & bit:
+            raise ValueError('{!r} not in domain'.format(value))
+        self.bits ^= bit
+        self.members = None
+
+    def append(self, value):
+        self.bits |= self.bit(value)
+        self.members = None
+
+    def values_of(self, bits):
+        """The values whose bits are set in bits, in order."""
+        # The binary digits, lowest first, as bytes of 0 and 1 select the values
+        digits = bin(bits)[:1:-1].encode().translate(BINARY_DIGITS)
+        return list(itertools.compress(self.values, digits))
+
+    def tolist(self):
+        if self.members is None:
+            self.members = self.values_of(self.bits)
+        return self.members
+
+    def __len__(self):
+        return bin(self.bits).count('1')
+
+    def __bool__(self):
+        return self.bits != 0
+
+    def __contains__(self, value):
+        i = self.index.get(value)
+        return i is not None and self.bits >> i & 1 == 1
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def __getitem__(self, i):
+        if i == slice(None):
+            return self.copy()
+        return self.tolist()[i]
+
+    def __setitem__(self, i, values):
+        if i != slice(None):
+            raise TypeError('only a whole BitDomain can be assigned to')
+        self.bits = sum(map(self.bit, set(values)))
+        self.members = None
+
+    def __eq__(self, other):
+        return self.tolist() == list(other)
+
+    def __repr__(self):
+        return 'BitDomain({!r})'.format(self.tolist())
+
 
 # ______________________________________________________________________________
 # Constraint Propagation with AC3
@@ -174,6 +519,10 @@ def AC3(csp, queue=None, removals=None, arc_heuristic=dom_j_up):
     if queue is None:
         queue = {(Xi, Xk) for Xi in csp.variables for Xk in csp.neighbors[Xi]}
     csp.support_pruning()
+    if csp.tables is not None:
+        # Leave out the arcs that cannot lose a value yet (see recheck)
+        queue = {(Xi, Xj) for Xi, Xj in queue
+                 if len(csp.curr_domains[Xj]) <= csp.table_conflicts[Xi, Xj]}
     queue = arc_heuristic(csp, queue)
     checks = 0
     while queue:
@@ -181,16 +530,35 @@ def AC3(csp, queue=None, removals=None, arc_heuristic=dom_j_up):
         revised, checks = revise(csp, Xi, Xj, removals, checks)
         if revised:
             if not csp.curr_domains[Xi]:
+                csp.wipeout(Xi, Xj)
                 return False, checks  # CSP is inconsistent
-            for Xk in csp.neighbors[Xi]:
-                if Xk != Xj:
-                    queue.add((Xk, Xi))
+            for Xk in csp.recheck(Xi, Xj):
+                queue.add((Xk, Xi))
     return True, checks  # CSP is satisfiable
 
 
 def revise(csp, Xi, Xj, removals, checks=0):
-    """Return true if we remove a value."""
+    """Return true if we remove a value. With bitset domains the values are
+    revised a domain at a time with bit operations, whose checks are not
+    counted."""
     revised = False
+    if csp.bitsets:
+        unsupported = csp.unsupported_bits(Xi, Xj)
+        if unsupported:
+            csp.prune_bits(Xi, unsupported, removals)
+        return unsupported != 0, checks
+    if csp.tables is not None:
+        if len(csp.curr_domains[Xj]) > csp.table_conflicts[Xi, Xj]:
+            return False, checks  # Every value of Xi still has a support
+        # One lookup checks x against every value left for Xj
+        rows, index = csp.table_rows[Xi, Xj], csp.value_index[Xi]
+        Dj = csp.value_bits(Xj, csp.curr_domains[Xj])
+        for x in csp.curr_domains[Xi][:]:
+            checks += 1
+            if not rows[index[x]] & Dj:
+                csp.prune(Xi, x, removals)
+                revised = True
+        return revised, checks
     for x in csp.curr_domains[Xi][:]:
         # If Xi=x conflicts with Xj=y for every possible y, eliminate Xi=x
         # if all(not csp.constraints(Xi, x, Xj, y) for y in csp.curr_domains[Xj]):
@@ -211,6 +579,10 @@ def revise(csp, Xi, Xj, removals, checks=0):
 # of AC3 with double-support domain-heuristic
 
 def AC3b(csp, queue=None, removals=None, arc_heuristic=dom_j_up):
+    if csp.bitsets:
+        # The double-support checks save constraint checks shared by the two
+        # arcs, but bitset domains are revised without any; so use AC3
+        return AC3(csp, queue, removals, arc_heuristic)
     if queue is None:
         queue = {(Xi, Xk) for Xi in csp.variables for Xk in csp.neighbors[Xi]}
     csp.support_pruning()
@@ -223,6 +595,7 @@ def AC3b(csp, queue=None, removals=None, arc_heuristic=dom_j_up):
         # Dj - Sj_p = Sj_u values are unknown, as yet, to be supported by Xi
         Si_p, Sj_p, Sj_u, checks = partition(csp, Xi, Xj, checks)
         if not Si_p:
+            csp.wipeout(Xi, Xj)
             return False, checks  # CSP is inconsistent
         revised = False
         for x in set(csp.curr_domains[Xi]) - Si_p:
@@ -238,8 +611,9 @@ def AC3b(csp, queue=None, removals=None, arc_heuristic=dom_j_up):
                 queue.difference_update({(Xj, Xi)})
             else:
                 queue.difference_update((Xj, Xi))
-            # the elements in D_j which are supported by Xi are given by the union of Sj_p with the set of those
-            # elements of Sj_u which further processing will show to be supported by some vi_p in Si_p
+            # the elements in D_j which are supported by Xi are given by the union of Sj_p with
+            # the set of those elements of Sj_u which further processing will show to be
+            # supported by some vi_p in Si_p
             for vj_p in Sj_u:
                 for vi_p in Si_p:
                     conflict = True
@@ -307,25 +681,44 @@ def AC4(csp, queue=None, removals=None, arc_heuristic=dom_j_up):
     while queue:
         (Xi, Xj) = queue.pop()
         revised = False
+        if csp.tables is not None and not csp.bitsets:
+            rows, index = csp.table_rows[Xi, Xj], csp.value_index[Xi]
+            Dj = [(y, csp.value_index[Xj][y]) for y in csp.curr_domains[Xj]]
+            Dj_bits = sum(1 << j for y, j in Dj)
         for x in csp.curr_domains[Xi][:]:
-            for y in csp.curr_domains[Xj]:
-                if csp.constraints(Xi, x, Xj, y):
+            if csp.bitsets:
+                # The supports of x are the values of Xj it does not conflict with
+                supports = csp.curr_domains[Xj].bits & ~csp.conflicting_bits(Xi, x, Xj)
+                for y in csp.curr_domains[Xj].values_of(supports):
                     support_counter[(Xi, x, Xj)] += 1
                     variable_value_pairs_supported[(Xj, y)].add((Xi, x))
+            elif csp.tables is not None:
+                supports = rows[index[x]] & Dj_bits
                 checks += 1
+                support_counter[(Xi, x, Xj)] += bin(supports).count('1')
+                for y, j in Dj:
+                    if supports >> j & 1:
+                        variable_value_pairs_supported[(Xj, y)].add((Xi, x))
+            else:
+                for y in csp.curr_domains[Xj]:
+                    if csp.constraints(Xi, x, Xj, y):
+                        support_counter[(Xi, x, Xj)] += 1
+                        variable_value_pairs_supported[(Xj, y)].add((Xi, x))
+                    checks += 1
             if support_counter[(Xi, x, Xj)] == 0:
                 csp.prune(Xi, x, removals)
                 revised = True
                 unsupported_variable_value_pairs.append((Xi, x))
         if revised:
             if not csp.curr_domains[Xi]:
+                csp.wipeout(Xi, Xj)
                 return False, checks  # CSP is inconsistent
     # propagation of removed values
     while unsupported_variable_value_pairs:
         Xj, y = unsupported_variable_value_pairs.pop()
         for Xi, x in variable_value_pairs_supported[(Xj, y)]:
             revised = False
-            if x in csp.curr_domains[Xi][:]:
+            if x in csp.curr_domains[Xi]:
                 support_counter[(Xi, x, Xj)] -= 1
                 if support_counter[(Xi, x, Xj)] == 0:
                     csp.prune(Xi, x, removals)
@@ -333,6 +726,7 @@ def AC4(csp, queue=None, removals=None, arc_heuristic=dom_j_up):
                     unsupported_variable_value_pairs.append((Xi, x))
             if revised:
                 if not csp.curr_domains[Xi]:
+                    csp.wipeout(Xi, Xj)
                     return False, checks  # CSP is inconsistent
     return True, checks  # CSP is satisfiable
 
@@ -354,6 +748,34 @@ def mrv(assignment, csp):
                              key=lambda var: num_legal_values(csp, var, assignment))
 
 
+def indexed_mrv(assignment, csp):
+    """Minimum-remaining-values heuristic, ties broken by degree (the most
+    neighbors) and then at random, found in the index of the unassigned
+    variables by domain size that support_variable_index keeps, rather than
+    by counting the values of each one. For use with an inference that
+    prunes domains."""
+    if csp.size_index is None or assignment is not csp.indexed:
+        csp.support_variable_index(assignment)
+    for variables in csp.size_index:
+        if variables:
+            return argmin_random_tie(variables, key=lambda var: -len(csp.neighbors[var]))
+
+
+def dom_wdeg(assignment, csp):
+    """Conflict-directed variable ordering (Boussemart et al., 2004): the
+    variable with the fewest legal values per weighted degree, where each
+    constraint with another unassigned variable weighs one more than the
+    number of times it has wiped out a domain in inference so far. The
+    unassigned variables, their domain sizes and weighted degrees are those
+    support_variable_index keeps up to date, so that none is counted here."""
+    if csp.weights is None:
+        csp.weights = defaultdict(Counter)
+    if csp.wdeg is None or assignment is not csp.indexed:
+        csp.support_variable_index(assignment)
+    return argmin_random_tie([var for variables in csp.size_index for var in variables],
+                             key=lambda var: csp.sizes[var] / max(csp.wdeg[var], 1))
+
+
 def num_legal_values(csp, var, assignment):
     if csp.curr_domains:
         return len(csp.curr_domains[var])
@@ -374,6 +796,17 @@ def lcv(var, assignment, csp):
     return sorted(csp.choices(var), key=lambda val: csp.nconflicts(var, val, assignment))
 
 
+def indexed_lcv(var, assignment, csp):
+    """Least-constraining-values heuristic, with the conflicts of each value
+    kept up to date by support_conflict_counts as variables are assigned,
+    so that each is a lookup (unless the CSP counts conflicts in its own
+    nconflicts, as NQueensCSP does)."""
+    if type(csp).nconflicts is CSP.nconflicts and (csp.conflicts is None or
+                                                   assignment is not csp.counted):
+        csp.support_conflict_counts(assignment)
+    return lcv(var, assignment, csp)
+
+
 # Inference
 
 
@@ -386,10 +819,17 @@ def forward_checking(csp, var, value, assignment, removals):
     csp.support_pruning()
     for B in csp.neighbors[var]:
         if B not in assignment:
+            if csp.bitsets:
+                csp.prune_bits(B, csp.conflicting_bits(var, value, B), removals)
+                if not csp.curr_domains[B]:
+                    csp.wipeout(B, var)
+                    return False
+                continue
             for b in csp.curr_domains[B][:]:
                 if not csp.constraints(var, value, B, b):
                     csp.prune(B, b, removals)
             if not csp.curr_domains[B]:
+                csp.wipeout(B, var)
                 return False
     return True
 
@@ -399,12 +839,176 @@ def mac(csp, var, value, assignment, removals, constraint_propagation=AC3b):
     return constraint_propagation(csp, {(X, var) for X in csp.neighbors[var]}, removals)
 
 
+# Nogood learning
+
+
+class NogoodStore:
+    """Nogoods learned by backtracking_search: lists of (variable, value)
+    pairs that cannot all hold in a solution. Each nogood watches two of its
+    pairs that do not hold, so that only the nogoods watching a pair are
+    visited when it is assigned; when all the pairs of a nogood but one
+    hold, the value of that one is pruned. To bound memory, at most
+    max_literals pairs are kept over all the nogoods: past that, the least
+    used are evicted (those that pruned the fewest values, oldest first)
+    down to half of it. Nogoods of more than max_length pairs are not kept."""
+
+    def __init__(self, max_literals=100000, max_length=None):
+        self.max_literals, self.max_length = max_literals, max_length
+        self.nogoods = {}  # {frozenset of pairs: list of them, the first two watched}
+        self.watches = defaultdict(list)
+        self.hits = Counter()
+        self.literals = self.learned = self.evicted = 0
+
+    def __len__(self):
+        return len(self.nogoods)
+
+    def add(self, literals):
+        """Learn the nogood of the (variable, value) pairs in literals, which
+        should come in the order they will be undone, so that the first two
+        are watched."""
+        key = frozenset(literals)
+        if not key or key in self.nogoods or (self.max_length is not None and
+                                              len(key) > self.max_length):
+            return
+        self.nogoods[key] = literals = list(literals)
+        for literal in literals[:2]:
+            self.watches[literal].append(key)
+        self.literals += len(literals)
+        self.learned += 1
+        if self.literals > self.max_literals:
+            self.evict()
+
+    def evict(self):
+        """Drop the least used nogoods, oldest first, down to half of
+        max_literals pairs, and watch the ones left afresh."""
+        for key in sorted(self.nogoods, key=lambda key: self.hits[key]):
+            if self.literals <= self.max_literals // 2:
+                break
+            self.literals -= len(self.nogoods.pop(key))
+            self.hits.pop(key, None)
+            self.evicted += 1
+        self.watches = defaultdict(list)
+        for key, literals in self.nogoods.items():
+            for literal in literals[:2]:
+                self.watches[literal].append(key)
+
+    def propagate(self, csp, var, value, assignment, removals, reasons):
+        """Now that var=value holds, prune the values ruled out by the
+        nogoods watching it, recording in reasons the other variables of the
+        nogood as the reason for each. Return False if that leaves a
+        variable with no values, or a nogood holds."""
+        watching = self.watches[(var, value)]
+        i = 0
+        while i < len(watching):
+            key = watching[i]
+            literals = self.nogoods[key]
+            if len(literals) == 1:
+                return False
+            if literals[0] == (var, value):
+                literals[0], literals[1] = literals[1], literals[0]
+            for k in range(2, len(literals)):
+                X, x = literals[k]
+                if X not in assignment or assignment[X] != x:
+                    literals[1], literals[k] = literals[k], literals[1]
+                    self.watches[literals[1]].append(key)
+                    watching[i] = watching[-1]
+                    watching.pop()
+                    break
+            else:
+                i += 1
+                X, x = literals[0]
+                if X in assignment:
+                    if assignment[X] == x:
+                        return False
+                elif x in csp.curr_domains[X]:
+                    csp.prune(X, x, removals)
+                    reasons[(X, x)] = {Y for Y, _ in literals if Y != X}
+                    self.hits[key] += 1
+                    if not csp.curr_domains[X]:
+                        csp.wiped = X
+                        return False
+        return True
+
+
 # The search, proper
 
 
 def backtracking_search(csp, select_unassigned_variable=first_unassigned_variable,
-                        order_domain_values=unordered_domain_values, inference=no_inference):
-    """[Figure 6.5]"""
+                        order_domain_values=unordered_domain_values, inference=no_inference,
+                        trail=True, backjumping=False, nogoods=None):
+    """[Figure 6.5]
+    The values pruned for each assignment are recorded on csp.trail and
+    undone with pop_level; pass trail=False to collect them in a new removals
+    list for each assignment instead, and undo them with restore.
+    With backjumping, conflict-directed backjumping (Prosser, 1993): each
+    variable gathers the conflict set of the assigned variables that ruled
+    out its values, and when it runs out of values the search jumps back to
+    the last of them, rather than to the variable assigned just before it.
+    Values pruned by forward_checking are blamed on the variable assigned,
+    and by any other inference on all the variables assigned.
+    If nogoods is a NogoodStore, the conflict sets are also learned into it
+    (which turns on backjumping), and its nogoods prune values as variables
+    are assigned."""
+    if nogoods is not None:
+        backjumping = True
+        csp.support_pruning()
+    reasons = {}
+
+    def culprits(var):
+        """The assigned variables that ruled out the values var has lost."""
+        if not csp.curr_domains:
+            return set()
+        left = set(csp.curr_domains[var])
+        return set().union(*(reasons.get((var, a), ()) for a in csp.domains[var] if a not in left))
+
+    def backjump(assignment):
+        if len(assignment) == len(csp.variables):
+            return assignment, None
+        var = select_unassigned_variable(assignment, csp)
+        conflicts = culprits(var)
+        for value in order_domain_values(var, assignment, csp):
+            if 0 != csp.nconflicts(var, value, assignment):
+                conflicts.update(B for B in csp.neighbors[var] if B in assignment and
+                                 not csp.constraints(var, value, B, assignment[B]))
+                continue
+            csp.assign(var, value, assignment)
+            if trail:
+                csp.push_level()
+                removals = csp.suppose(var, value, csp.trail)
+            else:
+                removals = csp.suppose(var, value)
+            mark, csp.wiped = len(removals), None
+            consistent = inference(csp, var, value, assignment, removals)
+            blame = {var} if inference is forward_checking else set(assignment)
+            for pruned in removals[mark:]:
+                reasons[pruned] = blame
+            if consistent and nogoods is not None:
+                consistent = nogoods.propagate(csp, var, value, assignment, removals, reasons)
+            if consistent:
+                result, jump = backjump(assignment)
+                if result is not None:
+                    return result, None
+                if var not in jump:
+                    if trail:
+                        csp.pop_level()
+                    else:
+                        csp.restore(removals)
+                    csp.unassign(var, assignment)
+                    return None, jump
+                conflicts |= jump
+            else:
+                conflicts |= set(assignment) if csp.wiped is None else culprits(csp.wiped)
+            if trail:
+                csp.pop_level()
+            else:
+                csp.restore(removals)
+        conflicts.discard(var)
+        csp.unassign(var, assignment)
+        if nogoods is not None:
+            depth = {X: i for i, X in enumerate(assignment)}
+            nogoods.add(sorted(((X, assignment[X]) for X in conflicts),
+                               key=lambda pair: -depth[pair[0]]))
+        return None, conflicts
 
     def backtrack(assignment):
         if len(assignment) == len(csp.variables):
@@ -413,16 +1017,23 @@ def backtracking_search(csp, select_unassigned_variable=first_unassigned_variabl
         for value in order_domain_values(var, assignment, csp):
             if 0 == csp.nconflicts(var, value, assignment):
                 csp.assign(var, value, assignment)
-                removals = csp.suppose(var, value)
+                if trail:
+                    csp.push_level()
+                    removals = csp.suppose(var, value, csp.trail)
+                else:
+                    removals = csp.suppose(var, value)
                 if inference(csp, var, value, assignment, removals):
                     result = backtrack(assignment)
                     if result is not None:
                         return result
-                csp.restore(removals)
+                if trail:
+                    csp.pop_level()
+                else:
+                    csp.restore(removals)
         csp.unassign(var, assignment)
         return None
 
-    result = backtrack({})
+    result = backjump({})[0] if backjumping else backtrack({})
     assert result is None or csp.goal_test(result)
     return result
 
@@ -431,10 +1042,18 @@ def backtracking_search(csp, select_unassigned_variable=first_unassigned_variabl
 # Min-conflicts Hill Climbing search for CSPs
 
 
-def min_conflicts(csp, max_steps=100000):
-    """Solve a CSP by stochastic Hill Climbing on the number of conflicts."""
+def min_conflicts(csp, max_steps=100000, incremental=None):
+    """Solve a CSP by stochastic Hill Climbing on the number of conflicts.
+    If incremental (by default, when the CSP does not count conflicts in its
+    own nconflicts, as NQueensCSP does), conflict counts are kept up to date
+    with support_conflict_counts, so that a step costs O(neighbors x domain
+    size) constraint checks instead of O(variables x neighbors)."""
     # Generate a complete assignment for all variables (probably with conflicts)
     csp.current = current = {}
+    if incremental is None:
+        incremental = type(csp).nconflicts is CSP.nconflicts
+    if incremental:
+        csp.support_conflict_counts(current)
     for var in csp.variables:
         val = min_conflicts_value(csp, var, current)
         csp.assign(var, val, current)
@@ -686,6 +1305,36 @@ class NQueensCSP(CSP):
             self.record_conflict(assignment, var, assignment[var], -1)
         CSP.unassign(self, var, assignment)
 
+    def conflicting_bits(self, var, value, B):
+        """The same row and the two diagonals, where they meet column B;
+        the values in a BitDomain here are the bits themselves."""
+        if B == var:
+            return 0
+        d = abs(B - var)
+        bits = 1 << value | 1 << value + d | (1 << value - d if value >= d else 0)
+        return bits & self.curr_domains[B].bits
+
+    def unsupported_bits(self, Xi, Xj):
+        """Xi=x conflicts with at most 3 values of Xj, so it can lose its
+        support only when Xj has 3 or fewer values left, and then only if
+        it is in conflict with one of them."""
+        Dj = self.curr_domains[Xj]
+        if len(Dj) > 3 or Xi == Xj:
+            return 0
+        if not Dj:
+            return self.curr_domains[Xi].bits
+        candidates = reduce(int.__or__, (self.conflicting_bits(Xj, y, Xi) for y in Dj))
+        return sum(1 << x for x in self.curr_domains[Xi].values_of(candidates)
+                   if self.conflicting_bits(Xi, x, Xj) == Dj.bits)
+
+    def recheck(self, Xi, Xj):
+        """A queen in column Xi attacks at most 3 squares of any other column,
+        so every value of Xk still has a support in Xi while Xi has more than
+        3 values left. (Otherwise every column is a neighbor of Xi.)"""
+        if len(self.curr_domains[Xi]) > 3:
+            return []
+        return CSP.recheck(self, Xi, Xj)
+
     def record_conflict(self, assignment, var, val, delta):
         """Record conflicts caused by addition or deletion of a Queen."""
         n = len(self.variables)
@@ -732,8 +1381,9 @@ _BGRID = [[[[_CELL() for x in _R3] for y in _R3] for bx in _R3] for by in _R3]
 _BOXES = flatten([list(map(flatten, brow)) for brow in _BGRID])
 _ROWS = flatten([list(map(flatten, zip(*brow))) for brow in _BGRID])
 _COLS = list(zip(*_ROWS))
+_SQUARES = flatten(_ROWS)
 
-_NEIGHBORS = {v: set() for v in flatten(_ROWS)}
+_NEIGHBORS = {v: set() for v in _SQUARES}
 for unit in map(set, _BOXES + _ROWS + _COLS):
     for v in unit:
         _NEIGHBORS[v].update(unit - {v})
@@ -783,6 +1433,7 @@ class Sudoku(CSP):
     boxes = _BOXES
     rows = _ROWS
     cols = _COLS
+    squares = _SQUARES
     neighbors = _NEIGHBORS
 
     def __init__(self, grid):
@@ -791,7 +1442,7 @@ class Sudoku(CSP):
         other characters are ignored."""
         squares = iter(re.findall(r'\d|\.', grid))
         domains = {var: [ch] if ch in '123456789' else '123456789'
-                   for var, ch in zip(flatten(self.rows), squares)}
+                   for var, ch in zip(self.squares, squares)}
         for _ in squares:
             raise ValueError("Not a Sudoku grid", grid)  # Too many squares
         CSP.__init__(self, None, domains, self.neighbors, different_values_constraint)
@@ -970,6 +1621,7 @@ def is_word_constraint(words):
     def isw(*letters):
         return "".join(letters) in words
 
+    isw.words = words
     return isw
 
 
@@ -995,6 +1647,7 @@ def sum_constraint(n):
         return sum(values) is n
 
     sumv.__name__ = str(n) + "==sum"
+    sumv.total = n
     return sumv
 
 
@@ -1198,6 +1851,459 @@ def ac_search_solver(csp, arc_heuristic=sat_up):
         return {var: first(solution[var]) for var in solution}
 
 
+class GACSolver(ACSolver):
+    """An ACSolver whose GAC revises all the variables of a constraint at
+    once, with a propagator chosen for the constraint up front: matching
+    for all_diff_constraint (Regin, 1994); bounds reasoning for
+    sum_constraint; simple tabular reduction (STR, Ullmann, 2007) over a
+    table of the tuples allowed, for is_word_constraint and for any other
+    constraint with at most max_table tuples over its domains; and
+    otherwise a search for supports, starting from residual supports
+    (GAC3rm, Lecoutre and Hemery, 2007) remembered across calls."""
+
+    def __init__(self, csp, max_table=10000):
+        super().__init__(csp)
+        self.max_table = max_table
+        self.tables = {}
+        self.residues = {}
+        self.propagators = {const: self.propagator(const) for const in csp.constraints}
+
+    def propagator(self, const):
+        """Choose the propagator for const, compiling its table if it has one."""
+        if const.condition is all_diff_constraint:
+            return self.all_diff
+        if hasattr(const.condition, 'total'):
+            return self.sum_bounds
+        words = getattr(const.condition, 'words', None)
+        if words is not None:
+            self.tables[const] = [tuple(word) for word in words if len(word) == len(const.scope)]
+            return self.tabular_reduction
+        domains = [self.csp.domains[var] for var in const.scope]
+        if reduce(lambda size, domain: size * len(domain), domains, 1) <= self.max_table:
+            self.tables[const] = [values for values in itertools.product(*domains)
+                                  if const.condition(*values)]
+            return self.tabular_reduction
+        return self.residual_supports
+
+    def GAC(self, orig_domains=None, to_do=None, arc_heuristic=sat_up):
+        """Like ACSolver.GAC, but a (var, const) pair taken from to_do
+        revises every variable in the scope of const, with its propagator,
+        and the other pairs of const are dropped from to_do."""
+        if orig_domains is None:
+            orig_domains = self.csp.domains
+        if to_do is None:
+            to_do = {(var, const) for const in self.csp.constraints for var in const.scope}
+        else:
+            to_do = to_do.copy()
+        domains = {var: set(domain) for var, domain in orig_domains.items()}
+        to_do = arc_heuristic(to_do)
+        tables = {}  # the tuples of each table still valid in this call
+        checks = 0
+        while to_do:
+            _, const = to_do.pop()
+            for var in const.scope:
+                to_do.discard((var, const))
+            revised, checks = self.propagators[const](domains, const, tables, checks)
+            if revised is None:
+                return False, domains, checks
+            for var in revised:
+                to_do |= self.new_to_do(var, const).difference(to_do)
+        return True, domains, checks
+
+    @staticmethod
+    def narrow(domains, scope, supported):
+        """Cut the domain of each variable in scope down to its values in
+        supported; return the variables cut, or None if one is left empty."""
+        revised = set()
+        for var, values in zip(scope, supported):
+            if len(values) < len(domains[var]):
+                if not values:
+                    return None
+                domains[var] = domains[var] & values
+                revised.add(var)
+        return revised
+
+    def tabular_reduction(self, domains, const, tables, checks):
+        """Drop the tuples of the table of const with a value no longer in
+        its domain; the values left in the tuples are those supported."""
+        scope = const.scope
+        table = tables.get(const, self.tables[const])
+        checks += len(table)
+        tables[const] = table = [values for values in table
+                                 if all(value in domains[var] for var, value in zip(scope, values))]
+        supported = [set(column) for column in zip(*table)] if table else [set() for _ in scope]
+        return self.narrow(domains, scope, supported), checks
+
+    def all_diff(self, domains, const, tables, checks):
+        """Prune the values that are in no maximum matching of the variables
+        of const to their values: those matched in one, those on an
+        alternating cycle and those on an alternating path to a free value."""
+        scope = const.scope
+        match = {}  # {value: variable}
+
+        def augment(var, seen):
+            for value in domains[var]:
+                if value not in seen:
+                    seen.add(value)
+                    if value not in match or augment(match[value], seen):
+                        match[value] = var
+                        return True
+            return False
+
+        for var in scope:
+            checks += 1
+            if not augment(var, set()):
+                return None, checks
+        # Nodes are (0, variable) and (1, value); a variable points to its other
+        # values and a value to the variable it is matched to
+        matched = {var: value for value, var in match.items()}
+        edges = {(0, var): [(1, value) for value in domains[var] if value != matched[var]]
+                 for var in scope}
+        values = set().union(*(domains[var] for var in scope))
+        edges.update({(1, value): [(0, match[value])] if value in match else []
+                      for value in values})
+        # The nodes that can reach a free value
+        reach = {(1, value) for value in values if value not in match}
+        frontier = list(reach)
+        while frontier:
+            node = frontier.pop()
+            for var in scope:
+                if (0, var) not in reach and node in edges[(0, var)]:
+                    reach |= {(0, var), (1, matched[var])}
+                    frontier.append((1, matched[var]))
+        component = strongly_connected_components(edges)
+        supported = [{value for value in domains[var]
+                      if value == matched[var] or (1, value) in reach or
+                      component[(0, var)] == component[(1, value)]} for var in scope]
+        return self.narrow(domains, scope, supported), checks
+
+    def sum_bounds(self, domains, const, tables, checks):
+        """Prune the values of each variable of const outside the bounds left
+        for it by the smallest and largest sums of the others, to a fixpoint."""
+        scope, total = const.scope, const.condition.total
+        revised = set()
+        while True:
+            lows, highs = [min(domains[var]) for var in scope], [max(domains[var]) for var in scope]
+            low, high = sum(lows), sum(highs)
+            checks += len(scope)
+            for i, var in enumerate(scope):
+                least, most = total - (high - highs[i]), total - (low - lows[i])
+                if lows[i] < least or highs[i] > most:
+                    domains[var] = {value for value in domains[var] if least <= value <= most}
+                    if not domains[var]:
+                        return None, checks
+                    revised.add(var)
+                    break
+            else:
+                return revised, checks
+
+    def residual_supports(self, domains, const, tables, checks):
+        """Keep the values of each variable of const with a support: its
+        residue (the last support found for it) if that is still valid, or
+        else the first tuple over the domains that satisfies const, which
+        becomes the residue of each of its values. Repeat to a fixpoint."""
+        scope = const.scope
+        revised, changed = set(), True
+        while changed:
+            changed = False
+            for i, var in enumerate(scope):
+                supported = set()
+                for value in domains[var]:
+                    residue = self.residues.get((const, i, value))
+                    if residue is not None and all(v in domains[x] for x, v in zip(scope, residue)):
+                        supported.add(value)
+                        continue
+                    others = [domains[x] if j != i else [value] for j, x in enumerate(scope)]
+                    for values in itertools.product(*others):
+                        checks += 1
+                        if const.condition(*values):
+                            supported.add(value)
+                            for j, v in enumerate(values):
+                                self.residues[(const, j, v)] = values
+                            break
+                if len(supported) < len(domains[var]):
+                    if not supported:
+                        return None, checks
+                    domains[var] = supported
+                    revised.add(var)
+                    changed = True
+        return revised, checks
+
+
+def strongly_connected_components(edges):
+    """Find the strongly connected components of the directed graph with
+    edges {node: [successor, ...]} (Tarjan's algorithm); return a dict
+    mapping each node to the root node of its component."""
+    index, low, component, stack, on_stack = {}, {}, {}, [], set()
+
+    def visit(node):
+        index[node] = low[node] = len(index)
+        stack.append(node)
+        on_stack.add(node)
+        for successor in edges.get(node, ()):
+            if successor not in index:
+                visit(successor)
+                low[node] = min(low[node], low[successor])
+            elif successor in on_stack:
+                low[node] = min(low[node], index[successor])
+        if low[node] == index[node]:
+            while True:
+                member = stack.pop()
+                on_stack.discard(member)
+                component[member] = node
+                if member == node:
+                    break
+
+    for node in edges:
+        if node not in index:
+            visit(node)
+    return component
+
+
+def gac_solver(csp, arc_heuristic=sat_up):
+    """Generalized arc consistency with GACSolver's propagators (domain
+    splitting interface)"""
+    return GACSolver(csp).domain_splitting(arc_heuristic=arc_heuristic)
+
+
+# ______________________________________________________________________________
+# Parallel and portfolio CSP solving
+
+
+def csp_task_worker(solve, tasks, todo, results):
+    """Put (i, solve(tasks[i])) on results for each index i taken from the
+    todo queue, until a None."""
+    for i in iter(todo.get, None):
+        results.put((i, solve(tasks[i])))
+
+
+def first_solution(solve, tasks, processes=None, timeout=None):
+    """Return (i, solve(tasks[i])) for the first task that a pool of worker
+    processes finds a solution (a true result) for, and kill the workers.
+    The workers take the tasks from one queue whenever they are free, so a
+    worker that is done with an easy subtree takes on the next one while
+    the others are still busy. Return (None, None) if no task has a solution,
+    or if timeout seconds pass first. solve and tasks need to be picklable
+    only where the workers are spawned rather than forked."""
+    processes = min(processes or os.cpu_count(), len(tasks))
+    todo, results = multiprocessing.Queue(), multiprocessing.Queue()
+    for i in list(range(len(tasks))) + [None] * processes:
+        todo.put(i)
+    workers = [multiprocessing.Process(target=csp_task_worker, args=(solve, tasks, todo, results),
+                                       daemon=True)
+               for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    try:
+        for _ in tasks:
+            while True:
+                try:
+                    i, result = results.get(timeout=0.1)
+                    break
+                except Empty:
+                    if ((deadline is not None and time.monotonic() >= deadline) or
+                            not any(worker.is_alive() for worker in workers)):
+                        return None, None
+            if result:
+                return i, result
+        return None, None
+    finally:
+        for worker in workers:
+            worker.kill()
+            worker.join()
+
+
+def csp_cubes(csp, n):
+    """Split csp at shallow depth: return the assignments to the variables
+    with the fewest values, as few of them as give at least n assignments
+    with no conflicts among themselves. Every solution of csp extends one."""
+    cubes = [{}]
+    for var in sorted(csp.variables, key=lambda v: len(csp.choices(v))):
+        if len(cubes) >= n:
+            break
+        cubes = [extend(cube, var, val) for cube in cubes for val in csp.choices(var)
+                 if CSP.nconflicts(csp, var, val, cube) == 0]
+    return cubes
+
+
+def solve_cube(csp, select_unassigned_variable, order_domain_values, inference, cube):
+    """Run backtracking_search on a copy of csp with the current domain of
+    each variable in cube cut down to its value there (with suppose), or
+    return None if that value is already ruled out."""
+    csp = copy.deepcopy(csp)
+    csp.support_pruning()
+    for var, value in cube.items():
+        if value not in csp.curr_domains[var]:
+            return None
+        csp.suppose(var, value)
+    return backtracking_search(csp, select_unassigned_variable, order_domain_values, inference)
+
+
+def parallel_backtracking_search(csp, select_unassigned_variable=mrv,
+                                 order_domain_values=unordered_domain_values,
+                                 inference=forward_checking, processes=None, cubes_per_process=4):
+    """Cube and conquer: split the search tree of csp into (about) cubes_per_process
+    subtrees for each process with csp_cubes, and search them with
+    backtracking_search on a pool of processes (see first_solution). Return
+    the first solution found, or None."""
+    processes = processes or os.cpu_count()
+    cubes = csp_cubes(csp, processes * cubes_per_process)
+    solve = partial(solve_cube, csp, select_unassigned_variable, order_domain_values, inference)
+    return first_solution(solve, cubes, processes)[1] if cubes else None
+
+
+def run_strategy(csp, strategy):
+    """Run backtracking_search on a copy of csp with the strategy, a
+    (select_unassigned_variable, order_domain_values, inference) triple."""
+    return backtracking_search(copy.deepcopy(csp), *strategy)
+
+
+def portfolio_backtracking_search(csp, strategies=None, timeout=None):
+    """Race backtracking_search with each of the strategies (triples of
+    select_unassigned_variable, order_domain_values and inference), each in
+    its own process, and return (solution, strategy) for the first to find
+    a solution; the others are killed. (None, None) if none does, which is
+    known only when all have finished, or after timeout seconds."""
+    strategies = strategies or [
+        (first_unassigned_variable, unordered_domain_values, forward_checking),
+        (mrv, unordered_domain_values, forward_checking),
+        (mrv, lcv, mac),
+        (first_unassigned_variable, lcv, mac)]
+    i, solution = first_solution(partial(run_strategy, csp), strategies, len(strategies), timeout)
+    return solution, None if i is None else strategies[i]
+
+
+def nary_cubes(csp, n, arc_heuristic=sat_up):
+    """Split the NaryCSP like ACSolver.domain_splitting, but breadth first,
+    into at least n arc consistent sets of domains (if it can be split so
+    far); every solution of csp is in one of them."""
+    solver = ACSolver(csp)
+    consistent, domains, _ = solver.GAC(arc_heuristic=arc_heuristic)
+    cubes = [domains] if consistent else []
+    while 0 < len(cubes) < n:
+        split = []
+        for domains in cubes:
+            var = first(x for x in csp.variables if len(domains[x]) > 1)
+            if var is None:
+                split.append(domains)
+                continue
+            to_do = solver.new_to_do(var, None)
+            for dom in partition_domain(domains[var]):
+                consistent, new_domains, _ = solver.GAC(extend(domains, var, dom), to_do,
+                                                        arc_heuristic)
+                if consistent:
+                    split.append(new_domains)
+        if len(split) == len(cubes) and all(len(d) == 1 for domains in split
+                                            for d in domains.values()):
+            break  # Every cube is a solution
+        cubes = split
+    return cubes
+
+
+def split_cube(csp, arc_heuristic, domains):
+    return ACSolver(csp).domain_splitting(domains, None, arc_heuristic)
+
+
+def parallel_domain_splitting(csp, processes=None, cubes_per_process=4, arc_heuristic=sat_up):
+    """Solve the NaryCSP (like Kakuro or Crossword) with arc consistency and
+    domain splitting, splitting it first into (about) cubes_per_process
+    sets of domains for each process with nary_cubes, which a pool of
+    processes then search (see first_solution). Return a solution or False."""
+    processes = processes or os.cpu_count()
+    cubes = nary_cubes(csp, processes * cubes_per_process, arc_heuristic)
+    if not cubes:
+        return False
+    return first_solution(partial(split_cube, csp, arc_heuristic), cubes, processes)[1] or False
+
+
+@lru_cache(maxsize=None)
+def sudoku_template():
+    """An empty Sudoku with its constraints compiled (see compile_constraints),
+    made once in each process, for batch_sudoku to share among the puzzles
+    of a batch."""
+    template = Sudoku('.' * 81)
+    template.compile_constraints()
+    return template
+
+
+def batch_sudoku(grid):
+    """Make a Sudoku for grid that shares the domains and the constraint
+    tables of sudoku_template, with BitDomains for its curr_domains and its
+    filled cells narrowed down there (with suppose) rather than in domains,
+    so nothing is built for it but its curr_domains. Raise ValueError if
+    grid does not have 81 squares."""
+    template, sudoku = sudoku_template(), Sudoku(grid)
+    if len(sudoku.domains) != len(Sudoku.squares):
+        raise ValueError("Not a Sudoku grid", grid)  # Too few squares
+    filled = {var: domain[0] for var, domain in sudoku.domains.items() if len(domain) == 1}
+    sudoku.domains = template.domains
+    sudoku.tables, sudoku.table_rows = template.tables, template.table_rows
+    sudoku.table_conflicts, sudoku.value_index = template.table_conflicts, template.value_index
+    sudoku.bitsets = True
+    for var, val in filled.items():
+        sudoku.suppose(var, val)
+    return sudoku
+
+
+def solve_sudoku(grid, select_unassigned_variable=mrv, inference=mac):
+    """Solve the Sudoku grid (made with batch_sudoku) with AC3 and then
+    backtracking_search. Return its solution as a string of 81 digits, or
+    None if it has none, and the seconds that took."""
+    start = time.perf_counter()
+    sudoku, solution = batch_sudoku(grid), None
+    if AC3(sudoku)[0]:
+        solution = backtracking_search(sudoku, select_unassigned_variable, inference=inference)
+    if solution is not None:
+        solution = ''.join(solution[var] for var in Sudoku.squares)
+    return solution, time.perf_counter() - start
+
+
+def solve_sudoku_chunk(select_unassigned_variable, inference, grids):
+    """(grid, solution, seconds) for each grid (see solve_sudoku); the
+    solution of a grid that is not a Sudoku grid is None, so that one bad
+    line does not stop a batch."""
+    results = []
+    for grid in grids:
+        start = time.perf_counter()
+        try:
+            results.append((grid,) + solve_sudoku(grid, select_unassigned_variable, inference))
+        except ValueError:
+            results.append((grid, None, time.perf_counter() - start))
+    return results
+
+
+def solve_sudokus(puzzles, processes=None, chunksize=32, select_unassigned_variable=mrv,
+                  inference=mac):
+    """Solve the Sudoku grids in the iterable puzzles (such as the lines of a
+    file; blank ones are skipped) on a pool of processes, and yield (grid,
+    solution, seconds) for each, in order (see solve_sudoku_chunk). The puzzles
+    are sent to the processes chunksize at a time, and no more than two
+    chunks for each process are in flight, so a batch of any size streams
+    through in bounded memory."""
+    processes = processes or os.cpu_count()
+    grids = (line.strip() for line in puzzles if line.strip())
+    solve = partial(solve_sudoku_chunk, select_unassigned_variable, inference)
+    sudoku_template()  # So that forked processes share it
+    with multiprocessing.Pool(processes) as pool:
+        pending = deque()
+        for chunk in iter(lambda: list(itertools.islice(grids, chunksize)), []):
+            pending.append(pool.apply_async(solve, (chunk,)))
+            if len(pending) >= 2 * processes:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+
+
+def solve_sudoku_file(infile, outfile, processes=None, chunksize=32):
+    """Solve the Sudokus in the file named infile, one grid to a line, with
+    solve_sudokus, writing a line for each to the file named outfile: its
+    solution (or None) and the seconds it took, separated by a tab."""
+    with open(infile) as puzzles, open(outfile, 'w') as solutions:
+        for _, solution, seconds in solve_sudokus(puzzles, processes, chunksize):
+            print(solution, '{:.6f}'.format(seconds), sep='\t', file=solutions)
+
+
 # ______________________________________________________________________________
 # Crossword Problem
 
@@ -1433,3 +2539,227 @@ send_more_money = NaryCSP({'S': set(range(1, 10)), 'M': set(range(1, 10)),
                            Constraint(('E', 'O', 'N', 'C2', 'C3'), lambda e, o, n, c2, c3: c2 + e + o == n + 10 * c3),
                            Constraint(('S', 'M', 'O', 'C3', 'C4'), lambda s, m, o, c3, c4: c3 + s + m == o + 10 * c4),
                            Constraint(('M', 'C4'), eq)])
+
+
+# ______________________________________________________________________________
+# Comparing CSP solvers
+
+
+def compare_domain_representations(problems=None, seed=1):
+    """Print the seconds backtracking_search with mrv and mac takes on each
+    CSP with curr_domains as lists and as BitDomains. problems are functions
+    that make a fresh CSP; by default Sudoku(harder1) and two NQueensCSPs.
+    The same seed is used for both, so that the same search is timed."""
+    problems = problems or [lambda: Sudoku(harder1), lambda: NQueensCSP(30), lambda: NQueensCSP(60)]
+
+    def do(make, bitsets):
+        csp = make()
+        csp.bitsets = bitsets
+        random.seed(seed)
+        start = time.perf_counter()
+        backtracking_search(csp, select_unassigned_variable=mrv, inference=mac)
+        return '{:.3f}s, {} assigns'.format(time.perf_counter() - start, csp.nassigns)
+
+    print_table([['{} {}'.format(type(make()).__name__, len(make().variables)),
+                  do(make, False), do(make, True)] for make in problems],
+                ['CSP', 'Lists', 'Bitsets'])
+
+
+def compare_backtracking_undo(problems=None, inference=mac, repeat=10, seed=1):
+    """Print the nodes (assignments) per second of backtracking_search with
+    mrv and inference on each CSP, over repeat runs, undoing the pruning
+    with a removals list for each assignment and on csp.trail. problems are
+    functions that make a fresh CSP; by default Sudoku(harder1) and Zebra()."""
+    problems = problems or [lambda: Sudoku(harder1), Zebra]
+
+    def do(make, trail):
+        nodes = seconds = 0
+        for _ in range(repeat):
+            csp = make()
+            random.seed(seed)
+            start = time.perf_counter()
+            backtracking_search(csp, select_unassigned_variable=mrv, inference=inference,
+                                trail=trail)
+            nodes, seconds = nodes + csp.nassigns, seconds + time.perf_counter() - start
+        return '{:.0f} nodes/s'.format(nodes / seconds)
+
+    print_table([['{} {}'.format(type(make()).__name__, len(make().variables)),
+                  do(make, False), do(make, True)]
+                 for make in problems], ['CSP', 'Removals lists', 'Trail'])
+
+
+def compare_constraint_tables(problems=None, propagation=AC3, batch=20):
+    """Print the seconds propagation (by default AC3) takes on a batch of
+    CSPs, calling the constraints and looking them up in tables built by
+    compile_constraints (shared through one cache across the batch); and
+    the seconds to compile those tables. problems are functions that make a
+    fresh CSP; by default Sudokus and colorings of a 30x30 grid map."""
+    grid = {(i, j): [(i + di, j + dj) for di, dj in [(-1, 0), (1, 0), (0, -1), (0, 1)]
+                     if 0 <= i + di < 30 and 0 <= j + dj < 30]
+            for i in range(30) for j in range(30)}
+    problems = problems or [lambda: Sudoku(easy1), lambda: Sudoku(harder1),
+                            lambda: MapColoringCSP(list('RGB'), grid), lambda: Zebra()]
+
+    def do(make):
+        csps, cache = [make() for _ in range(batch)], {}
+        start = time.perf_counter()
+        for csp in csps:
+            propagation(csp)
+        calls = time.perf_counter() - start
+        csps = [make() for _ in range(batch)]
+        start = time.perf_counter()
+        for csp in csps:
+            csp.compile_constraints(cache)
+        compiling = time.perf_counter() - start
+        start = time.perf_counter()
+        for csp in csps:
+            propagation(csp)
+        return [len(csps[0].variables), round(calls, 3), round(time.perf_counter() - start, 3),
+                round(compiling, 3)]
+
+    print_table([[type(make()).__name__] + do(make) for make in problems],
+                ['CSP', 'Variables', 'Calls (s)', 'Tables (s)', 'Compiling (s)'])
+
+
+def compare_parallel_solvers(processes=None, seed=1):
+    """Print the wall time of each sequential solver and of its parallel
+    version with the given number of processes (default: the number of
+    CPUs): backtracking_search with mrv and forward checking on an
+    NQueensCSP, and ac_solver on a Crossword and a Kakuro."""
+    problems = [('NQueensCSP 200', lambda: NQueensCSP(200),
+                 lambda csp: backtracking_search(csp, mrv, inference=forward_checking),
+                 lambda csp: parallel_backtracking_search(csp, processes=processes)),
+                ('Crossword', lambda: Crossword(crossword1, words1), ac_solver,
+                 lambda csp: parallel_domain_splitting(csp, processes)),
+                ('Kakuro 3', lambda: Kakuro(kakuro3), ac_solver,
+                 lambda csp: parallel_domain_splitting(csp, processes))]
+
+    def do(make, solver):
+        random.seed(seed)
+        start = time.perf_counter()
+        solver(make())
+        return round(time.perf_counter() - start, 3)
+
+    print_table([[label, do(make, sequential), do(make, parallel)]
+                 for label, make, sequential, parallel in problems],
+                ['CSP', 'Sequential (s)', 'Parallel (s)'])
+
+
+def compare_variable_orderings(problems=None, nodes=200, seed=1):
+    """Print the nodes (assignments) per second of backtracking_search on
+    each CSP selecting variables with mrv, indexed_mrv and dom_wdeg, over
+    the first nodes assignments or to a solution, whichever comes first;
+    on NQueensCSP(1000) most of the time of each node is in the inference.
+    problems are (label, function that makes a fresh CSP, order_domain_values,
+    inference); by default Sudoku(harder1) with forward checking, lcv and
+    indexed_lcv, and with mac, and NQueensCSP(1000) with BitDomains."""
+
+    def queens(n):
+        csp = NQueensCSP(n)
+        csp.bitsets = True
+        return csp
+
+    problems = problems or [
+        ('Sudoku, lcv, FC', lambda: Sudoku(harder1), lcv, forward_checking),
+        ('Sudoku, indexed_lcv, FC', lambda: Sudoku(harder1), indexed_lcv, forward_checking),
+        ('Sudoku, MAC', lambda: Sudoku(harder1), unordered_domain_values, mac),
+        ('NQueensCSP 1000, FC', lambda: queens(1000), unordered_domain_values, forward_checking)]
+
+    class OutOfNodes(Exception):
+        pass
+
+    def do(make, select, order, inference):
+        def select_unassigned_variable(assignment, csp):
+            if csp.nassigns >= nodes:
+                raise OutOfNodes
+            return select(assignment, csp)
+
+        csp = make()
+        random.seed(seed)
+        start = time.perf_counter()
+        try:
+            backtracking_search(csp, select_unassigned_variable, order, inference)
+        except OutOfNodes:
+            pass
+        return '{:.0f} nodes/s'.format(csp.nassigns / (time.perf_counter() - start))
+
+    print_table([[label] + [do(make, select, order, inference)
+                            for select in (mrv, indexed_mrv, dom_wdeg)]
+                 for label, make, order, inference in problems],
+                ['CSP', 'mrv', 'indexed_mrv', 'dom_wdeg'])
+
+
+def compare_backjumping(problems=None, seed=1):
+    """Print the assignments and seconds of backtracking_search on each CSP,
+    backtracking chronologically, with conflict-directed backjumping, and
+    with backjumping and a NogoodStore. problems are (label, function that
+    makes a fresh CSP, select_unassigned_variable, inference); by default
+    Zebra with the variables in order and each inference, and Sudoku(easy1)
+    with forward checking."""
+    problems = problems or [
+        ('Zebra', Zebra, first_unassigned_variable, no_inference),
+        ('Zebra, FC', Zebra, first_unassigned_variable, forward_checking),
+        ('Zebra, MAC', Zebra, first_unassigned_variable, mac),
+        ('Sudoku, FC', lambda: Sudoku(easy1), first_unassigned_variable, forward_checking)]
+
+    def do(make, select, inference, **options):
+        csp = make()
+        random.seed(seed)
+        start = time.perf_counter()
+        backtracking_search(csp, select, inference=inference, **options)
+        return '{} assigns, {:.3f}s'.format(csp.nassigns, time.perf_counter() - start)
+
+    print_table([[label, do(make, select, inference), do(make, select, inference, backjumping=True),
+                  do(make, select, inference, nogoods=NogoodStore())]
+                 for label, make, select, inference in problems],
+                ['CSP', 'Chronological', 'Backjumping', 'Backjumping, nogoods'])
+
+
+def compare_gac(problems=None):
+    """Print the seconds ACSolver.GAC and GACSolver.GAC take to make each
+    NaryCSP arc consistent, the seconds to set up the GACSolver (compiling
+    the tables), and the seconds ac_solver and gac_solver take to solve it.
+    problems are functions that make a fresh NaryCSP; by default a
+    Crossword, Kakuros and SEND + MORE = MONEY."""
+    problems = problems or [lambda: Crossword(crossword1, words1), lambda: Kakuro(kakuro3),
+                            lambda: Kakuro(kakuro4), lambda: send_more_money]
+
+    def seconds(function, *args):
+        start = time.perf_counter()
+        function(*args)
+        return round(time.perf_counter() - start, 4)
+
+    def do(make):
+        csp = make()
+        start = time.perf_counter()
+        solver = GACSolver(csp)
+        compiling = round(time.perf_counter() - start, 4)
+        return [len(csp.variables), seconds(ACSolver(csp).GAC), seconds(solver.GAC), compiling,
+                seconds(ac_solver, csp), seconds(gac_solver, csp)]
+
+    print_table([[type(make()).__name__] + do(make) for make in problems],
+                ['CSP', 'Variables', 'ACSolver.GAC (s)', 'GACSolver.GAC (s)', 'Compiling (s)',
+                 'ac_solver (s)', 'gac_solver (s)'])
+
+
+def compare_sudoku_batch(puzzles=None, processes=None, seed=1):
+    """Print the seconds a batch of Sudokus takes: each built with Sudoku and
+    solved with backtracking_search in turn; each built with batch_sudoku,
+    sharing compiled constraint tables, in turn (solve_sudoku); and with
+    solve_sudokus on a pool of processes (by default, one for each CPU).
+    By default the batch is easy1 and harder1, 100 times each."""
+    puzzles = puzzles or [easy1, harder1] * 100
+
+    def seconds(function):
+        random.seed(seed)
+        start = time.perf_counter()
+        function()
+        return round(time.perf_counter() - start, 3)
+
+    print_table([[len(puzzles),
+                  seconds(lambda: [backtracking_search(Sudoku(grid), mrv, inference=mac)
+                                   for grid in puzzles]),
+                  seconds(lambda: [solve_sudoku(grid) for grid in puzzles]),
+                  seconds(lambda: list(solve_sudokus(puzzles, processes)))]],
+                ['Puzzles', 'Sudoku (s)', 'solve_sudoku (s)',
+                 'solve_sudokus, {} processes (s)'.format(processes or os.cpu_count())])
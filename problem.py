@@ -92,7 +92,43 @@ def fitness_fn_landkart(individuum):
     if(individuum[3]==individuum[4]):
         fitness_ct-=1
     return fitness_ct
-   
+
+def fitness_fn_queens_batch(population):
+    # fitness_fn_queens for a whole population (one individual per row) at once
+    population = np.asarray(population)
+    idx, idx2 = np.triu_indices(population.shape[1], 1)
+    x, x2 = population[:, idx], population[:, idx2]
+    return len(idx) - ((x == x2) | (np.abs(x - x2) == idx2 - idx)).sum(axis=1)
+
+def fitness_fn_landkart_batch(population):
+    # fitness_fn_landkart for a whole population (one individual per row) at once
+    i = np.asarray(population).T
+    fitness_ct = 6 - (i[1] == i[2])
+    fitness_ct -= np.where((i[0] == i[1]) & (i[1] == i[2]), 2, (i[0] == i[1]) | (i[0] == i[2]))
+    fitness_ct -= np.where((i[1] == i[2]) & (i[2] == i[3]), 2, (i[1] == i[3]) | (i[2] == i[3]))
+    fitness_ct -= i[3] == i[4]
+    return fitness_ct
+
+def benchmark(init_p=2000, ngen=20):
+    # individuals per second of genetic_algorithm and vectorized_genetic_algorithm,
+    # run for ngen generations without a threshold on both fitness examples
+    for fitness_fn, batch_fn, gene_pool, state_length in [
+            (fitness_fn_queens, fitness_fn_queens_batch, [1, 2, 3, 4, 5, 6, 7, 8], 8),
+            (fitness_fn_landkart, fitness_fn_landkart_batch, ["red", "blue", "grey"], 6)]:
+        population = init_population(init_p, gene_pool, state_length)
+        start = timer()
+        genetic_algorithm(population, fitness_fn, gene_pool=gene_pool, ngen=1)
+        lists = init_p / (timer() - start)
+        start = timer()
+        vectorized_genetic_algorithm(population, fitness_fn, gene_pool=gene_pool, ngen=ngen)
+        arrays = init_p * ngen / (timer() - start)
+        start = timer()
+        vectorized_genetic_algorithm(population, batch_fn, gene_pool=gene_pool, ngen=ngen,
+                                     batched=True)
+        batched = init_p * ngen / (timer() - start)
+        print("{}: lists {:.0f}, arrays {:.0f}, arrays with batched fitness {:.0f} individuals/s"
+              .format(fitness_fn.__name__, lists, arrays, batched))
+
 if __name__ == "__main__":
     main()
 
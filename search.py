@@ -6,11 +6,28 @@ then create problem instances and solve them with calls to the various search
 functions.
 """
 
+import collections.abc
+import copy
+import csv
+import heapq
+import itertools
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import pickle
+import shelve
 import sys
-from collections import deque
+import time
+from collections import Counter, deque
 
 from utils import *
 
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
 
 class Problem:
     """The abstract class for a formal problem. You should subclass
@@ -61,6 +78,22 @@ class Problem:
         and related algorithms try to maximize this value."""
         raise NotImplementedError
 
+    def random_action(self, state):
+        """Return one of self.actions(state) chosen at random, or None if there
+        are none. Local search uses this to sample a single neighbour instead of
+        expanding them all; override it if that can be done without listing
+        every action."""
+        actions = list(self.actions(state))
+        return random.choice(actions) if actions else None
+
+    def state_key(self, state):
+        """Return the key that graph searches use in place of the state in their
+        explored sets and frontiers: states with equal keys are treated as the
+        same state. The default is the state itself; override it to return a
+        compact int or bytes encoding when states are large, slow to hash, or
+        (like hashabledict) hash poorly."""
+        return state
+
 
 # ______________________________________________________________________________
 
@@ -73,7 +106,10 @@ class Node:
     the total path_cost (also known as g) to reach the node. Other functions
     may add an f and h value; see best_first_graph_search and astar_search for
     an explanation of how the f and h values are handled. You will not need to
-    subclass this class."""
+    subclass this class. Nodes use __slots__ (with room reserved for f and h)
+    rather than a per-instance __dict__, which keeps large searches small."""
+
+    __slots__ = ('state', 'parent', 'action', 'path_cost', 'depth', 'f', 'h')
 
     def __init__(self, state, parent=None, action=None, path_cost=0):
         """Create a search tree Node, derived from a parent by an action."""
@@ -99,7 +135,8 @@ class Node:
     def child_node(self, problem, action):
         """[Figure 3.10]"""
         next_state = problem.result(self.state, action)
-        next_node = Node(next_state, self, action, problem.path_cost(self.path_cost, self.state, action, next_state))
+        next_node = type(self)(next_state, self, action,
+                               problem.path_cost(self.path_cost, self.state, action, next_state))
         return next_node
 
     def solution(self):
@@ -130,6 +167,54 @@ class Node:
         return hash(self.state)
 
 
+class CompactNode:
+    """A parent-pointer-only search tree Node, for searches that generate
+    millions of nodes. Only the state, parent, path_cost and the f and h slots
+    are stored; action and depth are not kept on the node but worked out when
+    requested: depth by walking up the parents, and the actions of the
+    solution by asking the problem which action leads from each state on the
+    path to the next. Pass node_type=CompactNode to best_first_graph_search or
+    astar_search to use it."""
+
+    __slots__ = ('state', 'parent', 'path_cost', 'f', 'h')
+
+    def __init__(self, state, parent=None, action=None, path_cost=0):
+        """Create a search tree Node; the action is accepted but not stored."""
+        self.state = state
+        self.parent = parent
+        self.path_cost = path_cost
+
+    @property
+    def depth(self):
+        """The number of steps from the root to this node."""
+        depth, node = 0, self.parent
+        while node:
+            depth, node = depth + 1, node.parent
+        return depth
+
+    def solution(self, problem=None):
+        """Return the sequence of actions to go from the root to this node,
+        recovering each one as the first action of problem that leads from a
+        state on the path to the next. The problem is needed for that, as the
+        actions are not stored on the nodes."""
+        if problem is None:
+            raise ValueError('CompactNode.solution needs the problem to recover the actions from')
+        path = self.path()
+        return [first(a for a in problem.actions(node.state)
+                      if problem.result(node.state, a) == child.state)
+                for node, child in zip(path, path[1:])]
+
+    def __eq__(self, other):
+        return isinstance(other, CompactNode) and self.state == other.state
+
+    __repr__ = Node.__repr__
+    __lt__ = Node.__lt__
+    __hash__ = Node.__hash__
+    expand = Node.expand
+    child_node = Node.child_node
+    path = Node.path
+
+
 # ______________________________________________________________________________
 
 
@@ -222,16 +307,23 @@ def depth_first_graph_search(problem):
     Does not get trapped by loops.
     If two paths reach a state, only use the first one.
     """
+    key = problem.state_key
     frontier = [(Node(problem.initial))]  # Stack
+    on_frontier = Counter([key(problem.initial)])
 
     explored = set()
     while frontier:
         node = frontier.pop()
+        node_key = key(node.state)
+        on_frontier[node_key] -= 1
         if problem.goal_test(node.state):
             return node
-        explored.add(node.state)
-        frontier.extend(child for child in node.expand(problem)
-                        if child.state not in explored and child not in frontier)
+        explored.add(node_key)
+        for child in node.expand(problem):
+            child_key = key(child.state)
+            if child_key not in explored and not on_frontier[child_key]:
+                frontier.append(child)
+                on_frontier[child_key] += 1
     return None
 
 
@@ -244,47 +336,93 @@ def breadth_first_graph_search(problem):
     node = Node(problem.initial)
     if problem.goal_test(node.state):
         return node
+    key = problem.state_key
     frontier = deque([node])
-    explored = set()
+    reached = {key(node.state)}  # the explored states and those on the frontier
     while frontier:
         node = frontier.popleft()
-        explored.add(node.state)
         for child in node.expand(problem):
-            if child.state not in explored and child not in frontier:
+            child_key = key(child.state)
+            if child_key not in reached:
                 if problem.goal_test(child.state):
                     return child
                 frontier.append(child)
+                reached.add(child_key)
     return None
 
 
-def best_first_graph_search(problem, f, display=False):
+def best_first_graph_search(problem, f, display=False, queue=IndexedPriorityQueue, node_type=Node,
+                            f_batch=None):
     """Search the nodes with the lowest f scores first.
     You specify the function f(node) that you want to minimize; for example,
     if f is a heuristic estimate to the goal, then we have greedy best
     first search; if f is node.depth then we have breadth-first search.
     There is a subtlety: the line "f = memoize(f, 'f')" means that the f
     values will be cached on the nodes as they are computed. So after doing
-    a best first search you can examine the f values of the path returned."""
+    a best first search you can examine the f values of the path returned.
+    The frontier is an IndexedPriorityQueue by default, so that checking
+    whether a child is already on the frontier and replacing it by a cheaper
+    path are O(1) and O(log n); pass queue=PriorityQueue for the plain heap.
+    Pass node_type=CompactNode to keep only parent pointers on the nodes.
+    The explored set and the frontier hold problem.state_key(state) rather
+    than the states themselves. See best_first_graph_search_events for a
+    version that reports its progress as it goes.
+    If f_batch is given, it is called with the list of new children of each
+    expanded node and returns their f values in one go (for heuristics that
+    are cheaper per node in bulk); f is then only used for the initial node."""
+    for event in best_first_graph_search_events(problem, f, 0, queue, node_type, f_batch):
+        pass
+    if display and event['solution']:
+        print(event['expanded'], "paths have been expanded and", event['frontier'],
+              "paths remain in the frontier")
+    return event['solution']
+
+
+def best_first_graph_search_events(problem, f, interval=1, queue=IndexedPriorityQueue,
+                                   node_type=Node, f_batch=None):
+    """best_first_graph_search as a generator of events, as dicts: every
+    interval expansions (never, if interval is 0)
+        {'expanded': n, 'frontier': size, 'f': f of the node being expanded,
+         'best_f': lowest f expanded}
+    and finally
+        {'expanded': n, 'frontier': size, 'solution': node or None, 'done': True}.
+    A caller can stop, or close the generator, at any event, e.g. at a deadline."""
     f = memoize(f, 'f')
-    node = Node(problem.initial)
-    frontier = PriorityQueue('min', f)
+    key = problem.state_key
+    record = getattr(problem, 'record_nodes', None)
+    node = node_type(problem.initial)
+    frontier = queue('min', f, key=lambda node: key(node.state))
     frontier.append(node)
     explored = set()
+    best_f = None
     while frontier:
+        if record:
+            record(len(frontier) + len(explored))
         node = frontier.pop()
         if problem.goal_test(node.state):
-            if display:
-                print(len(explored), "paths have been expanded and", len(frontier), "paths remain in the frontier")
-            return node
-        explored.add(node.state)
-        for child in node.expand(problem):
-            if child.state not in explored and child not in frontier:
+            yield {'expanded': len(explored), 'frontier': len(frontier), 'solution': node,
+                   'done': True}
+            return
+        explored.add(key(node.state))
+        if best_f is None or node.f < best_f:
+            best_f = node.f
+        if interval and len(explored) % interval == 0:
+            yield {'expanded': len(explored), 'frontier': len(frontier), 'f': node.f,
+                   'best_f': best_f}
+        children = node.expand(problem)
+        if f_batch:
+            new = [child for child in children if key(child.state) not in explored]
+            if new:
+                for child, value in zip(new, f_batch(new)):
+                    child.f = value
+        for child in children:
+            if key(child.state) not in explored and child not in frontier:
                 frontier.append(child)
             elif child in frontier:
                 if f(child) < frontier[child]:
                     del frontier[child]
                     frontier.append(child)
-    return None
+    yield {'expanded': len(explored), 'frontier': 0, 'solution': None, 'done': True}
 
 
 def uniform_cost_search(problem, display=False):
@@ -402,6 +540,70 @@ def bidirectional_search(problem):
     return np.inf
 
 
+def bidirectional_astar_search(problem, backward=None):
+    """Bidirectional A* for a GraphProblem, following the NBA* algorithm of
+    Pijls and Post (2009). A forward search from the initial node, guided by
+    problem.h, and a backward search from the goal, guided by the h of the
+    reversed problem (so both ends use GraphProblem.h), take turns expanding
+    the side with the smaller frontier. A node is not expanded if, by either
+    heuristic, no path through it can be shorter than the best path found so
+    far, and a node closed by one side is never expanded by the other. The
+    search stops when either frontier empties. The heuristics should be
+    consistent; an infinite h (no locations) is treated as 0.
+    Returns a solution Node, as astar_search does, or None."""
+    backward = backward or problem.reverse()
+    start, goal = problem.initial, problem.goal
+    if problem.goal_test(start):
+        return Node(start)
+    sides = (problem, backward)
+    g = ({start: 0}, {goal: 0})
+    parent = ({start: None}, {goal: None})
+    hs = ({}, {})
+
+    def h(i, state):
+        if state not in hs[i]:
+            value = sides[i].h(Node(state))
+            hs[i][state] = 0 if value == np.inf else value
+        return hs[i][state]
+
+    F = [h(0, start), h(1, goal)]
+    frontier = ([(F[0], start)], [(F[1], goal)])
+    closed = set()
+    best, meet = np.inf, None
+    while frontier[0] and frontier[1]:
+        i = 0 if len(frontier[0]) <= len(frontier[1]) else 1
+        j = 1 - i
+        x = heapq.heappop(frontier[i])[1]
+        if x not in closed:
+            closed.add(x)
+            gx = g[i][x]
+            if gx + h(i, x) < best and gx + F[j] - h(j, x) < best:
+                for y in sides[i].actions(x):
+                    gy = sides[i].path_cost(gx, x, y, y)
+                    if y not in closed and gy < g[i].get(y, np.inf):
+                        g[i][y], parent[i][y] = gy, x
+                        heapq.heappush(frontier[i], (gy + h(i, y), y))
+                        if y in g[j] and gy + g[j][y] < best:
+                            best, meet = gy + g[j][y], y
+        if frontier[i]:
+            F[i] = frontier[i][0][0]
+    if meet is None:
+        return None
+    states, s = [], meet
+    while s is not None:
+        states.append(s)
+        s = parent[0][s]
+    states.reverse()
+    s = parent[1][meet]
+    while s is not None:
+        states.append(s)
+        s = parent[1][s]
+    node = Node(start)
+    for s in states[1:]:
+        node = node.child_node(problem, s)
+    return node
+
+
 # ______________________________________________________________________________
 # Informed (Heuristic) Search
 
@@ -412,12 +614,87 @@ greedy_best_first_graph_search = best_first_graph_search
 # Greedy best-first search is accomplished by specifying f(n) = h(n).
 
 
-def astar_search(problem, h=None, display=False):
+def astar_search(problem, h=None, display=False, node_type=Node):
     """A* search is best-first graph search with f(n) = g(n)+h(n).
     You need to specify the h function when you call astar_search, or
-    else in your Problem subclass."""
+    else in your Problem subclass. If h is not given and the problem has an
+    h_batch(nodes) method, returning the h values of a list of nodes, the
+    children of each expanded node are evaluated with one call to it."""
+    h_batch = getattr(problem, 'h_batch', None) if h is None else None
+    h = memoize(h or problem.h, 'h')
+    f_batch = None
+    if h_batch:
+        def f_batch(nodes):
+            values = h_batch(nodes)
+            for node, value in zip(nodes, values):
+                node.h = value
+            return [node.path_cost + value for node, value in zip(nodes, values)]
+    return best_first_graph_search(problem, lambda n: n.path_cost + h(n), display,
+                                   node_type=node_type, f_batch=f_batch)
+
+
+def anytime_weighted_astar_search(problem, h=None, weight=3, interval=1):
+    """Anytime weighted A* (Hansen and Zhou, 2007), a generator of events.
+    Nodes are expanded in order of g + weight * h, which finds a first solution
+    quickly; the search then carries on, pruning nodes whose g + h shows they
+    cannot beat the best solution so far, and reopening states reached again
+    more cheaply. Each better solution is yielded as
+        {'expanded': n, 'frontier': size, 'solution': node, 'cost': its path cost}
+    and every interval expansions (never, if interval is 0)
+        {'expanded': n, 'frontier': size, 'f': g + h of the node being expanded}.
+    The final event {'expanded': n, 'frontier': 0, 'solution': best node or None,
+    'cost': ..., 'done': True} comes when the frontier is empty; with an
+    admissible h its solution is then optimal. Use search_until to stop at a
+    deadline with the best solution so far."""
     h = memoize(h or problem.h, 'h')
-    return best_first_graph_search(problem, lambda n: n.path_cost + h(n), display)
+    key = problem.state_key
+    node = Node(problem.initial)
+    g = {key(node.state): 0}
+    counter = itertools.count()
+    frontier = [(weight * h(node), next(counter), node)]
+    best, expanded = None, 0
+    while frontier:
+        node = heapq.heappop(frontier)[2]
+        if node.path_cost > g[key(node.state)]:
+            continue  # reached again more cheaply since it was pushed
+        if best and node.path_cost + h(node) >= best.path_cost:
+            continue
+        if problem.goal_test(node.state):
+            best = node
+            yield {'expanded': expanded, 'frontier': len(frontier), 'solution': node,
+                   'cost': node.path_cost}
+            continue
+        expanded += 1
+        if interval and expanded % interval == 0:
+            yield {'expanded': expanded, 'frontier': len(frontier), 'f': node.path_cost + h(node)}
+        for child in node.expand(problem):
+            child_key = key(child.state)
+            if child.path_cost < g.get(child_key, np.inf) and not (
+                    best and child.path_cost + h(child) >= best.path_cost):
+                g[child_key] = child.path_cost
+                f = child.path_cost + weight * h(child)
+                heapq.heappush(frontier, (f, next(counter), child))
+    yield {'expanded': expanded, 'frontier': 0, 'solution': best,
+           'cost': best.path_cost if best else np.inf, 'done': True}
+
+
+def search_until(events, seconds=None, max_events=None):
+    """Consume the events of a generator such as best_first_graph_search_events
+    or anytime_weighted_astar_search until it is done, seconds have passed or
+    max_events have been read, then close it. Return the last solution it
+    yielded (None if there was none) and the last event."""
+    deadline = None if seconds is None else time.perf_counter() + seconds
+    solution = event = None
+    try:
+        for count, event in enumerate(events, 1):
+            if event.get('solution') is not None:
+                solution = event['solution']
+            if ((deadline is not None and time.perf_counter() >= deadline) or
+                    (max_events is not None and count >= max_events)):
+                break
+    finally:
+        events.close()
+    return solution, event
 
 
 # ______________________________________________________________________________
@@ -500,6 +777,191 @@ class EightPuzzle(Problem):
         return sum(s != g for (s, g) in zip(node.state, self.goal))
 
 
+class NPuzzle(Problem):
+    """The generalisation of EightPuzzle to an n x n board (n = 4 is the 15-puzzle).
+    A state is a tuple of length n * n, where element at index i is the tile
+    number at index i (0 for the blank). The default heuristic is the sum of the
+    Manhattan distances of the tiles from their goal squares, which h_batch
+    computes for many nodes at once from a numpy table; pass a
+    PatternDatabases as h for a stronger one."""
+
+    def __init__(self, initial, goal=None, h=None):
+        """Define goal state (by default tiles in order with the blank last)
+        and initialize a problem."""
+        self.n = exact_sqrt(len(initial))
+        super().__init__(initial, goal or tuple(range(1, len(initial))) + (0,))
+        self.delta = {'UP': -self.n, 'DOWN': self.n, 'LEFT': -1, 'RIGHT': 1}
+        self.goal_square = {tile: i for i, tile in enumerate(self.goal)}
+        squares = len(initial)
+        # distance[i * squares + t] is the Manhattan distance of tile t on square i
+        # from its goal square
+        n, goal_square = self.n, self.goal_square
+        self.distance = np.array([[0 if t == 0 else abs(i // n - goal_square[t] // n) +
+                                   abs(i % n - goal_square[t] % n) for t in range(squares)]
+                                  for i in range(squares)]).ravel()
+        self.offsets = np.arange(squares) * squares
+        if h:
+            self.h = h
+            self.h_batch = None
+
+    def actions(self, state):
+        """Return the moves of the blank that stay on the board."""
+        n, blank = self.n, state.index(0)
+        possible_actions = []
+        if blank >= n:
+            possible_actions.append('UP')
+        if blank < n * (n - 1):
+            possible_actions.append('DOWN')
+        if blank % n:
+            possible_actions.append('LEFT')
+        if blank % n < n - 1:
+            possible_actions.append('RIGHT')
+        return possible_actions
+
+    def result(self, state, action):
+        """Swap the blank with the neighbouring tile in the direction of action."""
+        blank = state.index(0)
+        neighbor = blank + self.delta[action]
+        new_state = list(state)
+        new_state[blank], new_state[neighbor] = new_state[neighbor], new_state[blank]
+        return tuple(new_state)
+
+    def goal_test(self, state):
+        return state == self.goal
+
+    def parity(self, state):
+        """The permutation parity of a state, counting the row of the blank
+        on boards of even width; a move never changes it."""
+        tiles = [t for t in state if t != 0]
+        inversions = sum(tiles[i] > tiles[j]
+                         for i in range(len(tiles)) for j in range(i + 1, len(tiles)))
+        if self.n % 2 == 0:
+            inversions += state.index(0) // self.n
+        return inversions % 2
+
+    def check_solvability(self, state):
+        """Checks if the goal can be reached from the given state."""
+        return self.parity(state) == self.parity(self.goal)
+
+    def h(self, node):
+        """Sum of the Manhattan distances of the tiles from their goal squares."""
+        n, goal_square = self.n, self.goal_square
+        return sum(abs(i // n - goal_square[t] // n) + abs(i % n - goal_square[t] % n)
+                   for i, t in enumerate(node.state) if t != 0)
+
+    def h_batch(self, nodes):
+        """h for a list of nodes, by one lookup in the table of distances."""
+        states = np.array([node.state for node in nodes])
+        return self.distance[states + self.offsets].sum(axis=1).tolist()
+
+
+class PatternDatabase:
+    """A pattern database for the tiles in pattern of an n x n sliding-tile
+    puzzle with the given goal. table[i] is the least number of moves of the
+    pattern tiles needed to bring them from the squares encoded by i (square
+    p_k of tile pattern[k] contributes p_k * (n*n) ** (len(pattern)-1-k)) to
+    their goal squares. Moves of other tiles are free, so the databases of
+    disjoint patterns can be added together and stay admissible.
+    The table is a flat uint8 numpy array, built by a breadth-first search
+    backwards from the goal, and can be saved and memory-mapped back."""
+
+    def __init__(self, pattern, goal, table=None):
+        self.pattern = tuple(pattern)
+        self.goal = tuple(goal)
+        self.n = exact_sqrt(len(goal))
+        size = len(goal)
+        self.weights = [size ** (len(pattern) - 1 - k) for k in range(len(pattern))]
+        self.table = self.build() if table is None else table
+
+    def build(self):
+        """Breadth-first (0-1) search over the positions of the pattern tiles
+        together with the blank, outwards from the goal. Moving the blank onto
+        a pattern tile costs 1, onto any other square 0; the table keeps the
+        minimum over the positions of the blank."""
+        n, size, weights = self.n, len(self.goal), self.weights
+        neighbors = [[c for c in (b - n, b + n) if 0 <= c < size] +
+                     [c for c in (b - 1, b + 1) if 0 <= c < size and c // n == b // n]
+                     for b in range(size)]
+        positions = tuple(self.goal.index(t) for t in self.pattern)
+        code, blank = sum(p * w for p, w in zip(positions, weights)), self.goal.index(0)
+        unseen = 255
+        dist = bytearray([unseen]) * (size ** (len(self.pattern) + 1))
+        table = bytearray([unseen]) * (size ** len(self.pattern))
+        dist[code * size + blank] = 0
+        frontier = deque([(positions, code, blank, 0)])
+        while frontier:
+            positions, code, blank, d = frontier.popleft()
+            if d > dist[code * size + blank]:
+                continue
+            if d < table[code]:
+                table[code] = d
+            for c in neighbors[blank]:
+                if c in positions:
+                    k = positions.index(c)
+                    new = (positions[:k] + (blank,) + positions[k + 1:],
+                           code + (blank - c) * weights[k], c, d + 1)
+                else:
+                    new = (positions, code, c, d)
+                key = new[1] * size + c
+                if new[3] < dist[key]:
+                    dist[key] = new[3]
+                    if new[3] > d:
+                        frontier.append(new)
+                    else:
+                        frontier.appendleft(new)
+        return np.frombuffer(table, dtype=np.uint8).copy()
+
+    def index(self, squares):
+        """The table index for a list mapping each tile to its square."""
+        return sum(squares[t] * w for t, w in zip(self.pattern, self.weights))
+
+    @staticmethod
+    def filename(pattern, goal):
+        """A file name that identifies the puzzle size, goal and pattern."""
+        return 'pdb{}_{}_{}.npy'.format(len(goal), '-'.join(map(str, goal)),
+                                        '-'.join(map(str, pattern)))
+
+    def save(self, path):
+        np.save(path, self.table)
+
+    @classmethod
+    def load(cls, path, pattern, goal):
+        """Memory-map a table saved with save; it is not read into RAM up front."""
+        return cls(pattern, goal, np.load(path, mmap_mode='r'))
+
+
+class PatternDatabases:
+    """The additive heuristic of several disjoint pattern databases for the same
+    goal; call it on a node, or pass it as h to astar_search or NPuzzle.
+    By default the tiles are split into consecutive groups of at most five.
+    If directory is given, each database is memory-mapped from there when it
+    has been built before, and otherwise built and saved there."""
+
+    def __init__(self, goal, patterns=None, directory=None):
+        tiles = sorted(t for t in goal if t != 0)
+        self.patterns = patterns or [tiles[i:i + 5] for i in range(0, len(tiles), 5)]
+        pattern_tiles = [t for p in self.patterns for t in p]
+        assert len(pattern_tiles) == len(set(pattern_tiles)), 'patterns must be disjoint'
+        self.databases = [self.load_or_build(p, goal, directory) for p in self.patterns]
+
+    @staticmethod
+    def load_or_build(pattern, goal, directory):
+        if directory is None:
+            return PatternDatabase(pattern, goal)
+        path = os.path.join(directory, PatternDatabase.filename(pattern, goal))
+        if os.path.exists(path):
+            return PatternDatabase.load(path, pattern, goal)
+        pdb = PatternDatabase(pattern, goal)
+        pdb.save(path)
+        return pdb
+
+    def __call__(self, node):
+        squares = [0] * len(node.state)
+        for i, t in enumerate(node.state):
+            squares[t] = i
+        return sum(int(pdb.table[pdb.index(squares)]) for pdb in self.databases)
+
+
 # ______________________________________________________________________________
 
 
@@ -608,13 +1070,29 @@ class PlanRoute(Problem):
 
 
 def recursive_best_first_search(problem, h=None):
-    """[Figure 3.26]"""
+    """[Figure 3.26]
+    See recursive_best_first_search_events for a version that reports its
+    progress as it goes."""
+    for event in recursive_best_first_search_events(problem, h, 0):
+        pass
+    return event['solution']
+
+
+def recursive_best_first_search_events(problem, h=None, interval=1):
+    """recursive_best_first_search as a generator of events, as dicts: every
+    interval expansions (never, if interval is 0)
+        {'expanded': n, 'depth': depth of the node, 'f': its f, 'flimit': the f limit of this call}
+    and finally {'expanded': n, 'solution': node or None, 'done': True}."""
     h = memoize(h or problem.h, 'h')
+    expanded = [0]
 
     def RBFS(problem, node, flimit):
         if problem.goal_test(node.state):
             return node, 0  # (The second value is immaterial)
         successors = node.expand(problem)
+        expanded[0] += 1
+        if interval and expanded[0] % interval == 0:
+            yield {'expanded': expanded[0], 'depth': node.depth, 'f': node.f, 'flimit': flimit}
         if len(successors) == 0:
             return None, np.inf
         for s in successors:
@@ -629,32 +1107,220 @@ def recursive_best_first_search(problem, h=None):
                 alternative = successors[1].f
             else:
                 alternative = np.inf
-            result, best.f = RBFS(problem, best, min(flimit, alternative))
+            result, best.f = yield from RBFS(problem, best, min(flimit, alternative))
             if result is not None:
                 return result, best.f
 
     node = Node(problem.initial)
     node.f = h(node)
-    result, bestf = RBFS(problem, node, np.inf)
-    return result
+    result, bestf = yield from RBFS(problem, node, np.inf)
+    yield {'expanded': expanded[0], 'solution': result, 'done': True}
+
+
+def ida_star_search(problem, h=None):
+    """Iterative deepening A*: a series of depth-first searches, each cut off
+    where f = g + h exceeds a bound, the bound being raised each time to the
+    smallest f that exceeded it. Memory is linear in the solution depth.
+    States already on the current path are not revisited."""
+    h = memoize(h or problem.h, 'h')
+    record = getattr(problem, 'record_nodes', None) or (lambda n: None)
+    stored = [1]
+
+    def DFS(node, bound, path_states):
+        f = node.path_cost + h(node)
+        if f > bound:
+            return None, f
+        if problem.goal_test(node.state):
+            return node, f
+        successors = [s for s in node.expand(problem) if s.state not in path_states]
+        stored[0] += len(successors)
+        record(stored[0])
+        smallest = np.inf
+        for s in successors:
+            path_states.add(s.state)
+            result, f = DFS(s, bound, path_states)
+            path_states.discard(s.state)
+            if result is not None:
+                return result, f
+            smallest = min(smallest, f)
+        stored[0] -= len(successors)
+        return None, smallest
+
+    node = Node(problem.initial)
+    bound = h(node)
+    while bound < np.inf:
+        result, bound = DFS(node, bound, {node.state})
+        if result is not None:
+            return result
+    return None
+
+
+def sma_star_search(problem, h=None, max_nodes=1000):
+    """Simplified memory-bounded A*: A* that keeps at most max_nodes nodes.
+    Successors are generated one at a time; when memory is full the
+    shallowest of the highest-f leaves is forgotten, and its parent remembers
+    its f so that the subtree is only regenerated when it looks best again.
+    A node's f is backed up to the best of its successors once they have all
+    been generated. Returns an optimal solution Node if the shallowest one fits
+    in memory (its depth is less than max_nodes), otherwise the best reachable
+    one, or None. States already on the path to a node are not regenerated."""
+    h = memoize(h or problem.h, 'h')
+    record = getattr(problem, 'record_nodes', None) or (lambda n: None)
+    counter = itertools.count()
+
+    class Entry:
+        """A node in memory with its f, its children in memory, and its
+        successors that are not in memory as (forgotten f or None, action)."""
+        __slots__ = ('node', 'f', 'parent', 'children', 'pending', 'open', 'alive')
+
+        def __init__(self, node, f, parent):
+            self.node, self.f, self.parent = node, f, parent
+            self.children, self.pending = [], None
+            self.open = self.alive = True
+
+    # Both queues may hold stale entries, which are skipped when they come up:
+    # the frontier is ordered by lowest f then deepest, the leaves by highest f
+    # then shallowest.
+    frontier, leaves = [], []
+
+    def push(entry):
+        if entry.open:
+            heapq.heappush(frontier, (entry.f, -entry.node.depth, next(counter), entry))
+        if not entry.children and entry.parent:
+            heapq.heappush(leaves, (-entry.f, entry.node.depth, next(counter), entry))
+
+    def backup(entry):
+        """Raise the f of fully generated nodes to the best of their successors."""
+        while entry and all(f is not None for f, _ in entry.pending):
+            f = min([c.f for c in entry.children] + [f for f, _ in entry.pending], default=np.inf)
+            if f <= entry.f:
+                break
+            entry.f = f
+            push(entry)
+            entry = entry.parent
+
+    def forget_worst_leaf(keep):
+        """Remove the worst leaf other than keep, leaving its f with its parent."""
+        while leaves:
+            f, depth, _, entry = heapq.heappop(leaves)
+            if entry.alive and not entry.children and -f == entry.f and entry is not keep:
+                parent = entry.parent
+                parent.children.remove(entry)
+                parent.pending.append((entry.f, entry.node.action))
+                entry.alive = entry.open = False
+                if entry.f < np.inf:
+                    parent.open = True
+                push(parent)
+                return True
+        return False
+
+    node = Node(problem.initial)
+    root = Entry(node, h(node), None)
+    push(root)
+    stored = 1
+    while frontier:
+        f, _, _, best = frontier[0]
+        if not (best.alive and best.open and f == best.f):
+            heapq.heappop(frontier)
+            continue
+        if best.f == np.inf:
+            return None
+        if problem.goal_test(best.node.state):
+            return best.node
+        if best.pending is None:
+            best.pending = [(None, a) for a in problem.actions(best.node.state)]
+        if best.pending:
+            unseen = [i for i, (f, _) in enumerate(best.pending) if f is None]
+            pending = best.pending
+            i = unseen[0] if unseen else min(range(len(pending)), key=lambda i: pending[i][0])
+            forgotten_f, action = best.pending.pop(i)
+            child = best.node.child_node(problem, action)
+            if stored >= max_nodes and forget_worst_leaf(best):
+                stored -= 1
+            if (stored >= max_nodes or child.state in (n.state for n in best.node.path()) or
+                    (child.depth >= max_nodes - 1 and not problem.goal_test(child.state))):
+                best.pending.append((np.inf, action))
+            else:
+                child_f = max(best.f, child.path_cost + h(child), forgotten_f or 0)
+                entry = Entry(child, child_f, best)
+                best.children.append(entry)
+                stored += 1
+                push(entry)
+        if all(f == np.inf for f, _ in best.pending):
+            best.open = False
+        backup(best)
+        record(stored)
+    return None
 
 
-def hill_climbing(problem):
+def hill_climbing(problem, initial=None):
     """
     [Figure 4.2]
     From the initial node, keep choosing the neighbor with highest value,
-    stopping when no neighbor is better.
+    stopping when no neighbor is better. Start from initial instead of
+    problem.initial if it is given. See hill_climbing_events for a version
+    that reports each step.
     """
-    current = Node(problem.initial)
+    for event in hill_climbing_events(problem, initial):
+        pass
+    return event['solution']
+
+
+def hill_climbing_events(problem, initial=None):
+    """hill_climbing as a generator of events, as dicts: for the starting
+    state and after each step {'steps': k, 'value': v, 'solution': state}, each
+    solution better than the last; the final event also has 'done': True."""
+    current = Node(problem.initial if initial is None else initial)
+    steps, value = 0, problem.value(current.state)
     while True:
         neighbors = current.expand(problem)
         if not neighbors:
             break
         neighbor = argmax_random_tie(neighbors, key=lambda node: problem.value(node.state))
-        if problem.value(neighbor.state) <= problem.value(current.state):
+        neighbor_value = problem.value(neighbor.state)
+        if neighbor_value <= value:
+            break
+        yield {'steps': steps, 'value': value, 'solution': current.state}
+        current, value, steps = neighbor, neighbor_value, steps + 1
+    yield {'steps': steps, 'value': value, 'solution': current.state, 'done': True}
+
+
+def random_restart_hill_climbing(problem, random_state, restarts=10):
+    """Run hill_climbing from problem.initial and then from up to restarts
+    states drawn by calling random_state(), stopping early at a goal.
+    Return the best state found."""
+    best = hill_climbing(problem)
+    for _ in range(restarts):
+        if problem.goal_test(best):
+            break
+        state = hill_climbing(problem, random_state())
+        if problem.value(state) > problem.value(best):
+            best = state
+    return best
+
+
+def tabu_search(problem, tabu_size=10, max_steps=1000):
+    """Hill climbing with a tabu list: always move to the best neighbour whose
+    state is not among the tabu_size most recently visited ones, even if it is
+    worse, so that the search can walk off local maxima and plateaux. Stop
+    after max_steps moves, at a goal, or when every neighbour is tabu.
+    Return the best state visited."""
+    current = Node(problem.initial)
+    best = current.state
+    tabu = deque([current.state])
+    for _ in range(max_steps):
+        if problem.goal_test(current.state):
+            break
+        neighbors = [n for n in current.expand(problem) if n.state not in tabu]
+        if not neighbors:
             break
-        current = neighbor
-    return current.state
+        current = argmax_random_tie(neighbors, key=lambda node: problem.value(node.state))
+        tabu.append(current.state)
+        if len(tabu) > tabu_size:
+            tabu.popleft()
+        if problem.value(current.state) > problem.value(best):
+            best = current.state
+    return best
 
 
 def exp_schedule(k=20, lam=0.005, limit=100):
@@ -670,10 +1336,10 @@ def simulated_annealing(problem, schedule=exp_schedule()):
         T = schedule(t)
         if T == 0:
             return current.state
-        neighbors = current.expand(problem)
-        if not neighbors:
+        action = problem.random_action(current.state)
+        if action is None:
             return current.state
-        next_choice = random.choice(neighbors)
+        next_choice = current.child_node(problem, action)
         delta_e = problem.value(next_choice.state) - problem.value(current.state)
         if delta_e > 0 or probability(np.exp(delta_e / T)):
             current = next_choice
@@ -689,13 +1355,73 @@ def simulated_annealing_full(problem, schedule=exp_schedule()):
         T = schedule(t)
         if T == 0:
             return states
-        neighbors = current.expand(problem)
-        if not neighbors:
+        action = problem.random_action(current.state)
+        if action is None:
             return current.state
-        next_choice = random.choice(neighbors)
+        next_choice = current.child_node(problem, action)
+        delta_e = problem.value(next_choice.state) - problem.value(current.state)
+        if delta_e > 0 or probability(np.exp(delta_e / T)):
+            current = next_choice
+
+
+def tempering_chain(problem, state, T, steps, seed=None):
+    """Run steps of simulated annealing at the fixed temperature T from state,
+    sampling one neighbour per step. Return the final and the best state.
+    If seed is given, the random module is reseeded first (for a chain in a
+    process of its own)."""
+    if seed is not None:
+        random.seed(seed)
+    current = best = Node(state)
+    for _ in range(steps):
+        action = problem.random_action(current.state)
+        if action is None:
+            break
+        next_choice = current.child_node(problem, action)
         delta_e = problem.value(next_choice.state) - problem.value(current.state)
         if delta_e > 0 or probability(np.exp(delta_e / T)):
             current = next_choice
+            if problem.value(current.state) > problem.value(best.state):
+                best = current
+    return current.state, best.state
+
+
+def parallel_tempering(problem, temperatures=(0.1, 0.2, 0.4, 0.8, 1.6), steps=1000,
+                       swap_interval=50, processes=None):
+    """Simulated annealing with one chain per temperature (replica exchange).
+    Every swap_interval steps the chains stop, and the states of each pair of
+    neighbouring temperatures Ti < Tj are swapped with probability
+    min(1, exp((v(sj) - v(si)) * (1/Ti - 1/Tj))), so that good states found by
+    the hot, exploring chains move down to the cold, climbing ones. With
+    processes, the chains of each interval run in a process pool (problem
+    must then be picklable). The temperatures should span the scale of the
+    differences in value between neighbours. Return the best state found by
+    any chain."""
+    temperatures = sorted(temperatures)
+    states = [problem.initial] * len(temperatures)
+    best = problem.initial
+    pool = multiprocessing.Pool(processes) if processes else None
+    try:
+        for _ in range(0, steps, swap_interval):
+            if pool:
+                chains = pool.starmap(tempering_chain,
+                                      [(problem, s, T, swap_interval, random.getrandbits(64))
+                                       for s, T in zip(states, temperatures)])
+            else:
+                chains = [tempering_chain(problem, s, T, swap_interval)
+                          for s, T in zip(states, temperatures)]
+            states = [final for final, _ in chains]
+            best = max([best] + [b for _, b in chains], key=problem.value)
+            if problem.goal_test(best):
+                break
+            for i in range(len(temperatures) - 1):
+                delta = problem.value(states[i + 1]) - problem.value(states[i])
+                beta = 1 / temperatures[i] - 1 / temperatures[i + 1]
+                if probability(np.exp(min(0, delta * beta))):
+                    states[i], states[i + 1] = states[i + 1], states[i]
+        return best
+    finally:
+        if pool:
+            pool.close()
 
 
 def and_or_graph_search(problem):
@@ -763,6 +1489,18 @@ class PeakFindingProblem(Problem):
 
         return allowed_actions
 
+    def random_action(self, state):
+        """Returns one of the allowed actions at random, by drawing from the
+        defined actions until one stays on the grid (listing the allowed
+        actions only if a few draws miss, as near a corner)"""
+        (x, y), moves = state, self.defined_actions
+        for _ in range(len(moves)):
+            action = random.choice(list(moves))
+            dx, dy = moves[action]
+            if 0 <= x + dx < self.n and 0 <= y + dy < self.m:
+                return action
+        return super().random_action(state)
+
     def result(self, state, action):
         """Moves in the direction specified by action"""
         return vector_add(state, self.defined_actions[action])
@@ -784,13 +1522,15 @@ class OnlineDFSAgent:
     a subclass of the Problem class.
     """
 
-    def __init__(self, problem):
+    def __init__(self, problem, untried=None, unbacktracked=None, result=None):
+        """The tables can be given as TableStores, to keep what the agent has
+        learned beyond its own lifetime; by default each is a new DictStore."""
         self.problem = problem
         self.s = None
         self.a = None
-        self.untried = dict()
-        self.unbacktracked = dict()
-        self.result = {}
+        self.untried = DictStore() if untried is None else untried
+        self.unbacktracked = DictStore() if unbacktracked is None else unbacktracked
+        self.result = DictStore() if result is None else result
 
     def __call__(self, percept):
         s1 = self.update_state(percept)
@@ -823,6 +1563,21 @@ class OnlineDFSAgent:
         assumes the percept to be of type state."""
         return percept
 
+    def tables(self):
+        return {'untried': self.untried, 'unbacktracked': self.unbacktracked, 'result': self.result}
+
+    def snapshot(self):
+        """A copy of the agent's tables, to be given to restore later."""
+        return {name: table.snapshot() for name, table in self.tables().items()}
+
+    def restore(self, snapshot):
+        for name, table in self.tables().items():
+            table.restore(snapshot[name])
+
+    def reset(self):
+        """Forget the current state and action, to start a new trial."""
+        self.s = self.a = None
+
 
 # ______________________________________________________________________________
 
@@ -866,12 +1621,14 @@ class LRTAStarAgent:
     provided which is an instance of a subclass of Problem Class.
 
     Takes a OnlineSearchProblem [Figure 4.23] as a problem.
+    The learned cost estimates H can be given as a TableStore (by default a
+    new DictStore), so that later trials start from what was learned.
     """
 
-    def __init__(self, problem):
+    def __init__(self, problem, H=None):
         self.problem = problem
         # self.result = {}      # no need as we are using problem.result
-        self.H = {}
+        self.H = DictStore() if H is None else H
         self.s = None
         self.a = None
 
@@ -899,7 +1656,6 @@ class LRTAStarAgent:
     def LRTA_cost(self, s, a, s1, H):
         """Returns cost to move from state 's' to state 's1' plus
         estimated cost to get to goal from s1."""
-        print(s, a, s1)
         if s1 is None:
             return self.problem.h(s)
         else:
@@ -910,6 +1666,147 @@ class LRTAStarAgent:
             except:
                 return self.problem.c(s, a, s1) + self.problem.h(s1)
 
+    def tables(self):
+        return {'H': self.H}
+
+    snapshot, restore, reset = OnlineDFSAgent.snapshot, OnlineDFSAgent.restore, OnlineDFSAgent.reset
+
+
+class TableStore(collections.abc.MutableMapping):
+    """A table of an online search agent (such as LRTAStarAgent.H) that can
+    outlive the agent. snapshot returns a copy of the contents and restore
+    puts one back, so that repeated trials can start from what earlier ones
+    learned, or go back to an earlier point. Subclasses say where the entries
+    are kept: DictStore (in memory), ArrayStore (a numpy array of numbers
+    indexed by state id) or ShelfStore (on disk)."""
+
+    def snapshot(self):
+        return copy.deepcopy(dict(self))
+
+    def restore(self, snapshot):
+        self.clear()
+        self.update(copy.deepcopy(snapshot))
+
+
+class DictStore(TableStore):
+    """A TableStore kept in a dict."""
+
+    def __init__(self, entries=()):
+        self.entries = dict(entries)
+
+    def __getitem__(self, key):
+        return self.entries[key]
+
+    def __setitem__(self, key, value):
+        self.entries[key] = value
+
+    def __delitem__(self, key):
+        del self.entries[key]
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+
+class ArrayStore(TableStore):
+    """A TableStore of numbers, such as LRTAStarAgent.H, kept in a float numpy
+    array; ids maps each state to its index (NaN marks a missing entry).
+    A snapshot is a copy of the array."""
+
+    def __init__(self, ids):
+        self.ids = ids
+        self.values = np.full(len(ids), np.nan)
+
+    def __getitem__(self, key):
+        value = self.values[self.ids[key]]
+        if np.isnan(value):
+            raise KeyError(key)
+        return value.item()
+
+    def __setitem__(self, key, value):
+        self.values[self.ids[key]] = value
+
+    def __delitem__(self, key):
+        self[key]  # raises KeyError if missing
+        self.values[self.ids[key]] = np.nan
+
+    def __contains__(self, key):
+        return key in self.ids and not np.isnan(self.values[self.ids[key]])
+
+    def __iter__(self):
+        return (key for key, i in self.ids.items() if not np.isnan(self.values[i]))
+
+    def __len__(self):
+        return int(np.count_nonzero(~np.isnan(self.values)))
+
+    def snapshot(self):
+        return self.values.copy()
+
+    def restore(self, snapshot):
+        self.values[:] = snapshot
+
+
+class ShelfStore(TableStore):
+    """A TableStore kept on disk in a shelve database at path, so that it
+    survives the process; keys may be any picklable values. Entries read are
+    cached (so values such as lists can be changed in place) and written back
+    by sync or close."""
+
+    def __init__(self, path):
+        self.shelf = shelve.open(path, writeback=True)
+
+    @staticmethod
+    def shelf_key(key):
+        return pickle.dumps(key).hex()
+
+    def __getitem__(self, key):
+        return self.shelf[self.shelf_key(key)][1]
+
+    def __setitem__(self, key, value):
+        self.shelf[self.shelf_key(key)] = (key, value)
+
+    def __delitem__(self, key):
+        del self.shelf[self.shelf_key(key)]
+
+    def __contains__(self, key):
+        return self.shelf_key(key) in self.shelf
+
+    def __iter__(self):
+        return (key for key, _ in list(self.shelf.values()))
+
+    def __len__(self):
+        return len(self.shelf)
+
+    def sync(self):
+        self.shelf.sync()
+
+    def close(self):
+        self.shelf.close()
+
+
+def run_online_trials(problem, agent, trials=10, max_steps=1000):
+    """Run an online search agent on an OnlineSearchProblem trials times, each
+    from problem.initial, moving by problem.output until the agent returns no
+    action or max_steps actions have been taken. The agent is reset, not
+    replaced, between trials, so it keeps its tables. Return the number of
+    actions taken in each trial."""
+    steps = []
+    for _ in range(trials):
+        agent.reset()
+        state, n = problem.initial, 0
+        action = agent(state)
+        while action is not None and n < max_steps:
+            state = problem.output(state, action)
+            n += 1
+            action = agent(state)
+        steps.append(n)
+    return steps
+
 
 # ______________________________________________________________________________
 # Genetic Algorithm
@@ -942,6 +1839,166 @@ def genetic_algorithm(population, fitness_fn, gene_pool=[0, 1], f_thres=None, ng
     return max(population, key=fitness_fn),-1
 
 
+def vectorized_genetic_algorithm(population, fitness_fn, gene_pool=[0, 1], f_thres=None, ngen=1000,
+                                 pmut=0.1, batched=False, processes=None):
+    """The genetic_algorithm of Figure 4.8 on a population held as a 2-D numpy
+    array of indexes into gene_pool, one row per individual. Selection
+    (fitness-proportional), one-point crossover and mutation of one random
+    gene with probability pmut are done for the whole population at once, and
+    fitness is computed once per individual per generation.
+    If batched is True, fitness_fn takes a 2-D array of gene values and
+    returns an array of fitnesses; otherwise it is called on each individual
+    as a list. With processes, fitness is evaluated across a process pool
+    (fitness_fn must then be picklable). Returns (fittest individual as a
+    list, generation) as genetic_algorithm does."""
+    rng = np.random.default_rng(random.getrandbits(64))
+    genes = np.array(gene_pool)
+    population = gene_indexes(population, gene_pool)
+    pool = multiprocessing.Pool(processes) if processes else None
+    try:
+        chunks = processes or 1
+        fitness = evaluate_population(population, genes, fitness_fn, batched, pool, chunks)
+        for i in range(ngen):
+            population = next_generation(population, fitness, len(genes), pmut, rng)
+            fitness = evaluate_population(population, genes, fitness_fn, batched, pool, chunks)
+            best = np.argmax(fitness)
+            if f_thres and fitness[best] >= f_thres:
+                return genes[population[best]].tolist(), i
+        return genes[population[np.argmax(fitness)]].tolist(), -1
+    finally:
+        if pool:
+            pool.close()
+
+
+def gene_indexes(population, gene_pool):
+    """A population of individuals (sequences of genes) as a 2-D array of
+    indexes into gene_pool."""
+    index = {gene: i for i, gene in enumerate(gene_pool)}
+    return np.array([[index[gene] for gene in individual] for individual in population])
+
+
+def evaluate_population(population, genes, fitness_fn, batched=False, pool=None, chunks=1):
+    """The fitness of each row of a population of gene indexes, as an array.
+    fitness_fn is given the gene values: a 2-D array of them (in the given
+    number of chunks) if batched, otherwise one list per individual.
+    The calls are mapped over pool if given."""
+    values = genes[population]
+    mapper = pool.map if pool else map
+    if batched:
+        chunks = np.array_split(values, chunks)
+        return np.concatenate([np.asarray(f, dtype=float) for f in mapper(fitness_fn, chunks)])
+    return np.fromiter(mapper(fitness_fn, values.tolist()), dtype=float, count=len(values))
+
+
+def next_generation(population, fitness, gene_count, pmut, rng):
+    """Breed a new population of gene indexes, of the same size, from parents
+    selected in proportion to fitness, by one-point crossover and then, with
+    probability pmut, changing one random gene to a random one of gene_count."""
+    size, n = population.shape
+    totals = np.cumsum(fitness)
+    if totals[-1] > 0:
+        draws = rng.uniform(0, totals[-1], size=2 * size)
+        parents = np.minimum(np.searchsorted(totals, draws, side='right'), size - 1)
+    else:
+        parents = rng.integers(0, size, size=2 * size)
+    x, y = population[parents[:size]], population[parents[size:]]
+    population = np.where(np.arange(n) < rng.integers(0, n, size=size)[:, None], x, y)
+    mutants = np.flatnonzero(rng.random(size) < pmut)
+    population[mutants, rng.integers(0, n, size=len(mutants))] = rng.integers(0, gene_count,
+                                                                             size=len(mutants))
+    return population
+
+
+def island_genetic_algorithm(population, fitness_fn, gene_pool=[0, 1], f_thres=None, ngen=1000,
+                             pmut=0.1, islands=4, migration_interval=10, migrants=2,
+                             topology='ring', batched=False):
+    """An island model of the genetic algorithm: the population is split into
+    islands that evolve in separate processes (see vectorized_genetic_algorithm)
+    and, every migration_interval generations, send copies of their migrants
+    fittest individuals to their neighbours in the topology ('ring': to the
+    next island; 'full': to every other island), where they replace the least
+    fit. This is a generator of statistics events, as dicts:
+        {'generation': g, 'island': k, 'best': ..., 'mean': ...} per island and
+        generation,
+        {'generation': g, 'migration': (k, j), 'migrants': m} per migration,
+    and finally {'generation': g, 'solution': individual, 'fitness': f}, with
+    the fittest individual found. It stops after ngen generations, or at the
+    end of the interval in which an island reaches f_thres."""
+    assert topology in ('ring', 'full')
+    genes = np.array(gene_pool)
+    connections, processes = [], []
+    for k, part in enumerate(np.array_split(gene_indexes(population, gene_pool), islands)):
+        connection, island_end = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=island_worker, daemon=True,
+                                          args=(island_end, part, genes, fitness_fn, batched, pmut,
+                                                f_thres, migrants, random.getrandbits(64)))
+        process.start()
+        connections.append(connection)
+        processes.append(process)
+    immigrants = [None] * islands
+    best, best_fitness, generation = None, -np.inf, 0
+    try:
+        while generation < ngen:
+            interval = min(migration_interval, ngen - generation)
+            for connection, arrivals in zip(connections, immigrants):
+                connection.send((interval, arrivals))
+            emigrants, done = [], False
+            for k, connection in enumerate(connections):
+                stats, leaving, fittest, fitness = connection.recv()
+                for i, (island_best, island_mean) in enumerate(stats):
+                    yield {'generation': generation + i, 'island': k,
+                           'best': island_best, 'mean': island_mean}
+                emigrants.append(leaving)
+                if fitness > best_fitness:
+                    best, best_fitness = fittest, fitness
+                done = done or bool(f_thres and fitness >= f_thres)
+            generation += interval
+            if done or generation >= ngen:
+                break
+            routes = ([(k, (k + 1) % islands) for k in range(islands)] if topology == 'ring' else
+                      [(k, j) for k in range(islands) for j in range(islands) if j != k])
+            immigrants = [[] for _ in range(islands)]
+            for k, j in routes:
+                immigrants[j].append(emigrants[k])
+                yield {'generation': generation, 'migration': (k, j), 'migrants': len(emigrants[k])}
+            immigrants = [np.concatenate(arrivals) if arrivals else None for arrivals in immigrants]
+        yield {'generation': generation, 'solution': genes[best].tolist(), 'fitness': best_fitness}
+    finally:
+        for connection, process in zip(connections, processes):
+            connection.send(None)
+            process.join()
+
+
+def island_worker(connection, population, genes, fitness_fn, batched, pmut, f_thres, migrants,
+                  seed):
+    """The loop of one island of island_genetic_algorithm. It receives
+    (generations, immigrants or None) and answers with the best and mean
+    fitness of each generation (stopping early at f_thres), its fittest
+    individuals as emigrants, and its fittest individual with its fitness."""
+    rng = np.random.default_rng(seed)
+    fitness = evaluate_population(population, genes, fitness_fn, batched)
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        generations, immigrants = message
+        if immigrants is not None:
+            worst = np.argsort(fitness)[:len(immigrants)]
+            population[worst] = immigrants
+            fitness[worst] = evaluate_population(immigrants, genes, fitness_fn, batched)
+        stats = []
+        for _ in range(generations):
+            population = next_generation(population, fitness, len(genes), pmut, rng)
+            fitness = evaluate_population(population, genes, fitness_fn, batched)
+            stats.append((float(fitness.max()), float(fitness.mean())))
+            if f_thres and fitness.max() >= f_thres:
+                break
+        order = np.argsort(fitness)[::-1]
+        connection.send((stats, population[order[:migrants]], population[order[0]],
+                         float(fitness[order[0]])))
+    connection.close()
+
+
 def fitness_threshold(fitness_fn, f_thres, population):
     if not f_thres:
         return None
@@ -1070,6 +2127,111 @@ def UndirectedGraph(graph_dict=None):
     return Graph(graph_dict=graph_dict, directed=False)
 
 
+class CSRGraph:
+    """A read-only graph in compressed sparse row form, for route finding on
+    graphs with millions of edges. Nodes are the integers 0..n-1; the links
+    out of node a are indices[indptr[a]:indptr[a + 1]] (sorted), with lengths
+    in the same slice of the numpy array distances. An undirected graph
+    stores each edge in both directions. Optional (x, y) coordinates, an
+    n x 2 array, are exposed as the locations mapping used by GraphProblem.h.
+    It offers the get/nodes interface of Graph (and a read-only graph_dict
+    view), so GraphProblem and GraphProblemStochastic accept it unchanged.
+    Build one with from_edges, load_edge_list or from_graph."""
+
+    def __init__(self, indptr, indices, distances, coordinates=None, directed=True, names=None):
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.distances = np.asarray(distances, dtype=float)
+        self.directed = directed
+        self.names = names
+        self.graph_dict = ArrayMapping(self.get, np.flatnonzero(np.diff(self.indptr)).tolist())
+        if coordinates is not None:
+            self.coordinates = np.asarray(coordinates, dtype=float)
+            self.locations = ArrayMapping(self.coordinates.__getitem__,
+                                          range(len(self.coordinates)))
+
+    @classmethod
+    def from_edges(cls, sources, targets, distances=None, n=None, coordinates=None, directed=True,
+                   names=None):
+        """Build a graph from parallel arrays of edges (all distances 1 if not
+        given). If an edge is given twice, the last distance given wins, as
+        with Graph.connect."""
+        sources, targets = np.asarray(sources, dtype=np.int64), np.asarray(targets, dtype=np.int64)
+        if distances is None:
+            distances = np.ones(len(sources))
+        else:
+            distances = np.asarray(distances, dtype=float)
+        if not directed:
+            sources, targets = (np.concatenate([sources, targets]),
+                                np.concatenate([targets, sources]))
+            distances = np.concatenate([distances, distances])
+        if n is None:
+            n = int(max(sources.max(initial=-1), targets.max(initial=-1))) + 1
+        order = np.lexsort((np.arange(len(sources)), targets, sources))
+        sources, targets, distances = sources[order], targets[order], distances[order]
+        last = np.ones(len(sources), dtype=bool)
+        last[:-1] = (sources[1:] != sources[:-1]) | (targets[1:] != targets[:-1])
+        sources, targets, distances = sources[last], targets[last], distances[last]
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=n), out=indptr[1:])
+        return cls(indptr, targets, distances, coordinates, directed, names)
+
+    @classmethod
+    def load_edge_list(cls, file, n=None, coordinates=None, directed=True):
+        """Build a graph from a text file (or file name) with one edge per
+        line: source, target and optionally distance, separated by whitespace."""
+        edges = np.loadtxt(file, ndmin=2)
+        return cls.from_edges(edges[:, 0], edges[:, 1], edges[:, 2] if edges.shape[1] > 2 else None,
+                              n, coordinates, directed)
+
+    @classmethod
+    def from_graph(cls, graph):
+        """Convert a Graph; node i of the result is graph.nodes() sorted by
+        str, and names[i] holds the original node."""
+        names = sorted(graph.nodes(), key=str)
+        ids = {node: i for i, node in enumerate(names)}
+        edges = [(ids[a], ids[b], dist)
+                 for a, links in graph.graph_dict.items() for b, dist in links.items()]
+        sources, targets, distances = zip(*edges) if edges else ((), (), ())
+        locations = getattr(graph, 'locations', None)
+        coordinates = [locations[node] for node in names] if locations else None
+        return cls.from_edges(sources, targets, distances, len(names), coordinates, True, names)
+
+    def get(self, a, b=None):
+        """Return a link distance or a dict of {node: distance} entries.
+        .get(a,b) returns the distance or None;
+        .get(a) returns a dict of {node: distance} entries, possibly {}."""
+        start, end = self.indptr[a], self.indptr[a + 1]
+        if b is None:
+            return dict(zip(self.indices[start:end].tolist(), self.distances[start:end].tolist()))
+        i = start + np.searchsorted(self.indices[start:end], b)
+        if i < end and self.indices[i] == b:
+            return self.distances[i].item()
+        return None
+
+    def nodes(self):
+        """Return a list of nodes in the graph."""
+        return list(range(len(self.indptr) - 1))
+
+
+class ArrayMapping(collections.abc.Mapping):
+    """A read-only mapping of the given keys to lookup(key), without storing
+    the values; CSRGraph uses it to present its arrays as dicts."""
+
+    def __init__(self, lookup, keys):
+        self.lookup = lookup
+        self.keys_ = keys
+
+    def __getitem__(self, key):
+        return self.lookup(key)
+
+    def __iter__(self):
+        return iter(self.keys_)
+
+    def __len__(self):
+        return len(self.keys_)
+
+
 def RandomGraph(nodes=list(range(10)), min_links=2, width=400, height=300,
                 curvature=lambda: random.uniform(1.1, 1.5)):
     """Construct a random graph, with the specified nodes, and random links.
@@ -1210,6 +2372,19 @@ class GraphProblem(Problem):
 
         return m
 
+    def reverse(self):
+        """The problem of searching the same graph from the goal back to the
+        initial node, following every edge in the opposite direction."""
+        graph = self.graph
+        if graph.directed:
+            graph = Graph()
+            for a, links in self.graph.graph_dict.items():
+                for b, dist in links.items():
+                    graph.connect1(b, a, dist)
+            if hasattr(self.graph, 'locations'):
+                graph.locations = self.graph.locations
+        return GraphProblem(self.goal, self.initial, graph)
+
     def h(self, node):
         """h function is straight-line distance from a node's state to goal."""
         locs = getattr(self.graph, 'locations', None)
@@ -1238,6 +2413,285 @@ class GraphProblemStochastic(GraphProblem):
         raise NotImplementedError
 
 
+# ______________________________________________________________________________
+# Preprocessing for repeated shortest-path queries on the same graph
+
+
+def dijkstra_distances(adjacency, source):
+    """The shortest distance from source to every node (inf if unreachable),
+    in a graph given as a list of {neighbor: distance} dicts over node ids."""
+    dist = [np.inf] * len(adjacency)
+    dist[source] = 0
+    frontier = [(0, source)]
+    while frontier:
+        d, a = heapq.heappop(frontier)
+        if d > dist[a]:
+            continue
+        for b, w in adjacency[a].items():
+            if d + w < dist[b]:
+                dist[b] = d + w
+                heapq.heappush(frontier, (d + w, b))
+    return np.array(dist)
+
+
+class RouteIndex:
+    """Precomputed tables for answering many shortest-path queries on the same
+    graph (a Graph or CSRGraph, which must not change afterwards).
+    Landmark tables hold the distances from and to a few landmark nodes, chosen
+    far apart; by the triangle inequality d(L, b) - d(L, a) and d(a, L) - d(b, L)
+    are lower bounds on d(a, b), which gives an admissible A* heuristic (ALT) that
+    needs no coordinates and is much tighter than straight-line distance.
+    If contract is true, a contraction hierarchy is built as well: nodes are
+    removed one at a time, least important first, adding a shortcut u->w for
+    each shortest path u->v->w through the removed node v. A query then runs
+    Dijkstra from both ends, following only edges to nodes removed later, which
+    on road networks settles a few hundred nodes however large the graph is.
+    Save the tables with save and reload them with load."""
+
+    def __init__(self, graph, landmarks=8, contract=False, tables=None):
+        self.graph = graph
+        self.names = sorted(graph.nodes(), key=str)
+        self.ids = {name: i for i, name in enumerate(self.names)}
+        self.out = [{} for _ in self.names]
+        for a, links in graph.graph_dict.items():
+            for b, dist in links.items():
+                a_id, b_id = self.ids[a], self.ids[b]
+                if a_id != b_id and dist < self.out[a_id].get(b_id, np.inf):
+                    self.out[a_id][b_id] = dist
+        self.into = [{} for _ in self.names]
+        for a, links in enumerate(self.out):
+            for b, dist in links.items():
+                self.into[b][a] = dist
+        self.up = self.down = self.middle = None
+        if tables is not None:
+            self.landmarks = tables['landmarks']
+            self.from_landmark, self.to_landmark = tables['from_landmark'], tables['to_landmark']
+            if 'up' in tables:
+                self.up, self.down = self.edge_dicts(tables['up']), self.edge_dicts(tables['down'])
+                self.middle = {(u, w): v for u, w, v in tables['middle'].tolist()}
+            return
+        self.choose_landmarks(min(landmarks, len(self.names)))
+        if contract:
+            self.contract()
+
+    def choose_landmarks(self, k):
+        """Pick each landmark as far as possible from those already picked
+        (starting with the node farthest from the first one), and tabulate
+        the distances from and to them as n x k arrays."""
+        landmarks, dists = [], []
+        nearest = dijkstra_distances(self.out, 0) if self.names else np.zeros(0)
+        for _ in range(k):
+            landmark = int(np.argmax(nearest))
+            landmarks.append(landmark)
+            dists.append(dijkstra_distances(self.out, landmark))
+            nearest = np.minimum(nearest, dists[-1]) if len(landmarks) > 1 else dists[-1]
+        self.landmarks = np.array(landmarks, dtype=np.int64)
+        self.from_landmark = np.array(dists).reshape(k, len(self.names)).T.copy()
+        self.to_landmark = np.array([dijkstra_distances(self.into, landmark)
+                                     for landmark in landmarks])
+        self.to_landmark = self.to_landmark.reshape(k, len(self.names)).T.copy()
+
+    def h(self, a, b):
+        """A lower bound on the distance from node a to node b."""
+        a, b = self.ids[a], self.ids[b]
+        with np.errstate(invalid='ignore'):
+            bounds = np.concatenate([self.from_landmark[b] - self.from_landmark[a],
+                                     self.to_landmark[a] - self.to_landmark[b]])
+            bound = np.fmax.reduce(bounds, initial=0)
+        return 0 if np.isnan(bound) else bound.item()
+
+    def problem(self, initial, goal):
+        """A GraphProblem whose h is the landmark lower bound."""
+        return LandmarkGraphProblem(initial, goal, self)
+
+    def contract(self, settle_limit=50):
+        """Build the contraction hierarchy. Nodes are removed in order of edge
+        difference (shortcuts added minus edges removed) plus the number of
+        neighbors already removed, which spreads the removals evenly; priorities
+        are recomputed lazily when a node comes to the front of the queue.
+        Witness searches, which look for a path u->w avoiding v that is no
+        longer than u->v->w, stop after settle_limit nodes; giving up early only
+        adds a shortcut that was not needed."""
+        out = [dict(links) for links in self.out]
+        into = [dict(links) for links in self.into]
+        removed = [0] * len(self.names)
+        self.up, self.down, self.middle = [None] * len(self.names), [None] * len(self.names), {}
+
+        def shortcuts(v):
+            found = []
+            for u, du in into[v].items():
+                limit = du + max(out[v].values(), default=0)
+                dist = self.witness_distances(out, u, v, limit, settle_limit)
+                for w, dw in out[v].items():
+                    if w != u and dist.get(w, np.inf) > du + dw:
+                        found.append((u, w, du + dw))
+            return found
+
+        def priority(v):
+            return len(shortcuts(v)) - len(into[v]) - len(out[v]) + removed[v]
+
+        queue = [(priority(v), v) for v in range(len(self.names))]
+        heapq.heapify(queue)
+        while queue:
+            _, v = heapq.heappop(queue)
+            p = priority(v)
+            if queue and p > queue[0][0]:
+                heapq.heappush(queue, (p, v))
+                continue
+            for u, w, dist in shortcuts(v):
+                if dist < out[u].get(w, np.inf):
+                    out[u][w] = into[w][u] = dist
+                    self.middle[u, w] = v
+            for w in out[v]:
+                del into[w][v]
+                removed[w] += 1
+            for u in into[v]:
+                del out[u][v]
+                removed[u] += 1
+            self.up[v], self.down[v] = out[v], into[v]
+
+    @staticmethod
+    def witness_distances(out, source, avoid, limit, settle_limit):
+        """Dijkstra from source, not passing through avoid, up to distance limit."""
+        dist = {source: 0}
+        frontier = [(0, source)]
+        settled = 0
+        while frontier and settled < settle_limit:
+            d, a = heapq.heappop(frontier)
+            if d > dist[a]:
+                continue
+            if d > limit:
+                break
+            settled += 1
+            for b, w in out[a].items():
+                if b != avoid and d + w < dist.get(b, np.inf):
+                    dist[b] = d + w
+                    heapq.heappush(frontier, (d + w, b))
+        return dist
+
+    def search(self, initial, goal):
+        """A shortest path from initial to goal as a Node, as astar_search would
+        return it, or None. Uses the contraction hierarchy if there is one, and
+        otherwise A* with the landmark heuristic."""
+        if self.up is None:
+            return astar_search(self.problem(initial, goal))
+        dist, hops = self.hierarchy_query(self.ids[initial], self.ids[goal])
+        if hops is None:
+            return None
+        path = self.unpack(hops)
+        node = Node(initial)
+        for a, b in zip(path, path[1:]):
+            node = Node(self.names[b], node, self.names[b], node.path_cost + self.out[a][b])
+        return node
+
+    def distance(self, initial, goal):
+        """The shortest distance from initial to goal (inf if unreachable)."""
+        if self.up is None:
+            node = self.search(initial, goal)
+            return node.path_cost if node else np.inf
+        return self.hierarchy_query(self.ids[initial], self.ids[goal])[0]
+
+    def hierarchy_query(self, s, t):
+        """The shortest distance from node id s to t, and the node ids on the
+        path in the hierarchy (which may use shortcuts), or (inf, None).
+        Dijkstra runs upward from both ends, taking the next node from the side
+        whose frontier is nearer, until neither can improve on the best meeting.
+        A node is not expanded (it is stalled) if a node above it that has been
+        reached already gives a shorter way down to it than its own distance."""
+        edges = (self.up, self.down)
+        dist, parent = ({s: 0}, {t: 0}), ({s: None}, {t: None})
+        frontiers = ([(0, s)], [(0, t)])
+        best, meet = (0, s) if s == t else (np.inf, None)
+        while True:
+            nearest = [frontier[0][0] if frontier else np.inf for frontier in frontiers]
+            if min(nearest) >= best:
+                break
+            side = 0 if nearest[0] <= nearest[1] else 1
+            d, a = heapq.heappop(frontiers[side])
+            known = dist[side]
+            if d > known[a]:
+                continue
+            if d + dist[1 - side].get(a, np.inf) < best:
+                best, meet = d + dist[1 - side][a], a
+            if any(known.get(b, np.inf) + w < d for b, w in edges[1 - side][a].items()):
+                continue
+            for b, w in edges[side][a].items():
+                if d + w < dist[side].get(b, np.inf):
+                    dist[side][b], parent[side][b] = d + w, a
+                    heapq.heappush(frontiers[side], (d + w, b))
+        if meet is None:
+            return np.inf, None
+        forward, a = [], meet
+        while a is not None:
+            forward.append(a)
+            a = parent[0][a]
+        backward, a = [], parent[1][meet]
+        while a is not None:
+            backward.append(a)
+            a = parent[1][a]
+        return best, forward[::-1] + backward
+
+    def unpack(self, hops):
+        """Replace each shortcut on a path of node ids by the edges it stands for."""
+        path = [hops[0]]
+        for a, b in zip(hops, hops[1:]):
+            stack = [(a, b)]
+            while stack:
+                u, w = stack.pop()
+                if (u, w) in self.middle:
+                    v = self.middle[u, w]
+                    stack += [(v, w), (u, v)]
+                else:
+                    path.append(w)
+        return path
+
+    @staticmethod
+    def edge_array(edge_dicts):
+        return np.array([(a, b, dist)
+                         for a, links in enumerate(edge_dicts) for b, dist in links.items()],
+                        dtype=float).reshape(-1, 3)
+
+    def edge_dicts(self, edges):
+        dicts = [{} for _ in self.names]
+        for a, b, dist in edges.tolist():
+            dicts[int(a)][int(b)] = dist
+        return dicts
+
+    def save(self, path):
+        """Write the tables to path as a numpy .npz archive."""
+        tables = dict(landmarks=self.landmarks, from_landmark=self.from_landmark,
+                      to_landmark=self.to_landmark)
+        if self.up is not None:
+            tables.update(up=self.edge_array(self.up), down=self.edge_array(self.down),
+                          middle=np.array([(u, w, v) for (u, w), v in self.middle.items()],
+                                          dtype=np.int64).reshape(-1, 3))
+        with open(path, 'wb') as file:
+            np.savez(file, **tables)
+
+    @classmethod
+    def load(cls, path, graph):
+        """Reload the tables that save wrote for the same graph."""
+        with np.load(path) as tables:
+            return cls(graph, tables=dict(tables))
+
+
+class LandmarkGraphProblem(GraphProblem):
+    """A GraphProblem whose h is the lower bound from a RouteIndex's landmarks."""
+
+    def __init__(self, initial, goal, index):
+        super().__init__(initial, goal, index.graph)
+        self.index = index
+        self.goal_from = index.from_landmark[index.ids[goal]]
+        self.goal_to = index.to_landmark[index.ids[goal]]
+
+    def h(self, node):
+        a = self.index.ids[getattr(node, 'state', node)]
+        with np.errstate(invalid='ignore'):
+            bound = np.fmax(self.goal_from - self.index.from_landmark[a],
+                            self.index.to_landmark[a] - self.goal_to).max(initial=0)
+        return self.index.h(self.index.names[a], self.goal) if np.isnan(bound) else bound.item()
+
+
 # ______________________________________________________________________________
 
 
@@ -1301,12 +2755,50 @@ class NQueensProblem(Problem):
         return num_conflicts
 
 
+class NQueensLocalSearchProblem(Problem):
+    """The complete-state formulation of N-queens, for local search: a state
+    has one queen in every column (state[c] is the row of the queen in column
+    c), an action (c, r) moves the queen of column c to row r, and the value
+    of a state is minus the number of pairs of queens attacking each other."""
+
+    def __init__(self, N, initial=None):
+        super().__init__(tuple(initial or self.random_state(N)))
+        self.N = N
+
+    @staticmethod
+    def random_state(N):
+        return tuple(random.randrange(N) for _ in range(N))
+
+    def actions(self, state):
+        return [(c, r) for c in range(self.N) for r in range(self.N) if r != state[c]]
+
+    def random_action(self, state):
+        c, r = random.randrange(self.N), random.randrange(self.N - 1)
+        return c, (r if r < state[c] else r + 1)
+
+    def result(self, state, action):
+        c, r = action
+        return state[:c] + (r,) + state[c + 1:]
+
+    def value(self, state):
+        pairs = 0
+        for lines in (Counter(state),
+                      Counter(r - c for c, r in enumerate(state)),
+                      Counter(r + c for c, r in enumerate(state))):
+            pairs += sum(k * (k - 1) // 2 for k in lines.values())
+        return -pairs
+
+    def goal_test(self, state):
+        return self.value(state) == 0
+
+
 # ______________________________________________________________________________
 # Inverse Boggle: Search for a high-scoring Boggle board. A good domain for
 # iterative-repair and related search techniques, as suggested by Justin Boyan.
 
 
 ALPHABET = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+LETTERS = frozenset(ALPHABET)
 
 cubes16 = ['FORIXB', 'MOQABJ', 'GURILW', 'SETUPL',
            'CMPDAE', 'ACITAO', 'SLCRAE', 'ROMASH',
@@ -1426,14 +2918,182 @@ class Wordlist:
 # _____________________________________________________________________________
 
 
+class Dawg:
+    """A directed acyclic word graph: a trie in which identical subtrees are
+    shared, so that it is much smaller than the trie, or the sorted word list.
+    Node 0 is the root, and table[node, k] is the node reached by letter
+    ALPHABET[k] (0 if there is none); column 26 is 1 if the node ends a word.
+    The table is a numpy int32 array, which can be saved and memory-mapped
+    back, so a large dictionary is built only once. Use (word in dawg) to
+    check a word, dawg.walk(prefix) to follow a prefix, and dawg.board_words
+    to find the words on a Boggle board."""
+
+    def __init__(self, table, path=None):
+        self.table = table
+        self.path = path
+        self.cells = memoryview(np.ascontiguousarray(table).reshape(-1))
+
+    @classmethod
+    def from_words(cls, words, min_len=3):
+        """Build the graph from an iterable of words (of the letters A-Z, in any
+        case and order), keeping those at least min_len long and skipping any
+        with other characters (like "don't"), which the table cannot hold. The words are
+        added in sorted order and, as each one is added, the nodes no longer
+        on the path of the last word are merged with any equal node already
+        built (Daciuk et al., 2000), so the full trie is never held at once."""
+        children, final = [{}], [False]
+        register = {}
+        unchecked = []  # (parent, letter, child) along the path of the last word
+
+        def minimize(down_to):
+            while len(unchecked) > down_to:
+                parent, letter, child = unchecked.pop()
+                signature = (final[child], tuple(sorted(children[child].items())))
+                if signature in register:
+                    children[parent][letter] = register[signature]
+                else:
+                    register[signature] = child
+
+        previous = ''
+        words = {w.upper() for w in words if len(w) >= min_len}
+        for word in sorted(w for w in words if set(w) <= LETTERS):
+            common = 0
+            while common < min(len(word), len(previous)) and word[common] == previous[common]:
+                common += 1
+            minimize(common)
+            node = unchecked[-1][2] if unchecked else 0
+            for letter in word[common:]:
+                children.append({})
+                final.append(False)
+                children[node][ord(letter) - 65] = len(children) - 1
+                unchecked.append((node, ord(letter) - 65, len(children) - 1))
+                node = len(children) - 1
+            final[node] = True
+            previous = word
+        minimize(0)
+        # number the nodes still in use so that every edge leads to a higher number
+        order, seen, stack = [], {0}, [(0, iter(children[0].values()))]
+        while stack:
+            node, rest = stack[-1]
+            child = next(rest, None)
+            if child is None:
+                order.append(node)
+                stack.pop()
+            elif child not in seen:
+                seen.add(child)
+                stack.append((child, iter(children[child].values())))
+        number = {node: i for i, node in enumerate(reversed(order))}
+        table = np.zeros((len(order), 27), dtype=np.int32)
+        for node, i in number.items():
+            for letter, child in children[node].items():
+                table[i, letter] = number[child]
+            table[i, 26] = final[node]
+        return cls(table)
+
+    @classmethod
+    def from_file(cls, file, min_len=3):
+        """Build the graph from a file of whitespace-separated words."""
+        return cls.from_words(file.read().split(), min_len)
+
+    def save(self, path):
+        np.save(path, self.table)
+
+    @classmethod
+    def load(cls, path):
+        """Memory-map a graph saved with save; it is not read into RAM up front."""
+        return cls(np.load(path, mmap_mode='r'), path)
+
+    def __getstate__(self):
+        # a memory-mapped graph is sent to other processes as its file name
+        return {'path': self.path} if self.path else {'table': np.asarray(self.table)}
+
+    def __setstate__(self, state):
+        self.__init__(np.load(state['path'], mmap_mode='r') if 'path' in state else state['table'],
+                      state.get('path'))
+
+    def walk(self, prefix, node=0):
+        """The node reached by following prefix from node, or None (also if
+        prefix has a character other than the letters A-Z)."""
+        for letter in prefix.upper():
+            if letter not in LETTERS:
+                return None
+            node = self.cells[node * 27 + ord(letter) - 65]
+            if not node:
+                return None
+        return node
+
+    def __contains__(self, word):
+        node = self.walk(word)
+        return node is not None and self.cells[node * 27 + 26] == 1
+
+    def __len__(self):
+        """The number of words (every edge leads to a higher-numbered node)."""
+        table = np.asarray(self.table)
+        counts = table[:, 26].astype(np.int64)
+        for node in range(len(table) - 1, -1, -1):
+            children = table[node, :26]
+            counts[node] += counts[children[children > 0]].sum()
+        return int(counts[0])
+
+    def board_words(self, board):
+        """The words on a Boggle board, in the order they are found: paths of
+        adjacent squares, each used once, that spell a word ('Q' is 'QU').
+        As in the original recursive finder, which noted a word only on
+        stepping from its last square into a further one, a path counts only
+        if its last square has a neighbor not on the path. The search is a
+        depth-first walk of the board and the graph together, with an
+        explicit stack and a bitmask of the squares on the path."""
+        cells, neighbors = self.cells, boggle_neighbors(len(board))
+        codes = [ord(c) - 65 for c in board]
+        letters = ['QU' if c == 'Q' else c for c in board]
+        q, u = ord('Q') - 65, ord('U') - 65
+        found = {}
+        for start in range(len(board)):
+            node = cells[codes[start]]
+            if node and codes[start] == q:
+                node = cells[node * 27 + u]
+            if not node:
+                continue
+            path, visited = [start], 1 << start
+            if cells[node * 27 + 26] and neighbors[start]:
+                found[letters[start]] = True
+            stack = [(start, node, iter(neighbors[start]))]
+            while stack:
+                square, node, rest = stack[-1]
+                j = next(rest, None)
+                if j is None:
+                    stack.pop()
+                    path.pop()
+                    visited &= ~(1 << square)
+                    continue
+                if visited >> j & 1:
+                    continue
+                child = cells[node * 27 + codes[j]]
+                if child and codes[j] == q:
+                    child = cells[child * 27 + u]
+                if child:
+                    path.append(j)
+                    visited |= 1 << j
+                    if cells[child * 27 + 26] and any(not visited >> k & 1 for k in neighbors[j]):
+                        found[''.join([letters[i] for i in path])] = True
+                    stack.append((j, child, iter(neighbors[j])))
+        return list(found)
+
+
+# _____________________________________________________________________________
+
+
 class BoggleFinder:
     """A class that allows you to find all the words in a Boggle board."""
 
-    wordlist = None  # A class variable, holding a wordlist
+    dawg = None  # A class variable, holding the Dawg of the word list
 
-    def __init__(self, board=None):
-        if BoggleFinder.wordlist is None:
-            BoggleFinder.wordlist = Wordlist(open_data("EN-text/wordlist.txt"))
+    def __init__(self, board=None, dawg=None):
+        if dawg is None:
+            if BoggleFinder.dawg is None:
+                BoggleFinder.dawg = Dawg.from_file(open_data("EN-text/wordlist.txt"))
+            dawg = BoggleFinder.dawg
+        self.dawg = dawg
         self.found = {}
         if board:
             self.set_board(board)
@@ -1443,32 +3103,9 @@ class BoggleFinder:
         if board is None:
             board = random_boggle()
         self.board = board
-        self.neighbors = boggle_neighbors(len(board))
-        self.found = {}
-        for i in range(len(board)):
-            lo, hi = self.wordlist.bounds[board[i]]
-            self.find(lo, hi, i, [], '')
+        self.found = dict.fromkeys(self.dawg.board_words(board), True)
         return self
 
-    def find(self, lo, hi, i, visited, prefix):
-        """Looking in square i, find the words that continue the prefix,
-        considering the entries in self.wordlist.words[lo:hi], and not
-        revisiting the squares in visited."""
-        if i in visited:
-            return
-        wordpos, is_word = self.wordlist.lookup(prefix, lo, hi)
-        if wordpos is not None:
-            if is_word:
-                self.found[prefix] = True
-            visited.append(i)
-            c = self.board[i]
-            if c == 'Q':
-                c = 'QU'
-            prefix += c
-            for j in self.neighbors[i]:
-                self.find(wordpos, hi, j, visited, prefix)
-            visited.pop()
-
     def words(self):
         """The words found."""
         return list(self.found.keys())
@@ -1484,25 +3121,71 @@ class BoggleFinder:
         return len(self.found)
 
 
+def score_boggle_boards(boards, dawg=None, processes=None, pool=None):
+    """Find the words on each of many boards, split among processes (all CPUs
+    by default, or the given multiprocessing pool; processes=1 runs them
+    here). Return a (number of words, score) pair for each board. A Dawg
+    loaded with Dawg.load is sent to the workers as its file name and
+    memory-mapped there."""
+    if dawg is None:
+        dawg = BoggleFinder().dawg
+    boards = [list(board) for board in boards]
+    if pool is None and processes == 1:
+        return [boggle_board_score(board, dawg) for board in boards]
+    own_pool = pool is None
+    pool = pool or multiprocessing.Pool(processes)
+    chunksize = max(1, len(boards) // (4 * (processes or os.cpu_count() or 1)))
+    try:
+        return pool.starmap(boggle_board_score, [(board, dawg) for board in boards], chunksize)
+    finally:
+        if own_pool:
+            pool.close()
+
+
+def boggle_board_score(board, dawg):
+    words = dawg.board_words(board)
+    return len(words), sum(BoggleFinder.scores[len(w)] for w in words)
+
+
 # _____________________________________________________________________________
 
 
-def boggle_hill_climbing(board=None, ntimes=100, verbose=True):
+def boggle_hill_climbing(board=None, ntimes=100, verbose=True, batch=1, processes=None, dawg=None):
     """Solve inverse Boggle by hill-climbing: find a high-scoring board by
-    starting with a random one and changing it."""
-    finder = BoggleFinder()
+    starting with a random one and changing it. With batch > 1, each of the
+    ntimes steps tries batch random changes at once, scored in parallel by
+    score_boggle_boards, and keeps the best one if it is an improvement."""
+    finder = BoggleFinder(dawg=dawg)
     if board is None:
         board = random_boggle()
     best = len(finder.set_board(board))
-    for _ in range(ntimes):
-        i, oldc = mutate_boggle(board)
-        new = len(finder.set_board(board))
-        if new > best:
-            best = new
-            if verbose:
-                print(best, _, board)
-        else:
-            board[i] = oldc  # Change back
+    if batch > 1:
+        pool = None if processes == 1 else multiprocessing.Pool(processes)
+        try:
+            for _ in range(ntimes):
+                candidates = [list(board) for _ in range(batch)]
+                for candidate in candidates:
+                    mutate_boggle(candidate)
+                scores = score_boggle_boards(candidates, finder.dawg, processes, pool)
+                k = max(range(batch), key=lambda k: scores[k][0])
+                if scores[k][0] > best:
+                    best = scores[k][0]
+                    board[:] = candidates[k]
+                    if verbose:
+                        print(best, _, board)
+        finally:
+            if pool:
+                pool.close()
+    else:
+        for _ in range(ntimes):
+            i, oldc = mutate_boggle(board)
+            new = len(finder.set_board(board))
+            if new > best:
+                best = new
+                if verbose:
+                    print(best, _, board)
+            else:
+                board[i] = oldc  # Change back
     if verbose:
         print_boggle(board)
     return board, best
@@ -1527,8 +3210,15 @@ class InstrumentedProblem(Problem):
     def __init__(self, problem):
         self.problem = problem
         self.succs = self.goal_tests = self.states = 0
+        self.peak_nodes = 0
         self.found = None
 
+    def record_nodes(self, n):
+        """Searchers that track the nodes they hold in memory report the
+        count here; the largest is kept in peak_nodes."""
+        if n > self.peak_nodes:
+            self.peak_nodes = n
+
     def actions(self, state):
         self.succs += 1
         return self.problem.actions(state)
@@ -1550,6 +3240,13 @@ class InstrumentedProblem(Problem):
     def value(self, state):
         return self.problem.value(state)
 
+    def random_action(self, state):
+        self.succs += 1
+        return self.problem.random_action(state)
+
+    def state_key(self, state):
+        return self.problem.state_key(state)
+
     def __getattr__(self, attr):
         return getattr(self.problem, attr)
 
@@ -1574,6 +3271,104 @@ def compare_searchers(problems, header,
     print_table(table, header)
 
 
+portfolio_fields = ['searcher', 'problem', 'status', 'wall_time', 'peak_rss_kb',
+                    'succs', 'goal_tests', 'states', 'peak_nodes', 'path_cost']
+
+
+def search_task(searcher, problem, max_memory=None):
+    """Run searcher on problem (wrapped in an InstrumentedProblem) in this
+    process and return a dict of the portfolio_fields. If max_memory (bytes)
+    is given, the address space of the process is capped at it first, so it
+    should be a process of its own. peak_rss_kb is that of the whole process."""
+    if max_memory and resource:
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory, max_memory))
+    p = InstrumentedProblem(problem)
+    start = time.perf_counter()
+    try:
+        result = searcher(p)
+        status = 'solved' if p.found is not None else 'failed'
+    except MemoryError:
+        result, status = None, 'memory'
+    except Exception as e:
+        result, status = None, 'error: {!r}'.format(e)
+    row = task_row(searcher, problem, status, time.perf_counter() - start)
+    path_cost = float(result.path_cost) if isinstance(result, (Node, CompactNode)) else None
+    row.update(succs=p.succs, goal_tests=p.goal_tests, states=p.states, peak_nodes=p.peak_nodes,
+               path_cost=path_cost)
+    if resource:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        row['peak_rss_kb'] = rss // 1024 if sys.platform == 'darwin' else rss
+    return row
+
+
+def task_row(searcher, problem, status, wall_time):
+    """A row of portfolio_fields with only the names, status and time filled in."""
+    row = dict.fromkeys(portfolio_fields)
+    row.update(searcher=name(searcher), status=status, wall_time=round(wall_time, 6),
+               problem='{}({}, {})'.format(name(problem), problem.initial, problem.goal))
+    return row
+
+
+def search_task_worker(conn, searcher, problem, max_memory):
+    conn.send(search_task(searcher, problem, max_memory))
+    conn.close()
+
+
+def run_search_portfolio(problems, searchers, processes=None, timeout=None, max_memory=None,
+                         csv_path=None, json_path=None):
+    """Run every searcher on every problem, each pair in a fresh process, with
+    up to processes (default: the number of CPUs) running at once. A task is
+    killed after timeout seconds, and its address space is capped at
+    max_memory bytes where the platform allows. Return a list of dicts of the
+    portfolio_fields, searcher-major like compare_searchers, and also write
+    them to csv_path and/or json_path if given. status is 'solved', 'failed',
+    'timeout', 'memory', 'crashed' or 'error: ...'."""
+    problems, searchers = list(problems), list(searchers)
+    tasks = deque(enumerate((s, p) for s in searchers for p in problems))
+    results = [None] * len(tasks)
+    processes = processes or os.cpu_count()
+    running = {}
+    while tasks or running:
+        while tasks and len(running) < processes:
+            i, (searcher, problem) = tasks.popleft()
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=search_task_worker, daemon=True,
+                                              args=(sender, searcher, problem, max_memory))
+            process.start()
+            sender.close()
+            running[receiver] = (i, process, time.monotonic())
+        wait = None
+        if timeout is not None:
+            first_started = min(started for _, _, started in running.values())
+            wait = max(0, first_started + timeout - time.monotonic())
+        for receiver in multiprocessing.connection.wait(list(running), wait):
+            i, process, started = running.pop(receiver)
+            try:
+                results[i] = receiver.recv()
+            except EOFError:
+                searcher, problem = searchers[i // len(problems)], problems[i % len(problems)]
+                results[i] = task_row(searcher, problem, 'crashed', time.monotonic() - started)
+            receiver.close()
+            process.join()
+        for receiver, (i, process, started) in list(running.items()):
+            if timeout is not None and time.monotonic() - started >= timeout:
+                process.kill()
+                process.join()
+                receiver.close()
+                del running[receiver]
+                searcher, problem = searchers[i // len(problems)], problems[i % len(problems)]
+                results[i] = task_row(searcher, problem, 'timeout', time.monotonic() - started)
+    if csv_path:
+        with open(csv_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, portfolio_fields)
+            writer.writeheader()
+            writer.writerows(results)
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
 def compare_graph_searchers():
     """Prints a table of search results."""
     compare_searchers(problems=[GraphProblem('Arad', 'Bucharest', romania_map),
@@ -1581,3 +3376,168 @@ def compare_graph_searchers():
                                 GraphProblem('Q', 'WA', australia_map)],
                       header=['Searcher', 'romania_map(Arad, Bucharest)',
                               'romania_map(Oradea, Neamt)', 'australia_map'])
+
+
+def compare_priority_queues(problems=None, queues=(PriorityQueue, IndexedPriorityQueue)):
+    """Print the seconds taken by A* on each problem with each kind of frontier
+    queue. By default the problems are a large RandomGraph route and a hard
+    EightPuzzle, where the linear scans of PriorityQueue dominate."""
+    if problems is None:
+        graph = RandomGraph(list(range(1000)), min_links=3, width=2000, height=2000)
+        problems = [GraphProblem(0, 999, graph),
+                    EightPuzzle((5, 2, 8, 4, 1, 7, 0, 3, 6))]
+
+    def do(queue, problem):
+        h = memoize(problem.h, 'h')
+        start = time.perf_counter()
+        best_first_graph_search(problem, lambda n: n.path_cost + h(n), queue=queue)
+        return round(time.perf_counter() - start, 3)
+
+    table = [[name(q)] + [do(q, p) for p in problems] for q in queues]
+    print_table(table, ['Queue'] + [name(p) for p in problems])
+
+
+def compare_node_memory(problem=None, node_types=(Node, CompactNode)):
+    """Print the peak memory (in KB, as traced by tracemalloc) used by A* on
+    the problem with each kind of search tree node, by default on a
+    22-move EightPuzzle."""
+    import tracemalloc
+    problem = problem or EightPuzzle((5, 2, 8, 4, 1, 7, 0, 3, 6))
+
+    def do(node_type):
+        tracemalloc.start()
+        astar_search(problem, node_type=node_type)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak // 1024
+
+    print_table([[name(t), do(t)] for t in node_types], ['Node type', 'Peak KB'])
+
+
+def compare_bidirectional_astar(problems=None):
+    """Print the number of nodes expanded (and the path cost found) by
+    astar_search and bidirectional_astar_search on each GraphProblem. By
+    default the problems are Arad to Bucharest and a long route across a
+    1000-node RandomGraph."""
+    if problems is None:
+        graph = RandomGraph(list(range(1000)), min_links=3, width=2000, height=2000)
+        start = min(graph.locations, key=lambda n: sum(graph.locations[n]))
+        goal = max(graph.locations, key=lambda n: sum(graph.locations[n]))
+        problems = [GraphProblem('Arad', 'Bucharest', romania_map),
+                    GraphProblem(start, goal, graph)]
+
+    def do(searcher, problem):
+        forward, backward = InstrumentedProblem(problem), InstrumentedProblem(problem.reverse())
+        if searcher is astar_search:
+            node = astar_search(forward)
+        else:
+            node = searcher(forward, backward)
+        return '{} ({})'.format(forward.succs + backward.succs, node and node.path_cost)
+
+    table = [[name(s)] + [do(s, p) for p in problems]
+             for s in [astar_search, bidirectional_astar_search]]
+    print_table(table, ['Searcher'] +
+                ['{}({}, {})'.format(name(p), p.initial, p.goal) for p in problems])
+
+
+def compare_local_searchers(problems=None, searchers=None):
+    """Print the value of the state found, and the seconds taken, by local
+    searchers on a random 100 x 100 PeakFindingProblem and a 32-queens
+    NQueensLocalSearchProblem, or on the given (problem, random_state,
+    temperatures for parallel_tempering) triples."""
+    if problems is None:
+        grid = [[random.randrange(1000) for _ in range(100)] for _ in range(100)]
+        problems = [(PeakFindingProblem((0, 0), grid, directions8),
+                     lambda: (random.randrange(100), random.randrange(100)), (10, 30, 100, 300)),
+                    (NQueensLocalSearchProblem(32),
+                     lambda: NQueensLocalSearchProblem.random_state(32), (0.1, 0.2, 0.4, 0.8, 1.6))]
+    searchers = searchers or [
+        ('hill_climbing', lambda p, r, ts: hill_climbing(p)),
+        ('random_restart_hill_climbing',
+         lambda p, r, ts: random_restart_hill_climbing(p, r, restarts=10)),
+        ('tabu_search', lambda p, r, ts: tabu_search(p, tabu_size=20, max_steps=200)),
+        ('simulated_annealing', lambda p, r, ts: simulated_annealing(p, exp_schedule(limit=5000))),
+        ('parallel_tempering', lambda p, r, ts: parallel_tempering(p, ts, steps=5000))]
+
+    def do(searcher, problem, random_state, temperatures):
+        start = time.perf_counter()
+        state = searcher(problem, random_state, temperatures)
+        return '{} ({:.2f}s)'.format(problem.value(state), time.perf_counter() - start)
+
+    table = [[label] + [do(s, *p) for p in problems] for label, s in searchers]
+    print_table(table, ['Searcher'] + [name(p[0]) for p in problems])
+
+
+def compare_route_queries(graph=None, queries=100):
+    """Print the seconds per query for astar_search with straight-line h, A*
+    with the landmark heuristic of a RouteIndex, and its contraction hierarchy,
+    on random queries, along with the seconds spent building the index. By
+    default the graph is a 50 x 50 grid of roads whose lengths are from one to
+    three times the straight-line distance, as travel times on a road map are."""
+    if graph is None:
+        graph = Graph(directed=False)
+        graph.locations = {(x, y): (10 * x, 10 * y) for x in range(50) for y in range(50)}
+        for x, y in graph.locations:
+            for neighbor in [(x + 1, y), (x, y + 1)]:
+                if neighbor in graph.locations:
+                    graph.connect((x, y), neighbor, random.randint(10, 30))
+    start = time.perf_counter()
+    index = RouteIndex(graph, contract=True)
+    built = time.perf_counter() - start
+    nodes = graph.nodes()
+    pairs = [(random.choice(nodes), random.choice(nodes)) for _ in range(queries)]
+
+    def do(search):
+        start = time.perf_counter()
+        for a, b in pairs:
+            search(a, b)
+        return '{:.6f}'.format((time.perf_counter() - start) / queries)
+
+    print_table([['astar_search', do(lambda a, b: astar_search(GraphProblem(a, b, graph)))],
+                 ['landmarks (ALT)', do(lambda a, b: astar_search(index.problem(a, b)))],
+                 ['contraction hierarchy', do(index.distance)]],
+                ['Query', 'Seconds'])
+    print('Built the index in {:.1f}s'.format(built))
+
+
+def compare_batched_heuristics(problems=None):
+    """Print the seconds astar_search takes on each NPuzzle when it calls
+    problem.h once per node and when it calls problem.h_batch (numpy Manhattan
+    distances) once per expansion, with the length of the solution found.
+    By default the problems are a 31-move 8-puzzle and a 40-move 15-puzzle."""
+    problems = problems or [NPuzzle((8, 6, 7, 2, 5, 4, 3, 0, 1)),
+                            NPuzzle((2, 7, 11, 5, 13, 0, 9, 4, 14, 1, 8, 6, 10, 3, 12, 15))]
+
+    def do(problem, batched):
+        start = time.perf_counter()
+        node = astar_search(problem, None if batched else problem.h)
+        return '{:.3f}s ({})'.format(time.perf_counter() - start, node.path_cost)
+
+    print_table([[label] + [do(p, batched) for p in problems]
+                 for label, batched in [('h', False), ('h_batch', True)]],
+                ['Heuristic'] + ['{}-puzzle'.format(len(p.initial) - 1) for p in problems])
+
+
+def compare_online_trials(problem=None, trials=8):
+    """Print the steps taken in each of several trials by LRTAStarAgent when
+    each trial starts with a new (cold) H table, when H is kept from one
+    trial to the next (warm), and when a new agent is restored from a
+    snapshot of the warm agent's H. By default the problem is crossing a
+    10 x 10 grid, walled in places, with h = 0."""
+    if problem is None:
+        walls = {(x, 5) for x in range(1, 10)} | {(x, 2) for x in range(0, 9)}
+        cells = [(x, y) for x in range(10) for y in range(10) if (x, y) not in walls]
+        moves = dict(Right=(1, 0), Left=(-1, 0), Up=(0, 1), Down=(0, -1))
+        grid = Graph({(x, y): {a: (x + dx, y + dy)
+                               for a, (dx, dy) in moves.items() if (x + dx, y + dy) in cells}
+                      for x, y in cells})
+        grid.least_costs = {cell: 0 for cell in cells}
+        problem = OnlineSearchProblem((0, 0), (9, 9), grid)
+    warm = LRTAStarAgent(problem)
+    table = [['cold'] + [run_online_trials(problem, LRTAStarAgent(problem), 1)[0]
+                         for _ in range(trials)],
+             ['warm'] + run_online_trials(problem, warm, trials)]
+    restored = LRTAStarAgent(problem)
+    restored.restore(warm.snapshot())
+    table.append(['restored'] + run_online_trials(problem, restored, trials))
+    print_table(table, ['LRTAStarAgent H'] + ['Trial {}'.format(i + 1) for i in range(trials)])
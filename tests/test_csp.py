@@ -89,6 +89,16 @@ def test_csp_suppose():
     assert removals == [('A', '2'), ('A', '3')]
     assert map_coloring_test.curr_domains == {'A': ['1'], 'B': ['1', '2', '3'], 'C': ['1', '2', '3']}
 
+    # A list domain is replaced, not changed in place; a BitDomain stays one
+    domain = map_coloring_test.curr_domains['B']
+    map_coloring_test.suppose('B', '2')
+    assert domain == ['1', '2', '3'] and map_coloring_test.curr_domains['B'] == ['2']
+    map_coloring_test = MapColoringCSP(list('123'), 'A: B C; B: C; C: ')
+    map_coloring_test.bitsets = True
+    map_coloring_test.suppose(var, value)
+    assert isinstance(map_coloring_test.curr_domains['A'], BitDomain)
+    assert list(map_coloring_test.curr_domains['A']) == ['1']
+
 
 def test_csp_prune():
     map_coloring_test = MapColoringCSP(list('123'), 'A: B C; B: C; C: ')
@@ -144,6 +154,21 @@ def test_csp_restore():
     assert map_coloring_test.curr_domains == {'A': ['2', '3', '1'], 'B': ['1', '2', '3'], 'C': ['2', '3']}
 
 
+def test_csp_trail():
+    map_coloring_test = MapColoringCSP(list('123'), 'A: B C; B: C; C: ')
+    map_coloring_test.push_level()
+    map_coloring_test.suppose('A', '1', map_coloring_test.trail)
+    map_coloring_test.push_level()
+    assert forward_checking(map_coloring_test, 'A', '1', {'A': '1'}, map_coloring_test.trail)
+    map_coloring_test.prune('C', '2', map_coloring_test.trail)
+    assert map_coloring_test.curr_domains == {'A': ['1'], 'B': ['2', '3'], 'C': ['3']}
+    map_coloring_test.pop_level()
+    assert map_coloring_test.curr_domains == {'A': ['1'], 'B': ['2', '3', '1'], 'C': ['3', '1', '2']}
+    map_coloring_test.pop_level()
+    assert map_coloring_test.trail == [] and map_coloring_test.levels == []
+    assert map_coloring_test.curr_domains == {'A': ['1', '2', '3'], 'B': ['2', '3', '1'], 'C': ['3', '1', '2']}
+
+
 def test_csp_conflicted_vars():
     map_coloring_test = MapColoringCSP(list('123'), 'A: B C; B: C; C: ')
 
@@ -316,6 +341,61 @@ def test_mrv():
     assert mrv(assignment, csp) == 'C'
 
 
+def test_indexed_mrv():
+    neighbors = parse_neighbors('A: B C; B: C; C: ')
+    domains = {'A': [0, 1, 2, 3, 4], 'B': [0, 1, 2, 3, 4, 5, 6], 'C': [0, 1, 2, 3, 4]}
+    csp = CSP(variables=None, domains=domains, neighbors=neighbors, constraints=lambda X, x, Y, y: x != y)
+    assignment = {}
+
+    assert indexed_mrv(assignment, csp) in ('A', 'C')
+
+    csp.assign('A', 0, assignment)
+    assert indexed_mrv(assignment, csp) == 'C'
+
+    csp.push_level()
+    forward_checking(csp, 'A', 0, assignment, csp.trail)
+    csp.prune('B', 6, csp.trail)
+    csp.prune('B', 5, csp.trail)
+    csp.prune('B', 4, csp.trail)
+    assert indexed_mrv(assignment, csp) == 'B'
+
+    csp.pop_level()
+    assert indexed_mrv(assignment, csp) == 'C'
+    csp.unassign('A', assignment)
+    assert csp.size_index[5] == {'A', 'C'}
+
+    # a domain narrowed before the index is built can still grow back
+    csp = CSP(variables=None, domains=domains, neighbors=neighbors, constraints=lambda X, x, Y, y: x != y)
+    removals = csp.suppose('B', 0)
+    assert indexed_mrv({}, csp) == 'B'
+    csp.restore(removals)
+    assert csp.size_index[7] == {'B'}
+
+    for inference in [forward_checking, mac]:
+        sudoku = Sudoku(harder1)
+        assert backtracking_search(sudoku, indexed_mrv, indexed_lcv, inference) is not None
+        assert sudoku.goal_test(sudoku.infer_assignment())
+
+
+def test_dom_wdeg():
+    csp = MapColoringCSP(list('RG'), 'A: B C D; B: C; D: ')
+    csp.support_pruning()
+    csp.weights = defaultdict(Counter)
+    csp.weights['B']['C'] = csp.weights['C']['B'] = 3
+    assert dom_wdeg({}, csp) in ('B', 'C')
+    assert dom_wdeg({'A': 'R'}, csp) in ('B', 'C')
+    assert dom_wdeg({'B': 'R'}, csp) == 'A'
+
+    csp.prune('C', 'G', None)
+    assert not forward_checking(csp, 'A', 'R', {'A': 'R'}, [])
+    assert csp.weights['C']['A'] == csp.weights['A']['C'] == 1
+
+    random.seed(2)
+    sudoku = Sudoku(harder1)
+    assert backtracking_search(sudoku, dom_wdeg, inference=mac) is not None
+    assert sudoku.goal_test(sudoku.infer_assignment())
+
+
 def test_unordered_domain_values():
     map_coloring_test = MapColoringCSP(list('123'), 'A: B C; B: C; C: ')
     assignment = None
@@ -387,6 +467,58 @@ def test_backtracking_search():
     assert backtracking_search(australia_csp, inference=forward_checking)
     assert backtracking_search(australia_csp, inference=mac)
     assert backtracking_search(usa_csp, select_unassigned_variable=mrv, order_domain_values=lcv, inference=mac)
+    for inference in [forward_checking, mac]:
+        solutions = []
+        for trail in [False, True]:
+            random.seed(1)
+            solutions.append(backtracking_search(Sudoku(harder1), mrv, inference=inference, trail=trail))
+        assert solutions[0] == solutions[1] and solutions[0] is not None
+
+
+def test_backjumping():
+    for inference in [no_inference, forward_checking, mac]:
+        counts = []
+        for options in [{}, dict(backjumping=True), dict(nogoods=NogoodStore()),
+                        dict(nogoods=NogoodStore(max_literals=10), trail=False)]:
+            zebra = Zebra()
+            assert zebra.goal_test(backtracking_search(zebra, inference=inference, **options))
+            counts.append(zebra.nassigns)
+        assert counts[1] < counts[0] and counts[2] < counts[0]
+    queens = NQueensCSP(8)
+    queens.bitsets = True
+    solution = backtracking_search(queens, mrv, inference=forward_checking, nogoods=NogoodStore())
+    assert all(CSP.nconflicts(queens, var, solution[var], solution) == 0 for var in queens.variables)
+    for inference in [no_inference, forward_checking, mac]:
+        k4 = MapColoringCSP(list('RGB'), 'A: B C D; B: C D; C: D')
+        assert backtracking_search(k4, inference=inference, backjumping=True) is None
+        assert backtracking_search(k4, inference=inference, nogoods=NogoodStore()) is None
+
+
+def test_nogood_store():
+    csp = MapColoringCSP([1, 2, 3], 'A: B C; B: C; D: E F; E: F')
+    csp.support_pruning()
+    store = NogoodStore(max_literals=6)
+    store.add([('A', 1), ('B', 2), ('C', 3)])
+    store.add([('A', 1), ('B', 2), ('C', 3)])
+    assert len(store) == 1 and store.literals == 3
+    assignment, reasons, removals = {'C': 3}, {}, []
+    assert store.propagate(csp, 'C', 3, assignment, removals, reasons)
+    assert removals == []
+    assignment['A'] = 1
+    assert store.propagate(csp, 'A', 1, assignment, removals, reasons)
+    assert removals == [('B', 2)] and reasons[('B', 2)] == {'A', 'C'}
+    assert csp.curr_domains['B'] == [1, 3]
+
+    store.add([('D', 1), ('E', 1)])
+    store.add([('D', 2), ('E', 2), ('F', 2)])
+    assert len(store) == 1 and store.evicted == 2 and store.literals == 3
+    assert ('D', 1) not in store.watches
+
+    store = NogoodStore(max_length=1)
+    store.add([('D', 1), ('E', 1)])
+    store.add([('D', 1)])
+    assert len(store) == 1
+    assert not store.propagate(csp, 'D', 1, {'D': 1}, [], {})
 
 
 def test_min_conflicts():
@@ -402,6 +534,33 @@ def test_min_conflicts():
     assert min_conflicts(NQueensCSP(3), 1000) is None
 
 
+def test_conflict_counts():
+    csp = MapColoringCSP(list('RGB'), usa_csp.neighbors)
+    current = {}
+    csp.support_conflict_counts(current)
+    random.seed(3)
+    for _ in range(300):
+        var = random.choice(csp.variables)
+        if random.random() < 0.2:
+            csp.unassign(var, current)
+        else:
+            csp.assign(var, random.choice(csp.domains[var]), current)
+    for var in csp.variables:
+        for val in csp.domains[var]:
+            assert csp.nconflicts(var, val, current) == CSP.nconflicts(csp, var, val, dict(current))
+    assert set(csp.conflicted_vars(current)) == {var for var in current
+                                                 if CSP.nconflicts(csp, var, current[var], dict(current))}
+
+    # Both ways take the same random choices, on a CSP that takes many steps
+    for incremental in [False, True]:
+        csp = MapColoringCSP(list('RGBY'), usa_csp.neighbors)
+        random.seed(2)
+        result = (min_conflicts(csp, 5000, incremental=incremental), csp.nassigns)
+        if not incremental:
+            expected = result
+        assert result == expected and result[0] and result[1] > len(csp.variables)
+
+
 def test_nqueens_csp():
     csp = NQueensCSP(8)
 
@@ -516,6 +675,39 @@ def test_ac_search_solver():
                                                  'C1': 1, 'C2': 1, 'C3': 0, 'C4': 1}
 
 
+def test_gac_solver():
+    assert gac_solver(send_more_money) == {'S': 9, 'M': 1, 'E': 5, 'N': 6, 'D': 7, 'O': 0, 'R': 8, 'Y': 2,
+                                           'C1': 1, 'C2': 1, 'C3': 0, 'C4': 1}
+    for csp in [csp_crossword, two_two_four, Crossword(crossword1, words1), Kakuro(kakuro2), Kakuro(kakuro4)]:
+        solution = gac_solver(csp)
+        assert len(solution) == len(csp.variables) and csp.consistent(solution)
+    for csp in [csp_crossword, two_two_four, Crossword(crossword1, words1)]:
+        consistent, domains, _ = ACSolver(csp).GAC()
+        assert GACSolver(csp).GAC()[:2] == (consistent, {var: set(domains[var]) for var in domains})
+
+    # Only 1 and 2 are left for A and B, so C cannot be either
+    all_diff = NaryCSP({'A': {1, 2}, 'B': {1, 2}, 'C': {1, 2, 3}}, [Constraint(('A', 'B', 'C'), all_diff_constraint)])
+    assert GACSolver(all_diff).GAC()[:2] == (True, {'A': {1, 2}, 'B': {1, 2}, 'C': {3}})
+    all_diff.domains['C'] = {1, 2}
+    assert not GACSolver(all_diff).GAC()[0]
+
+    total = NaryCSP({'A': set(range(1, 10)), 'B': {1, 2}}, [Constraint(('A', 'B'), sum_constraint(10))])
+    assert GACSolver(total).GAC()[:2] == (True, {'A': {8, 9}, 'B': {1, 2}})
+
+    ordered = NaryCSP({'A': {1, 2, 3}, 'B': {1, 2, 3}}, [Constraint(('A', 'B'), lambda a, b: a < b)])
+    solver = GACSolver(ordered, max_table=0)
+    assert solver.propagators[ordered.constraints[0]] == solver.residual_supports
+    assert solver.GAC()[:2] == (True, {'A': {1, 2}, 'B': {2, 3}})
+    assert solver.residues
+
+
+def test_strongly_connected_components():
+    component = strongly_connected_components({1: [2], 2: [3], 3: [1, 4], 4: [5], 5: [4], 6: []})
+    assert component[1] == component[2] == component[3]
+    assert component[4] == component[5] != component[1]
+    assert len(set(component.values())) == 3
+
+
 def test_different_values_constraint():
     assert different_values_constraint('A', 1, 'B', 2)
     assert not different_values_constraint('A', 1, 'B', 1)
@@ -533,6 +725,31 @@ def test_sudoku():
     assert backtracking_search(g, select_unassigned_variable=mrv, inference=forward_checking) is not None
 
 
+def test_solve_sudokus(tmp_path):
+    solution, seconds = solve_sudoku(easy1)
+    assert seconds > 0
+    sudoku = Sudoku(solution)
+    assert sudoku.goal_test({var: sudoku.domains[var][0] for var in sudoku.variables})
+    assert all(ch == '.' or ch == digit for ch, digit in zip(easy1, solution))
+    assert batch_sudoku(harder1).domains is batch_sudoku(easy1).domains
+    assert all(isinstance(domain, BitDomain) for domain in batch_sudoku(easy1).curr_domains.values())
+    with pytest.raises(ValueError):
+        batch_sudoku(easy1[:80])
+    assert solve_sudoku('11' + '.' * 79)[0] is None
+
+    results = list(solve_sudokus([easy1, '\n', harder1 + '\n', easy1 + '1', easy1], processes=2, chunksize=2))
+    assert [grid for grid, _, _ in results] == [easy1, harder1, easy1 + '1', easy1]
+    assert results[0][1] == results[3][1] == solution
+    assert results[1][1] == solve_sudoku(harder1)[0]
+    assert results[2][1] is None  # Too many squares, but the batch goes on
+
+    (tmp_path / 'puzzles.txt').write_text(easy1 + '\n' + '11' + '.' * 79 + '\n')
+    solve_sudoku_file(tmp_path / 'puzzles.txt', tmp_path / 'solutions.txt', processes=1)
+    lines = [line.split('\t') for line in (tmp_path / 'solutions.txt').read_text().splitlines()]
+    assert [line[0] for line in lines] == [solution, 'None']
+    assert all(float(line[1]) > 0 for line in lines)
+
+
 def test_make_arc_consistent():
     neighbors = parse_neighbors('A: B; B: ')
     domains = {'A': [0], 'B': [3]}
@@ -586,6 +803,106 @@ def test_assign_value():
     assert assign_value(Xi, Xj, csp, assignment) == 3
 
 
+def test_bit_domain():
+    d = BitDomain('123456789')
+    d.remove('5')
+    d.remove('1')
+    assert len(d) == 7 and d == list('2346789') and d[0] == '2' and '5' not in d
+    e = d[:]
+    d.append('5')
+    assert e == list('2346789') and d == list('23456789')
+    d[:] = ['9']
+    assert d == ['9'] and d
+    with pytest.raises(ValueError):
+        d.remove('5')
+
+    csp = NQueensCSP(8)
+    csp.bitsets = True
+    removals = csp.suppose(0, 2)
+    assert csp.curr_domains[0] == [2] and len(removals) == 7
+    assert forward_checking(csp, 0, 2, {0: 2}, removals)
+    assert csp.curr_domains[1] == [0, 4, 5, 6, 7] and csp.curr_domains[3] == [0, 1, 3, 4, 6, 7]
+    for Xi, Xj in [(1, 3), (3, 1), (1, 2), (2, 2)]:
+        assert csp.unsupported_bits(Xi, Xj) == CSP.unsupported_bits(csp, Xi, Xj)
+    csp.restore(removals)
+    assert all(csp.curr_domains[var] == list(range(8)) for var in csp.variables)
+
+    # Each propagation prunes the same values with either representation
+    for propagation in [AC3, AC3b, AC4]:
+        domains = []
+        for bitsets in [False, True]:
+            csp = NQueensCSP(10)
+            csp.bitsets = bitsets
+            assignment = {}
+            for var, value in [(4, 4), (7, 3)]:
+                csp.assign(var, value, assignment)
+                assert mac(csp, var, value, assignment, csp.suppose(var, value), propagation)[0]
+            domains.append({var: sorted(csp.curr_domains[var]) for var in csp.variables})
+        assert domains[0] == domains[1]
+
+    def ordered(var, assignment, csp):
+        return sorted(csp.choices(var))
+
+    for make in [lambda: NQueensCSP(12), lambda: Sudoku(easy1), lambda: Sudoku(harder1),
+                 lambda: CSP(None, {'A': [0, 1, 2, 3], 'B': [0, 1, 2, 3], 'C': [0, 1, 2, 3]},
+                             parse_neighbors('A: B; B: C'), lambda X, x, Y, y: (x + y) % 2 == 1)]:
+        for inference in [forward_checking, mac]:
+            solutions = []
+            for bitsets in [False, True]:
+                csp = make()
+                csp.bitsets = bitsets
+                random.seed(1)
+                solutions.append(backtracking_search(csp, mrv, ordered, inference))
+            assert solutions[0] == solutions[1] and solutions[0] is not None
+
+
+def test_compile_constraints():
+    cache = {}
+    for make in [lambda: Sudoku(harder1), Zebra, lambda: NQueensCSP(6)]:
+        plain, compiled = make(), make()
+        compiled.compile_constraints(cache)
+        assert compiled.tables[plain.variables[0], first(plain.neighbors[plain.variables[0]])].dtype == bool
+        assignment = {var: first(plain.domains[var]) for var in plain.variables[:10]}
+        for var in plain.variables:
+            for val in plain.domains[var]:
+                assert CSP.nconflicts(compiled, var, val, assignment) == CSP.nconflicts(plain, var, val, assignment)
+        for propagation in [AC3, AC4]:
+            plain, compiled = make(), make()
+            compiled.compile_constraints(cache)
+            assert propagation(plain)[0] == propagation(compiled)[0]
+            assert {v: sorted(plain.curr_domains[v]) for v in plain.variables} == \
+                   {v: sorted(compiled.curr_domains[v]) for v in plain.variables}
+    assert len(cache) < 2 * 81 * 20  # the Sudokus share the tables of most arcs
+    z = Zebra()
+    z.compile_constraints()
+    assert z.table_conflicts['Norwegian', 'Blue'] == 4 and z.table_conflicts['Red', 'Blue'] == 1
+    z.bitsets = True
+    solutions = []
+    for csp in [Zebra(), z]:
+        random.seed(1)
+        solutions.append(backtracking_search(csp, mrv, inference=mac))
+    assert solutions[0] == solutions[1] and solutions[0] is not None
+
+
+def test_parallel_csp_solvers():
+    cubes = csp_cubes(NQueensCSP(6), 10)
+    assert len(cubes) == 20 and all(len(cube) == 2 and cube[0] != cube[1] for cube in cubes)
+    queens = NQueensCSP(12)
+    solution = parallel_backtracking_search(queens, processes=2)
+    assert len(solution) == 12 and all(CSP.nconflicts(queens, var, solution[var], solution) == 0 for var in solution)
+    assert parallel_backtracking_search(NQueensCSP(3), processes=2) is None
+    solution, strategy = portfolio_backtracking_search(Sudoku(easy1), timeout=60)
+    assert Sudoku(easy1).goal_test(solution) and len(strategy) == 3
+    solution = parallel_domain_splitting(csp_crossword, processes=2)  # It has two solutions
+    assert len(solution) == len(csp_crossword.variables) and csp_crossword.consistent(solution)
+    queens = NQueensCSP(4)
+    queens.support_pruning()
+    assert solve_cube(queens, mrv, unordered_domain_values, forward_checking, {0: 0}) is None
+    assert solve_cube(queens, mrv, unordered_domain_values, forward_checking, {0: 1})[0] == 1
+    assert first_solution(abs, [0, 0, -3, 4], processes=2) in [(2, 3), (3, 4)]
+    assert first_solution(abs, [0, 0], processes=2) == (None, None)
+
+
 def test_no_inference():
     neighbors = parse_neighbors('A: B; B: ')
     domains = {'A': [0, 1, 2, 3, 4], 'B': [0, 1, 2, 3, 4, 5]}
@@ -39,6 +39,9 @@ def test_best_first_graph_search():
                                                       'Craiova',
                                                       'Pitesti',
                                                       'Bucharest']
+    f = lambda node: node.path_cost + eight_puzzle.h(node)
+    assert (best_first_graph_search(eight_puzzle, f, queue=PriorityQueue).solution() ==
+            best_first_graph_search(eight_puzzle, f).solution())
 
 
 def test_uniform_cost_search():
@@ -75,6 +78,20 @@ def test_bidirectional_search():
     assert bidirectional_search(EightPuzzle((1, 2, 3, 4, 5, 6, 0, 7, 8))) == 2
 
 
+def test_bidirectional_astar_search():
+    assert bidirectional_astar_search(romania_problem).solution() == ['Sibiu', 'Rimnicu', 'Pitesti', 'Bucharest']
+    assert bidirectional_astar_search(GraphProblem('Oradea', 'Neamt', romania_map)).path_cost == \
+           astar_search(GraphProblem('Oradea', 'Neamt', romania_map)).path_cost
+    graph = Graph(dict(A=dict(B=1, C=5), B=dict(C=1), C=dict(D=1)))
+    assert bidirectional_astar_search(GraphProblem('A', 'D', graph)).solution() == ['B', 'C', 'D']
+    assert bidirectional_astar_search(GraphProblem('D', 'A', graph)) is None
+    graph = RandomGraph(list(range(200)), min_links=3)
+    for goal in range(1, 200, 20):
+        problem = GraphProblem(0, goal, graph)
+        assert (getattr(bidirectional_astar_search(problem), 'path_cost', None) ==
+                getattr(astar_search(problem), 'path_cost', None))
+
+
 def test_astar_search():
     assert astar_search(romania_problem).solution() == ['Sibiu', 'Rimnicu', 'Pitesti', 'Bucharest']
     assert astar_search(eight_puzzle).solution() == ['LEFT', 'LEFT', 'UP', 'RIGHT', 'RIGHT', 'DOWN', 'LEFT', 'UP',
@@ -83,6 +100,106 @@ def test_astar_search():
     assert astar_search(n_queens).solution() == [7, 1, 3, 0, 6, 4, 2, 5]
 
 
+def test_csr_graph(tmp_path):
+    graph = CSRGraph.from_graph(romania_map)
+    ids = {name: i for i, name in enumerate(graph.names)}
+    assert graph.nodes() == list(range(20))
+    assert graph.get(ids['Arad']) == {ids['Sibiu']: 140, ids['Timisoara']: 118, ids['Zerind']: 75}
+    assert graph.get(ids['Arad'], ids['Sibiu']) == 140 and graph.get(ids['Arad'], ids['Bucharest']) is None
+    problem = GraphProblem(ids['Arad'], ids['Bucharest'], graph)
+    assert problem.find_min_edge() == 70
+    assert [graph.names[i] for i in astar_search(problem).solution()] == ['Sibiu', 'Rimnicu', 'Pitesti', 'Bucharest']
+    assert uniform_cost_search(problem).path_cost == 418
+    graph = CSRGraph.from_edges([0, 1, 0], [1, 2, 1], [5, 2, 1], coordinates=[(0, 0), (1, 0), (2, 0)],
+                                directed=False)
+    assert graph.get(1) == {0: 1, 2: 2} and dict(graph.graph_dict) == {0: {1: 1}, 1: {0: 1, 2: 2}, 2: {1: 2}}
+    assert GraphProblem(0, 2, graph).h(Node(0)) == 2
+    path = tmp_path / 'edges.txt'
+    path.write_text('0 1 1.5\n1 2 2\n2 0 1\n')
+    graph = CSRGraph.load_edge_list(str(path))
+    assert graph.get(0) == {1: 1.5} and astar_search(GraphProblem(2, 1, graph)).path_cost == 2.5
+
+
+def test_route_index(tmp_path):
+    index = RouteIndex(romania_map, landmarks=4, contract=True)
+    problem = index.problem('Arad', 'Bucharest')
+    assert index.h('Arad', 'Bucharest') <= 418 and problem.h(Node('Bucharest')) == 0
+    assert astar_search(problem).solution() == ['Sibiu', 'Rimnicu', 'Pitesti', 'Bucharest']
+    assert index.search('Arad', 'Bucharest').solution() == ['Sibiu', 'Rimnicu', 'Pitesti', 'Bucharest']
+    assert index.distance('Arad', 'Arad') == 0
+    graph = Graph(dict(A=dict(B=1, C=5), B=dict(C=1), C=dict(D=1), E=dict(A=1)))
+    index = RouteIndex(graph, contract=True)
+    assert index.search('A', 'D').solution() == ['B', 'C', 'D'] and index.distance('D', 'A') == np.inf
+    assert index.search('D', 'A') is None
+    graph = RandomGraph(list(range(200)), min_links=3)
+    RouteIndex(graph, contract=True).save(str(tmp_path / 'index.npz'))
+    index = RouteIndex.load(str(tmp_path / 'index.npz'), graph)
+    for goal in range(1, 200, 20):
+        expected = getattr(uniform_cost_search(GraphProblem(0, goal, graph)), 'path_cost', np.inf)
+        assert index.distance(0, goal) == pytest.approx(expected)
+        assert index.h(0, goal) <= expected + 1e-9
+
+
+def test_state_key():
+    class KeyedProblem(GraphProblem):
+        def state_key(self, state):
+            return state.lower().encode()
+
+    problem = KeyedProblem('Arad', 'Bucharest', romania_map)
+    for searcher in [breadth_first_graph_search, depth_first_graph_search, uniform_cost_search, astar_search]:
+        assert searcher(problem).solution() == searcher(romania_problem).solution()
+    assert InstrumentedProblem(problem).state_key('Arad') == b'arad'
+    assert astar_search(eight_puzzle).solution() == astar_search(InstrumentedProblem(eight_puzzle)).solution()
+
+
+def test_compact_node():
+    node = astar_search(eight_puzzle, node_type=CompactNode)
+    assert node.solution(eight_puzzle) == astar_search(eight_puzzle).solution()
+    assert node.depth == 12 and node.f == 12
+    assert not hasattr(node, 'action')
+    with pytest.raises(ValueError):
+        node.solution()
+    with pytest.raises(AttributeError):
+        Node('Arad').g = 0
+
+
+def test_npuzzle():
+    puzzle = NPuzzle((5, 2, 8, 4, 1, 7, 0, 3, 6))
+    assert puzzle.actions(puzzle.initial) == ['UP', 'RIGHT']
+    assert puzzle.h(Node(puzzle.initial)) == 14
+    assert not puzzle.check_solvability((2, 1, 3, 4, 5, 6, 7, 8, 0))
+    assert len(astar_search(puzzle).solution()) == 22
+    fifteen = NPuzzle((1, 2, 3, 4, 5, 6, 0, 8, 9, 10, 7, 11, 13, 14, 15, 12))
+    assert fifteen.check_solvability(fifteen.initial)
+    assert astar_search(fifteen).solution() == ['DOWN', 'RIGHT', 'DOWN']
+
+
+def test_h_batch():
+    puzzle = NPuzzle((2, 7, 11, 5, 13, 0, 9, 4, 14, 1, 8, 6, 10, 3, 12, 15))
+    nodes = Node(puzzle.initial).expand(puzzle) + [Node(puzzle.goal)]
+    assert puzzle.h_batch(nodes) == [puzzle.h(node) for node in nodes]
+    puzzle = NPuzzle((8, 6, 7, 2, 5, 4, 3, 0, 1))
+    node = astar_search(InstrumentedProblem(puzzle))
+    assert node.path_cost == astar_search(puzzle, puzzle.h).path_cost == 31
+    assert node.h == 0 and NPuzzle(puzzle.initial, h=puzzle.h).h_batch is None
+
+
+def test_pattern_databases(tmp_path):
+    puzzle = NPuzzle((5, 2, 8, 4, 1, 7, 0, 3, 6))
+    pdb = PatternDatabases(puzzle.goal, directory=str(tmp_path))
+    assert [db.pattern for db in pdb.databases] == [(1, 2, 3, 4, 5), (6, 7, 8)]
+    assert pdb(Node(puzzle.goal)) == 0
+    assert puzzle.h(Node(puzzle.initial)) <= pdb(Node(puzzle.initial)) <= 22
+    assert len(astar_search(puzzle, h=pdb).solution()) == 22
+    loaded = PatternDatabases(puzzle.goal, directory=str(tmp_path))
+    assert isinstance(loaded.databases[0].table, np.memmap)
+    assert loaded(Node(puzzle.initial)) == pdb(Node(puzzle.initial))
+    goal = tuple(range(1, 16)) + (0,)
+    fifteen = NPuzzle((1, 2, 3, 4, 5, 6, 0, 8, 9, 10, 7, 11, 13, 14, 15, 12),
+                      h=PatternDatabases(goal, [(1, 2, 3), (7, 11, 12), (4, 8, 15)]))
+    assert astar_search(fifteen).solution() == ['DOWN', 'RIGHT', 'DOWN']
+
+
 def test_find_blank_square():
     assert eight_puzzle.find_blank_square((0, 1, 2, 3, 4, 5, 6, 7, 8)) == 0
     assert eight_puzzle.find_blank_square((6, 3, 5, 1, 8, 4, 2, 0, 7)) == 7
@@ -182,6 +299,27 @@ def test_recursive_best_first_search():
                'LEFT', 'UP', 'UP', 'LEFT', 'DOWN', 'RIGHT', 'DOWN', 'UP', 'DOWN', 'RIGHT']
 
 
+def test_ida_star_search():
+    assert ida_star_search(romania_problem).solution() == ['Sibiu', 'Rimnicu', 'Pitesti', 'Bucharest']
+    assert len(ida_star_search(eight_puzzle).solution()) == 12
+    problem = InstrumentedProblem(EightPuzzle((5, 2, 8, 4, 1, 7, 0, 3, 6)))
+    assert len(ida_star_search(problem).solution()) == 22
+    assert 22 < problem.peak_nodes < 100
+    assert ida_star_search(GraphProblem('A', 'D', Graph(dict(A=dict(B=1), C=dict(D=1))))) is None
+
+
+def test_sma_star_search():
+    assert sma_star_search(romania_problem).solution() == ['Sibiu', 'Rimnicu', 'Pitesti', 'Bucharest']
+    assert sma_star_search(romania_problem, max_nodes=6).solution() == ['Sibiu', 'Rimnicu', 'Pitesti', 'Bucharest']
+    problem = InstrumentedProblem(eight_puzzle)
+    assert len(sma_star_search(problem, max_nodes=40).solution()) == 12
+    assert problem.peak_nodes == 40
+    problem = InstrumentedProblem(eight_puzzle)
+    astar_search(problem)
+    assert problem.peak_nodes > 40
+    assert sma_star_search(GraphProblem('A', 'D', Graph(dict(A=dict(B=1), C=dict(D=1))))) is None
+
+
 def test_hill_climbing():
     prob = PeakFindingProblem((0, 0), [[0, 5, 10, 20],
                                        [-3, 7, 11, 5]])
@@ -196,6 +334,28 @@ def test_hill_climbing():
     assert hill_climbing(prob) == (1, 3)
 
 
+def test_search_events():
+    events = list(best_first_graph_search_events(romania_problem, lambda node: node.path_cost))
+    assert [e['expanded'] for e in events[:-1]] == list(range(1, len(events)))
+    assert all(a['f'] <= b['f'] for a, b in zip(events, events[1:-1]))
+    assert events[-1]['done'] and events[-1]['solution'].path_cost == 418
+    events = list(recursive_best_first_search_events(eight_puzzle, interval=5))
+    assert all(e['expanded'] % 5 == 0 for e in events[:-1])
+    assert events[-1]['solution'].solution() == recursive_best_first_search(eight_puzzle).solution()
+    prob = PeakFindingProblem((0, 0), [[0, 5, 10, 20], [-3, 7, 11, 5]])
+    events = list(hill_climbing_events(prob))
+    assert [e['value'] for e in events] == [0, 5, 10, 20] and events[-1]['solution'] == (0, 3)
+    events = list(anytime_weighted_astar_search(eight_puzzle, weight=3, interval=0))
+    costs = [e['cost'] for e in events]
+    assert costs[:-1] == sorted(set(costs), reverse=True) and costs[-1] == costs[-2]
+    assert events[-1]['done'] and costs[-1] == astar_search(eight_puzzle).path_cost
+    events = anytime_weighted_astar_search(eight_puzzle, interval=1)
+    solution, event = search_until(events, max_events=3)
+    assert solution is None and event['expanded'] == 3 and events.gi_frame is None
+    solution, event = search_until(anytime_weighted_astar_search(eight_puzzle), seconds=10)
+    assert event['done'] and solution.path_cost == 12
+
+
 def test_simulated_annealing():
     prob = PeakFindingProblem((0, 0), [[0, 5, 10, 20],
                                        [-3, 7, 11, 5]], directions4)
@@ -208,6 +368,31 @@ def test_simulated_annealing():
     assert max(sols) == 999
 
 
+def test_local_search_variants():
+    grid = [[0, 5, 10, 8],
+            [-3, 7, 9, 999],
+            [1, 2, 5, 11]]
+    prob = PeakFindingProblem((0, 0), grid, directions4)
+    assert {prob.random_action((0, 0)) for _ in range(50)} == set(prob.actions((0, 0)))
+    assert PeakFindingProblem((0, 0), [[1]]).random_action((0, 0)) is None
+    assert hill_climbing(prob) == (0, 2)
+    assert hill_climbing(prob, (2, 0)) == (1, 3)
+    assert random_restart_hill_climbing(prob, lambda: (2, 0), restarts=1) == (1, 3)
+    assert tabu_search(prob, tabu_size=5, max_steps=20) == (1, 3)
+    assert prob.value(parallel_tempering(prob, temperatures=(1, 10, 100), steps=200)) == 999
+    assert prob.value(parallel_tempering(prob, temperatures=(1, 10, 100), steps=200, processes=2)) == 999
+
+
+def test_nqueens_local_search_problem():
+    prob = NQueensLocalSearchProblem(4, (0, 1, 2, 3))
+    assert prob.value(prob.initial) == -6
+    assert len(prob.actions(prob.initial)) == 12
+    assert prob.random_action(prob.initial) in prob.actions(prob.initial)
+    assert prob.goal_test((1, 3, 0, 2))
+    prob = NQueensLocalSearchProblem(8)
+    assert prob.goal_test(tabu_search(prob, tabu_size=10, max_steps=500))
+
+
 def test_BoggleFinder():
     board = list('SARTELNID')
     """
@@ -220,6 +405,34 @@ def test_BoggleFinder():
     assert len(f) == 206
 
 
+def test_dawg(tmp_path):
+    words = ['sat', 'sate', 'rate', 'rates', 'tea', 'tear', 'at', 'quit', 'quite', 'eat', 'eats']
+    dawg = Dawg.from_words(words)
+    assert len(dawg) == 10 and 'TEAR' in dawg and 'tea' in dawg and 'AT' not in dawg and 'TE' not in dawg
+    assert dawg.walk('RAT') and dawg.walk('RAX') is None
+    odd = Dawg.from_words(["don't", 'dont', 'caf\xe9', 'a-z'])
+    assert len(odd) == 1 and 'DONT' in odd and 'DONBT' not in odd and "don't" not in odd
+    assert odd.walk("DON'") is None and odd.walk('caf\xe9') is None
+    assert len(dawg.table) < sum(map(len, words)) // 2  # prefixes and suffixes are shared
+    board = list('SAT'
+                 'EQR'
+                 'ITZ')
+    finder = BoggleFinder(board, dawg)
+    assert sorted(finder.words()) == ['EAT', 'QUIT', 'QUITE', 'SAT', 'TEA', 'TEAR']
+    assert finder.score() == 4 and len(finder) == 6
+    # As before the DAWG, a word is not counted if it fills in its last square's neighbors
+    assert BoggleFinder(list('CAST'), Dawg.from_words(['cat', 'cats'])).words() == ['CAT']
+    dawg.save(str(tmp_path / 'words.npy'))
+    loaded = Dawg.load(str(tmp_path / 'words.npy'))
+    assert loaded.board_words(board) == dawg.board_words(board)
+    boards = [board, list('RATESZZZZ'), list('ZZZZ')]
+    assert score_boggle_boards(boards, loaded, processes=1) == [(6, 4), (3, 1), (0, 0)]
+    assert score_boggle_boards(boards, loaded, processes=2) == [(6, 4), (3, 1), (0, 0)]
+    board, best = boggle_hill_climbing(list('ZZZZZZZZZ'), ntimes=5, verbose=False, batch=4, processes=1,
+                                       dawg=dawg)
+    assert best == len(BoggleFinder(board, dawg))
+
+
 def test_and_or_graph_search():
     def run_plan(state, problem, plan):
         if problem.goal_test(state):
@@ -256,6 +469,31 @@ def test_LRTAStarAgent():
     assert lrta_agent('State_5') is None
 
 
+def test_online_agent_stores(tmp_path):
+    assert run_online_trials(LRTA_problem, LRTAStarAgent(LRTA_problem), 3) == [4, 2, 2]
+    ids = {state: i for i, state in enumerate(one_dim_state_space.nodes())}
+    agent = LRTAStarAgent(LRTA_problem, ArrayStore(ids))
+    assert run_online_trials(LRTA_problem, agent, 1) == [4]
+    assert dict(agent.H) == {'State_3': 5, 'State_4': 4} and 'State_5' not in agent.H
+    warm = agent.snapshot()
+    fresh = LRTAStarAgent(LRTA_problem, ArrayStore(ids))
+    fresh.restore(warm)
+    assert run_online_trials(LRTA_problem, fresh, 1) == [2]
+    path = str(tmp_path / 'H')
+    agent = LRTAStarAgent(LRTA_problem, ShelfStore(path))
+    assert run_online_trials(LRTA_problem, agent, 1) == [4]
+    agent.H.close()
+    agent = LRTAStarAgent(LRTA_problem, ShelfStore(path))
+    assert run_online_trials(LRTA_problem, agent, 1) == [2] and len(agent.H) == 2
+    store = DictStore({('s', 'a'): ['x']})
+    snapshot = store.snapshot()
+    store[('s', 'a')].append('y')
+    store.restore(snapshot)
+    assert dict(store) == {('s', 'a'): ['x']}
+    odfs_agent = OnlineDFSAgent(LRTA_problem, untried=store)
+    assert set(odfs_agent('State_3')) == {'Right', 'Left'} and 'State_3' not in store
+
+
 def test_genetic_algorithm():
     # Graph coloring
     edges = {'A': [0, 1],
@@ -297,6 +535,48 @@ def test_genetic_algorithm():
     assert fitness(solution) >= 25
 
 
+def test_vectorized_genetic_algorithm():
+    edges = [(0, 1), (0, 3), (1, 2), (2, 3)]
+
+    def fitness(c):
+        return sum(c[n1] != c[n2] for (n1, n2) in edges)
+
+    population = init_population(8, ['R', 'G'], 4)
+    solution, generation = vectorized_genetic_algorithm(population, fitness, gene_pool=['R', 'G'], f_thres=4)
+    assert solution in (['R', 'G', 'R', 'G'], ['G', 'R', 'G', 'R']) and generation >= 0
+
+    def batch_fitness(q):
+        rows, cols = np.triu_indices(q.shape[1], 1)
+        attacking = (q[:, rows] == q[:, cols]) | (np.abs(q[:, rows] - q[:, cols]) == cols - rows)
+        return len(rows) - attacking.sum(axis=1)
+
+    population = init_population(500, range(8), 8)
+    solution, generation = vectorized_genetic_algorithm(population, batch_fitness, gene_pool=range(8),
+                                                        f_thres=27, batched=True)
+    assert batch_fitness(np.array([solution]))[0] >= 27
+
+
+def test_island_genetic_algorithm():
+    edges = [(0, 1), (0, 3), (1, 2), (2, 3)]
+
+    def fitness(c):
+        return sum(c[n1] != c[n2] for (n1, n2) in edges)
+
+    population = init_population(40, ['R', 'G'], 4)
+    events = list(island_genetic_algorithm(population, fitness, gene_pool=['R', 'G'], ngen=6, islands=2,
+                                           migration_interval=3, migrants=1, topology='full'))
+    assert len([e for e in events if 'island' in e]) == 12
+    assert [e['migration'] for e in events if 'migration' in e] == [(0, 1), (1, 0)]
+    assert events[-1]['solution'] in (['R', 'G', 'R', 'G'], ['G', 'R', 'G', 'R'])
+    assert events[-1]['fitness'] == 4
+
+    # Stop once an island reaches f_thres, even on the last generation of an interval
+    events = list(island_genetic_algorithm(population, fitness, gene_pool=['R', 'G'], f_thres=1, ngen=6,
+                                           islands=2, migration_interval=1))
+    assert not [e for e in events if 'migration' in e]
+    assert events[-1]['generation'] == 1 and events[-1]['fitness'] >= 1
+
+
 def GA_GraphColoringChars(edges, fitness):
     gene_pool = ['R', 'G']
     population = init_population(8, gene_pool, 4)
@@ -317,6 +597,26 @@ def GA_GraphColoringInts(edges, fitness):
     return genetic_algorithm(population, fitness)
 
 
+def sleepy_search(problem):
+    time.sleep(30)
+
+
+def test_run_search_portfolio(tmp_path):
+    problems = [romania_problem, eight_puzzle]
+    results = run_search_portfolio(problems, [astar_search, ida_star_search, sleepy_search],
+                                   processes=4, timeout=1, csv_path=str(tmp_path / 'results.csv'),
+                                   json_path=str(tmp_path / 'results.json'))
+    assert [(r['searcher'], r['status']) for r in results] == [
+        ('astar_search', 'solved'), ('astar_search', 'solved'),
+        ('ida_star_search', 'solved'), ('ida_star_search', 'solved'),
+        ('sleepy_search', 'timeout'), ('sleepy_search', 'timeout')]
+    assert results[0]['path_cost'] == 418 and results[1]['path_cost'] == 12
+    assert results[0]['succs'] == 5 and results[0]['peak_rss_kb'] > 0
+    assert json.load(open(str(tmp_path / 'results.json'))) == results
+    with open(str(tmp_path / 'results.csv')) as f:
+        assert len(list(csv.DictReader(f))) == 6
+
+
 def test_simpleProblemSolvingAgent():
     class vacuumAgent(SimpleProblemSolvingAgentProgram):
         def update_state(self, state, percept):
@@ -299,5 +299,33 @@ def test_priority_queue_with_objects():
     assert len(queue) == 0
 
 
+def test_indexed_priority_queue():
+    queue = IndexedPriorityQueue(f=lambda x: x[1])
+    queue.extend([(1, 100), (2, 30), (3, 50), (5, 70), (6, 20)])
+    assert queue.pop() == (6, 20)
+    assert len(queue) == 4
+    assert queue[(3, 50)] == 50
+    assert (1, 100) in queue
+    del queue[(1, 100)]
+    assert (1, 100) not in queue
+    with pytest.raises(KeyError):
+        del queue[(1, 100)]
+    queue.extend([(1, 100), (4, 10)])
+    assert [queue.pop() for _ in range(len(queue))] == [(4, 10), (2, 30), (3, 50), (5, 70), (1, 100)]
+    queue = IndexedPriorityQueue(order='max', f=lambda x: x[1])
+    queue.extend([(1, 100), (2, 30), (3, 50)])
+    assert queue.pop() == (1, 100)
+    queue = IndexedPriorityQueue(f=lambda x: x[1], key=lambda x: x[0])
+    queue.extend([(1, {}), (2, {}), (1, {})])
+    assert len(queue) == 2 and (2, None) in queue and queue[(1, None)] == {}
+    items = [object() for _ in range(4)]  # hashable, but not orderable
+    queue = IndexedPriorityQueue(f=lambda x: 0)
+    queue.extend(items)
+    assert [queue.pop() for _ in range(len(queue))] == items
+    queue = PriorityQueue(key=abs)
+    queue.extend([3, -2])
+    assert 2 in queue and queue[-3] == 3 and 1 not in queue
+
+
 if __name__ == '__main__':
     pytest.main()
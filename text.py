@@ -414,3 +414,8 @@ class PermutationDecoderProblem(search.Problem):
     def goal_test(self, state):
         """We're done when all letters in search domain are assigned."""
         return len(state) >= len(self.decoder.chardomain)
+
+    def state_key(self, state):
+        """A string of the assigned letter pairs. Every hashabledict has the
+        same hash, so the explored set of the search keys on this instead."""
+        return ''.join(sorted(plain + cipher for plain, cipher in state.items()))
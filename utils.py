@@ -5,6 +5,7 @@ import collections
 import collections.abc
 import functools
 import heapq
+import itertools
 import operator
 import os.path
 import random
@@ -726,9 +727,9 @@ class hashabledict(dict):
 
 
 # ______________________________________________________________________________
-# Queues: Stack, FIFOQueue, PriorityQueue
+# Queues: Stack, FIFOQueue, PriorityQueue, IndexedPriorityQueue
 # Stack and FIFOQueue are implemented as list and collection.deque
-# PriorityQueue is implemented here
+# PriorityQueue and IndexedPriorityQueue are implemented here
 
 
 class PriorityQueue:
@@ -736,10 +737,12 @@ class PriorityQueue:
     order) is returned first.
     If order is 'min', the item with minimum f(x) is
     returned first; if order is 'max', then it is the item with maximum f(x).
-    Also supports dict-like lookup."""
+    Also supports dict-like lookup, in which items with the same key(x) are
+    treated as the same item."""
 
-    def __init__(self, order='min', f=lambda x: x):
+    def __init__(self, order='min', f=lambda x: x, key=lambda x: x):
         self.heap = []
+        self.key = key
         if order == 'min':
             self.f = f
         elif order == 'max':  # now item with max f(x)
@@ -770,25 +773,127 @@ class PriorityQueue:
 
     def __contains__(self, key):
         """Return True if the key is in PriorityQueue."""
-        return any([item == key for _, item in self.heap])
+        k = self.key(key)
+        return any([self.key(item) == k for _, item in self.heap])
 
     def __getitem__(self, key):
         """Returns the first value associated with key in PriorityQueue.
         Raises KeyError if key is not present."""
+        k = self.key(key)
         for value, item in self.heap:
-            if item == key:
+            if self.key(item) == k:
                 return value
         raise KeyError(str(key) + " is not in the priority queue")
 
     def __delitem__(self, key):
         """Delete the first occurrence of key."""
+        k = self.key(key)
         try:
-            del self.heap[[item == key for _, item in self.heap].index(True)]
+            del self.heap[[self.key(item) == k for _, item in self.heap].index(True)]
         except ValueError:
             raise KeyError(str(key) + " is not in the priority queue")
         heapq.heapify(self.heap)
 
 
+class IndexedPriorityQueue(PriorityQueue):
+    """A PriorityQueue that also keeps a map from each item to its position in
+    the heap. Membership and lookup take O(1) time, and deleting an item (so
+    that it can be appended again with a lower f value, i.e. decrease-key)
+    takes O(log n) instead of the linear scan and re-heapify of PriorityQueue.
+    The keys key(x) must be hashable, and appending an item with the same key
+    as one already in the queue replaces the old entry. Heap entries are
+    (f(x), n, key(x), x), where n counts the appends: ties in f go to the
+    item appended first, so neither keys nor items need be comparable."""
+
+    def __init__(self, order='min', f=lambda x: x, key=lambda x: x):
+        super().__init__(order, f, key)
+        self.index = {}
+        self.count = itertools.count()
+
+    def append(self, item):
+        """Insert item at its correct position."""
+        k = self.key(item)
+        if k in self.index:
+            self._remove(self.index[k])
+        self.heap.append((self.f(item), next(self.count), k, item))
+        self.index[k] = len(self.heap) - 1
+        self._sift_up(len(self.heap) - 1)
+
+    def pop(self):
+        """Pop and return the item (with min or max f(x) value)
+        depending on the order."""
+        if not self.heap:
+            raise Exception('Trying to pop from empty PriorityQueue.')
+        return self._remove(0)
+
+    def __contains__(self, key):
+        """Return True if the key is in PriorityQueue."""
+        return self.key(key) in self.index
+
+    def __getitem__(self, key):
+        """Returns the value associated with key in PriorityQueue.
+        Raises KeyError if key is not present."""
+        try:
+            return self.heap[self.index[self.key(key)]][0]
+        except KeyError:
+            raise KeyError(str(key) + " is not in the priority queue")
+
+    def __delitem__(self, key):
+        """Delete the entry of key."""
+        try:
+            i = self.index[self.key(key)]
+        except KeyError:
+            raise KeyError(str(key) + " is not in the priority queue")
+        self._remove(i)
+
+    def _remove(self, i):
+        """Remove the entry at heap position i and return its item."""
+        heap = self.heap
+        _, _, k, item = heap[i]
+        del self.index[k]
+        last = heap.pop()
+        if i < len(heap):
+            heap[i] = last
+            self.index[last[2]] = i
+            self._sift_down(self._sift_up(i))
+        return item
+
+    def _sift_up(self, i):
+        """Move the entry at position i towards the root; return its new position."""
+        heap, index = self.heap, self.index
+        entry = heap[i]
+        while i > 0:
+            parent = (i - 1) >> 1
+            if not entry < heap[parent]:
+                break
+            heap[i] = heap[parent]
+            index[heap[i][2]] = i
+            i = parent
+        heap[i] = entry
+        index[entry[2]] = i
+        return i
+
+    def _sift_down(self, i):
+        """Move the entry at position i towards the leaves; return its new position."""
+        heap, index = self.heap, self.index
+        n = len(heap)
+        entry = heap[i]
+        while True:
+            child = 2 * i + 1
+            if child >= n:
+                break
+            if child + 1 < n and heap[child + 1] < heap[child]:
+                child += 1
+            if not heap[child] < entry:
+                break
+            heap[i] = heap[child]
+            index[heap[i][2]] = i
+            i = child
+        heap[i] = entry
+        index[entry[2]] = i
+        return i
+
+
 # ______________________________________________________________________________
 # Useful Shorthands
 